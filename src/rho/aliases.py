@@ -0,0 +1,66 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Spots the same machine turning up at more than one ip in a scan """
+
+# A host with several interfaces in the scanned ranges shows us the same
+# host key on each of them. Once one of its ips has been inventoried, the
+# others skip the commands and are reported as aliases of it, with its
+# data.
+#
+# Two of a host's ips being scanned at the same time both run the
+# commands, neither has finished to be an alias of. With --processes,
+# each worker process only knows about the hosts it has scanned.
+
+import threading
+
+
+class HostAliases(object):
+
+    def __init__(self):
+        # {host key fingerprint: (ip, {command name: data})}
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def add(self, ssh_job):
+        """ Remember an inventoried host, if it's the first with its key. """
+        if ssh_job.host_key is None or ssh_job.alias_of is not None:
+            return
+        data = {}
+        for rho_cmd in ssh_job.rho_cmds:
+            data[rho_cmd.name] = rho_cmd.data
+        self.lock.acquire()
+        try:
+            if ssh_job.host_key not in self.hosts:
+                self.hosts[ssh_job.host_key] = (ssh_job.ip, data)
+        finally:
+            self.lock.release()
+
+    def fill(self, ssh_job):
+        """
+        If another ip has the job's host key, make the job an alias of it
+        and give it that ip's data. Returns True if it did.
+        """
+        self.lock.acquire()
+        try:
+            host = self.hosts.get(ssh_job.host_key)
+        finally:
+            self.lock.release()
+        if host is None or host[0] == ssh_job.ip:
+            return False
+
+        ip, data = host
+        ssh_job.alias_of = ip
+        for rho_cmd in ssh_job.rho_cmds:
+            if rho_cmd.name in data:
+                rho_cmd.data = dict(data[rho_cmd.name])
+        return True
+
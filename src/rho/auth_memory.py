@@ -0,0 +1,58 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Remembers which credential got into which host between scans """
+
+# Only credential names are kept, never the credentials themselves, keyed
+# by ip and then by the host key's fingerprint. A host that has been
+# reinstalled (new host key) or an ip that now belongs to another machine
+# won't match, and gets the auths in config order like any other.
+
+import state_file
+
+
+class AuthMemory(object):
+
+    def __init__(self, path):
+        self.path = path
+        # {ip: {fingerprint: credential name}}
+        self.hosts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        self.hosts = state_file.load(self.path)
+
+    def save(self):
+        state_file.save(self.path, self.hosts)
+
+    def hints(self, ip):
+        """ {fingerprint: credential name} for ip, for SshJob.auth_hints """
+        return self.hosts.get(ip, {})
+
+    def record(self, ssh_job):
+        """ Count and remember how a finished job got in, if it did. """
+        auth_name = None
+        if ssh_job.connection_result != "FAILED" and ssh_job.auth is not None:
+            auth_name = ssh_job.auth.name
+
+        if ssh_job.auth_hint is not None:
+            if ssh_job.auth_hint == auth_name:
+                self.hits = self.hits + 1
+            else:
+                self.misses = self.misses + 1
+
+        if auth_name is not None and ssh_job.host_key is not None:
+            # only the current host key is worth keeping
+            self.hosts[ssh_job.ip] = {ssh_job.host_key: auth_name}
+
+    def summary(self):
+        return _("%s hits, %s misses") % (self.hits, self.misses)
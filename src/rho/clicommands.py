@@ -13,6 +13,7 @@
 
 import sys
 import os
+import time
 
 import gettext
 t = gettext.translation('rho', 'locale', fallback=True)
@@ -22,14 +23,53 @@ from optparse import OptionParser
 from getpass import getpass
 import simplejson as json
 
+from rho import auth_memory
 from rho import config
 from rho import crypto
+from rho import deadlines
+from rho import fact_cache
+from rho import history
+from rho import journal
+from rho import resolver
+from rho import result_store
+from rho import scan_db
+from rho import retry
+from rho import rho_cmds
+from rho import rho_ips
 from rho import scanner
+from rho import sinks
 from rho import ssh_jobs
 
 
 RHO_PASSPHRASE = "RHO_PASSPHRASE"
 DEFAULT_RHO_CONF = "~/.rho.conf"
+# what rho remembers between scans
+DEFAULT_RHO_STATE_DIR = "~/.rho.d"
+AUTH_MEMORY_FILE = "auths.json"
+HISTORY_FILE = "history.json"
+RESULT_STORE_FILE = "results.json"
+# where scans keep their journals, unless told otherwise
+JOURNAL_DIR = "journals"
+SCAN_DB_FILE = "scans.db"
+FACT_CACHE_FILE = "facts.json"
+
+# suffixes for --max-age
+AGE_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_age(age):
+    """ Seconds in an age like "90", "30m" or "12h", None if it's bad. """
+    seconds = 1
+    if age and age[-1] in AGE_UNITS:
+        seconds = AGE_UNITS[age[-1]]
+        age = age[:-1]
+    try:
+        age = float(age)
+    except ValueError:
+        return None
+    if age < 0:
+        return None
+    return age * seconds
 
 
 
@@ -129,8 +169,89 @@ class ScanCommand(CliCommand):
         self.parser.add_option("--auth", dest="auth", action="append",
                 metavar="AUTH",
                 help=_("auth class name to use"))
-
-        self.parser.set_defaults(ports="22")
+        self.parser.add_option("--engine", dest="engine", type="choice",
+                choices=["events", "threads"],
+                help=_("scan engine to use, 'events' (default) or 'threads'"))
+        self.parser.add_option("--concurrency", dest="concurrency",
+                metavar="CONCURRENCY",
+                help=_("number of hosts to scan at once, or 'auto' to adjust it to how the hosts and network cope"))
+        self.parser.add_option("--processes", dest="processes", type="int",
+                metavar="PROCESSES",
+                help=_("number of processes to split the scan over"))
+        self.parser.add_option("--sweep-timeout", dest="sweep_timeout",
+                type="float", metavar="SECONDS",
+                help=_("check hosts answer on the ssh port first, giving up on them after SECONDS"))
+        self.parser.add_option("--max-attempts", dest="max_attempts",
+                type="int", metavar="ATTEMPTS",
+                help=_("try hosts that look busy up to ATTEMPTS times in all - default is %s") % retry.DEFAULT_MAX_ATTEMPTS)
+        self.parser.add_option("--retry-delay", dest="retry_delay",
+                type="float", metavar="SECONDS",
+                help=_("wait about SECONDS before trying a busy host again, twice that before the next try, and so on - default is %s") % retry.DEFAULT_RETRY_DELAY)
+        self.parser.add_option("--batch", dest="batch", action="store_true",
+                help=_("run all the commands for a host in one ssh command"))
+        self.parser.add_option("--channels", dest="channels", type="int",
+                metavar="CHANNELS",
+                help=_("run up to CHANNELS commands at once on each host (keep this under sshd's MaxSessions) - default is 1"))
+        self.parser.add_option("--resolvers", dest="resolvers", type="int",
+                metavar="THREADS",
+                help=_("look up to THREADS hostnames at once - default is %s") % resolver.DEFAULT_THREADS)
+        for phase in deadlines.PHASES:
+            self.parser.add_option("--%s-timeout" % phase,
+                    dest="%s_timeout" % phase, type="float",
+                    metavar="SECONDS",
+                    help=self._timeout_help(phase))
+        self.parser.add_option("--state-dir", dest="state_dir",
+                metavar="DIR",
+                help=_("directory for what rho remembers between scans - default is %s") % DEFAULT_RHO_STATE_DIR)
+        self.parser.add_option("--no-auth-memory", dest="auth_memory",
+                action="store_false",
+                help=_("don't try the credentials that worked on a host last time first"))
+        self.parser.add_option("--no-history", dest="history",
+                action="store_false",
+                help=_("scan hosts in the order given, not the ones that answered last time first"))
+        self.parser.add_option("--no-aliases", dest="aliases",
+                action="store_false",
+                help=_("inventory every ip, even ones with the same host key as an ip already done"))
+        self.parser.add_option("--no-fact-cache", dest="fact_cache",
+                action="store_false",
+                help=_("run every command on every host, even ones whose answers hardly ever change"))
+        self.parser.add_option("--max-age", dest="max_age", metavar="AGE",
+                help=_("don't scan hosts that were scanned in the last AGE (seconds, or with an s, m, h or d after it), report what was found then"))
+        self.parser.add_option("--journal", dest="journal", metavar="FILE",
+                help=_("write each host to FILE as it's done, and keep it after the scan - default is a file in the state directory, removed once the scan is done"))
+        self.parser.add_option("--resume", dest="resume", metavar="FILE",
+                help=_("carry on with the scan that wrote the journal FILE, skipping the hosts it finished"))
+        self.parser.add_option("--fields", dest="fields", metavar="FIELDS",
+                help=_("report only FIELDS, a comma separated list like ip,uname.os, and only run the commands they need"))
+        self.parser.add_option("--output", dest="output", metavar="FILE",
+                help=_("write each host to FILE as soon as it's done, instead of a report at the end. the hosts aren't kept for a later --max-age unless this scan uses --max-age too"))
+        self.parser.add_option("--output-format", dest="output_format",
+                type="choice", choices=sinks.FORMATS, metavar="FORMAT",
+                help=_("write each host as soon as it's done, as FORMAT (%s) - default is csv with --output") % ", ".join(sinks.FORMATS))
+        self.parser.add_option("--database", dest="database", metavar="FILE",
+                help=_("keep the results of every scan in the SQLite database FILE - default is %s in the state directory") % SCAN_DB_FILE)
+        self.parser.add_option("--no-database", dest="use_database",
+                action="store_false",
+                help=_("don't keep this scan's results in the database"))
+
+        self.parser.set_defaults(ports="22", engine="events", processes=1,
+                                 batch=False, channels=1,
+                                 resolvers=resolver.DEFAULT_THREADS,
+                                 max_attempts=retry.DEFAULT_MAX_ATTEMPTS,
+                                 retry_delay=retry.DEFAULT_RETRY_DELAY,
+                                 state_dir=DEFAULT_RHO_STATE_DIR,
+                                 auth_memory=True, history=True,
+                                 fact_cache=True, aliases=True,
+                                 use_database=True)
+
+    def _timeout_help(self, phase):
+        if phase == deadlines.TOTAL:
+            return _("give up on a host after SECONDS all told - default is no limit")
+        if phase == deadlines.CONNECT:
+            default = deadlines.DEFAULT_CONNECT_TIMEOUT
+        else:
+            default = deadlines.DEFAULT_TIMEOUTS[phase]
+        return _("give up on a host after SECONDS in the %s phase - default is %s") % (phase, default)
 
     def _validate_options(self):
         CliCommand._validate_options(self)
@@ -138,8 +259,128 @@ class ScanCommand(CliCommand):
             self.parser.print_help()
             sys.exit(1)
 
+        if self.options.concurrency and self.options.concurrency != "auto":
+            try:
+                self.options.concurrency = int(self.options.concurrency)
+            except ValueError:
+                self.parser.error(_("--concurrency must be a number or 'auto'"))
+            if self.options.concurrency < 1:
+                self.parser.error(_("--concurrency must be a number or 'auto'"))
+
+        if self.options.processes < 1:
+            self.parser.error(_("--processes must be at least 1"))
+
+        if self.options.sweep_timeout is not None and \
+                self.options.sweep_timeout <= 0:
+            self.parser.error(_("--sweep-timeout must be more than 0"))
+
+        for phase in deadlines.PHASES:
+            seconds = getattr(self.options, "%s_timeout" % phase)
+            if seconds is not None and seconds <= 0:
+                self.parser.error(_("--%s-timeout must be more than 0") % phase)
+
+        if self.options.max_attempts < 1:
+            self.parser.error(_("--max-attempts must be at least 1"))
+
+        if self.options.retry_delay <= 0:
+            self.parser.error(_("--retry-delay must be more than 0"))
+
+        if self.options.channels < 1:
+            self.parser.error(_("--channels must be at least 1"))
+
+        if self.options.resolvers < 1:
+            self.parser.error(_("--resolvers must be at least 1"))
+
+        if self.options.batch and self.options.channels > 1:
+            self.parser.error(_("--batch and --channels can not be used together"))
+
+        if self.options.max_age is not None:
+            self.options.max_age = parse_age(self.options.max_age)
+            if self.options.max_age is None:
+                self.parser.error(_("--max-age must be a number of seconds, or a number with s, m, h or d after it"))
+
+        if self.options.journal and self.options.resume:
+            self.parser.error(_("--journal and --resume can not be used together"))
+        if self.options.resume and not os.path.exists(self.options.resume):
+            self.parser.error(_("No such journal: %s") % self.options.resume)
+
     def _do_command(self):
         self.scanner = scanner.Scanner(config=self.config)
+        self.scanner.ssh_jobs.engine = self.options.engine
+        self.scanner.ssh_jobs.concurrency = self.options.concurrency
+        self.scanner.ssh_jobs.processes = self.options.processes
+        self.scanner.ssh_jobs.sweep_timeout = self.options.sweep_timeout
+        self.scanner.ssh_jobs.max_attempts = self.options.max_attempts
+        self.scanner.ssh_jobs.retry_delay = self.options.retry_delay
+        self.scanner.batch = self.options.batch
+        self.scanner.channels = self.options.channels
+        self.scanner.resolver = resolver.Resolver(
+                threads=self.options.resolvers)
+        for phase in deadlines.PHASES:
+            seconds = getattr(self.options, "%s_timeout" % phase)
+            if seconds is not None:
+                self.scanner.timeouts[phase] = seconds
+
+        state_dir = os.path.expanduser(self.options.state_dir)
+        if self.options.auth_memory:
+            memory = auth_memory.AuthMemory(os.path.join(state_dir,
+                                                         AUTH_MEMORY_FILE))
+            memory.load()
+            self.scanner.auth_memory = memory
+        if self.options.history:
+            host_history = history.HostHistory(os.path.join(state_dir,
+                                                            HISTORY_FILE))
+            host_history.load()
+            self.scanner.history = host_history
+        if self.options.fact_cache:
+            facts = fact_cache.FactCache(os.path.join(state_dir,
+                                                      FACT_CACHE_FILE))
+            facts.load()
+            self.scanner.fact_cache = facts
+        # kept so there's something for the next --max-age. it holds a
+        # row for every host, which a streamed scan is meant not to, so
+        # then only if this scan uses it too.
+        streaming = self.options.output or self.options.output_format
+        if not streaming or self.options.max_age is not None:
+            store = result_store.ResultStore(os.path.join(state_dir,
+                                                          RESULT_STORE_FILE))
+            store.load()
+            self.scanner.result_store = store
+        self.scanner.max_age = self.options.max_age
+        self.scanner.find_aliases = self.options.aliases
+
+        scan_journal = self._open_journal(state_dir)
+        self.scanner.journal = scan_journal
+
+        report = self.scanner.ssh_jobs.report
+        report.mark_timed_out = True
+        if self.options.fields:
+            fields = []
+            for field in self.options.fields.split(","):
+                if field.strip():
+                    fields.append(field.strip())
+            try:
+                self.scanner.set_fields(fields)
+            except rho_cmds.UnknownFieldsError, detail:
+                self.parser.error(str(detail))
+
+        if self.options.use_database:
+            report.sinks.append(scan_db.ScanDatabase(self.options.database or
+                    os.path.join(state_dir, SCAN_DB_FILE)))
+
+        out = None
+        if streaming:
+            out = sys.stdout
+            if self.options.output:
+                out = open(self.options.output, "w")
+            report.keep_rows = False
+            # the scan sets up the source and alias_of columns, too late
+            # for the sink's header
+            report.mark_cached = self.options.max_age is not None
+            report.mark_aliases = self.options.aliases
+            report.sinks.append(sinks.make_sink(
+                self.options.output_format or sinks.CSV, out,
+                report.fields()))
 
         if self.options.auth:
             auths = []
@@ -166,7 +407,11 @@ class ScanCommand(CliCommand):
             # on the command line
             ports = []
             if self.options.ports:
-                ports = self.options.ports.strip().split(",")
+                for port in self.options.ports.strip().split(","):
+                    try:
+                        ports.append(int(port))
+                    except ValueError:
+                        self.parser.error(_("Invalid ssh port: %s") % port)
 
             g = config.Group(name="clioptions", ranges=self.options.ranges,
                          credential_names=self.options.auth, ports=ports)
@@ -180,6 +425,32 @@ class ScanCommand(CliCommand):
                 for name in missing:
                     print name
 
+        try:
+            report.close()
+        except scan_db.DatabaseError, detail:
+            print _("Could not save the results to the database: %s") % detail
+        if out is not None and out is not sys.stdout:
+            out.close()
+
+        if self.options.journal or self.options.resume:
+            scan_journal.close()
+        else:
+            # the scan is done, nothing left to resume
+            scan_journal.remove()
+
+    def _open_journal(self, state_dir):
+        path = self.options.resume or self.options.journal
+        if path is None:
+            path = os.path.join(state_dir, JOURNAL_DIR, "scan-%s-%s.journal" %
+                                (time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+            # so it can be resumed if we don't make it to the end
+            print >> sys.stderr, _("Journal: %s") % path
+        scan_journal = journal.Journal(path)
+        if self.options.resume:
+            scan_journal.load()
+        scan_journal.open()
+        return scan_journal
+
 
 class DumpConfigCommand(CliCommand):
     """
@@ -231,6 +502,45 @@ class ProfileShowCommand(CliCommand):
             # make this a pretty table
             print(g.to_dict())
 
+class ProfileExpandCommand(CliCommand):
+    def __init__(self):
+        usage = _("usage: %prog profile expand [options] PROFILE...")
+        shortdesc = _("list the ips a network profile covers")
+        desc = _("list the ips a network profile covers")
+
+        CliCommand.__init__(self, "profile expand", usage, shortdesc, desc)
+
+        self.parser.add_option("--count", dest="count", action="store_true",
+                help=_("only count the ips of each range"))
+
+        self.parser.set_defaults(count=False)
+
+    def _do_command(self):
+        # the first arg is "expand"
+        names = self.args[1:]
+        if not names:
+            names = [g.name for g in self.config.list_groups()]
+
+        # an ip in more than one range is only scanned once
+        total = rho_ips.IpSet()
+        lookups = resolver.Resolver()
+        for name in names:
+            group = self.config.get_group(name)
+            if group is None:
+                print(_("No such profile: %s") % name)
+                continue
+            for range_str in group.ranges:
+                ipr = rho_ips.RhoIpRange(range_str, lookups)
+                if self.options.count:
+                    print("%s\t%s\t%s" % (name, range_str, len(ipr)))
+                else:
+                    for ip in ipr:
+                        print(ip)
+                total.add_range(ipr)
+
+        if self.options.count:
+            print(_("total: %s") % len(total))
+
 class ProfileClearCommand(CliCommand):
     def __init__(self):
         usage = _("usage: %prog profile clear [--name | --all] [options]")
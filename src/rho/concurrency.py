@@ -0,0 +1,157 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Limits on how many ssh jobs a scan keeps in flight """
+
+import threading
+
+import deadlines
+
+# "auto" concurrency starts here and never goes outside these bounds
+AUTO_INITIAL = 4
+AUTO_MINIMUM = 1
+AUTO_MAXIMUM = 256
+
+# connects slower than this (seconds) stop the limit from growing
+AUTO_LATENCY_TARGET = 5.0
+
+# failures that mean a host (or the network) is getting more than it
+# can take, as opposed to the host just not being there. sshd's
+# MaxStartups shows up as the banner error.
+CONGESTION_ERRORS = [
+    "error reading ssh protocol banner",
+    "timed out",
+    "connection reset by peer",
+]
+
+
+def is_congestion_error(detail):
+    detail = str(detail).lower()
+    for error in CONGESTION_ERRORS:
+        if error in detail:
+            return True
+    return False
+
+
+def is_congestion(ssh_job):
+    """ Did the job fail because the host had more than it could take? """
+    if ssh_job.connection_result != "FAILED":
+        return False
+    if ssh_job.timed_out is not None:
+        # whichever engine waited for it, a banner that never came is
+        # MaxStartups or a full accept queue. the other deadlines are a
+        # host that is slow or not there.
+        return ssh_job.timed_out == deadlines.BANNER
+    return is_congestion_error(ssh_job.command_output)
+
+
+class ConcurrencyLimiter(object):
+    """
+    Counting semaphore for ssh jobs. acquire() before starting a job,
+    release() with the finished job. wait() blocks until nothing is in
+    flight.
+
+    A job that is set aside to be run again later (a retry) can be
+    park()ed before it is released. It doesn't take up a slot while it
+    waits, but wait() waits for it too. It is acquire(parked=True)ed when
+    it's run again.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        # most jobs that can ever be in flight, used to size thread pools
+        self.maximum = limit
+        self.in_use = 0
+        self.parked = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, parked=False):
+        self.cond.acquire()
+        try:
+            while self.in_use >= self.limit:
+                self.cond.wait()
+            self.in_use = self.in_use + 1
+            if parked:
+                self.parked = self.parked - 1
+        finally:
+            self.cond.release()
+
+    def park(self):
+        self.cond.acquire()
+        try:
+            self.parked = self.parked + 1
+        finally:
+            self.cond.release()
+
+    def release(self, ssh_job=None):
+        self.cond.acquire()
+        try:
+            if ssh_job is not None:
+                self._job_finished(ssh_job)
+            self.in_use = self.in_use - 1
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def wait(self):
+        self.cond.acquire()
+        try:
+            while self.in_use or self.parked:
+                self.cond.wait()
+        finally:
+            self.cond.release()
+
+    def _job_finished(self, ssh_job):
+        pass
+
+
+class AimdLimiter(ConcurrencyLimiter):
+    """
+    Limiter that finds its own limit, the same way tcp finds a window.
+
+    It doubles (slow start) until the first congestion error, then grows
+    by one per limit's worth of healthy connects, and halves on banner
+    errors, timeouts and resets. Only one halving happens per window of
+    jobs, since everything that was in flight at the time is likely to
+    fail the same way.
+    """
+
+    def __init__(self, initial=AUTO_INITIAL, minimum=AUTO_MINIMUM,
+                 maximum=AUTO_MAXIMUM, latency_target=AUTO_LATENCY_TARGET):
+        ConcurrencyLimiter.__init__(self, initial)
+        self.window = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        # slow start until we see the first congestion error
+        self.threshold = float(maximum)
+        self.recovering = 0
+
+    def _job_finished(self, ssh_job):
+        if self.recovering:
+            self.recovering = self.recovering - 1
+
+        if is_congestion(ssh_job):
+            if not self.recovering:
+                self.window = max(self.minimum, self.window / 2)
+                self.threshold = self.window
+                self.recovering = self.in_use
+        elif ssh_job.connect_latency is not None and \
+                ssh_job.connect_latency <= self.latency_target:
+            if self.window < self.threshold:
+                self.window = self.window + 1
+            else:
+                self.window = self.window + 1 / self.window
+            self.window = min(self.maximum, self.window)
+        # anything else (refused, auth failures, slow connects) leaves the
+        # limit where it is
+
+        self.limit = int(self.window)
@@ -0,0 +1,184 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Time limits for each phase of an ssh job, and for the job as a whole """
+
+# paramiko has no timeouts of its own for authenticating or for reading a
+# channel, so a host that stops talking would keep its SSHThread forever.
+# Instead an Alarm is set for the phase, and if it goes off the transport
+# (or channel) is closed under whoever is waiting on it, which wakes them
+# up. They then check the alarm and raise DeadlineExceeded.
+
+import heapq
+import threading
+import time
+
+CONNECT = "connect"
+BANNER = "banner"
+AUTH = "auth"
+COMMAND = "command"
+TOTAL = "total"
+
+PHASES = [CONNECT, BANNER, AUTH, COMMAND, TOTAL]
+
+# seconds, None for no limit. the connect limit is SshJob.timeout.
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_TIMEOUTS = {
+    BANNER: 30,
+    AUTH: 30,
+    COMMAND: 300,
+    TOTAL: None,
+}
+
+
+class DeadlineExceeded(Exception):
+
+    def __init__(self, phase):
+        Exception.__init__(self, phase)
+        self.phase = phase
+
+    def __str__(self):
+        # not "timed out", that's a sign of congestion to the limiters
+        return _("%s deadline passed") % self.phase
+
+
+class Watchdog(threading.Thread):
+    """ Calls things when their time is up, all from one thread. """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="Watchdog")
+        self.setDaemon(True)
+        self.alarms = []
+        self.cond = threading.Condition()
+
+    def add(self, alarm):
+        self.cond.acquire()
+        try:
+            heapq.heappush(self.alarms, (alarm.when, alarm))
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while True:
+                    # cancelled ones are dropped as they come up
+                    while self.alarms and self.alarms[0][1].cancelled:
+                        heapq.heappop(self.alarms)
+                    if not self.alarms:
+                        self.cond.wait()
+                        continue
+                    left = self.alarms[0][0] - time.time()
+                    if left <= 0:
+                        break
+                    self.cond.wait(left)
+                when, alarm = heapq.heappop(self.alarms)
+            finally:
+                self.cond.release()
+            alarm.go_off()
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def watchdog():
+    """ The process's Watchdog, started the first time it's needed. """
+    global _watchdog
+    _watchdog_lock.acquire()
+    try:
+        # a forked child gets the object, but not the thread
+        if _watchdog is None or not _watchdog.isAlive():
+            _watchdog = Watchdog()
+            _watchdog.start()
+        return _watchdog
+    finally:
+        _watchdog_lock.release()
+
+
+class Alarm(object):
+    """ Calls close() if it isn't cancelled by 'when'. """
+
+    def __init__(self, when, phase, close):
+        self.when = when
+        self.phase = phase
+        self.close = close
+        self.cancelled = False
+        self.expired = False
+        self.lock = threading.Lock()
+
+    def go_off(self):
+        self.lock.acquire()
+        try:
+            if self.cancelled:
+                return
+            self.expired = True
+        finally:
+            self.lock.release()
+        self.close()
+
+    def cancel(self):
+        self.lock.acquire()
+        try:
+            self.cancelled = True
+        finally:
+            self.lock.release()
+
+    def check(self):
+        """ Raise DeadlineExceeded if the alarm went off. """
+        if self.expired:
+            raise DeadlineExceeded(self.phase)
+
+
+class Deadlines(object):
+    """ Works out what's left of each phase's time limit for an SshJob. """
+
+    def __init__(self, ssh_job):
+        self.ssh_job = ssh_job
+        self.start_time = ssh_job.start_time
+        if self.start_time is None:
+            self.start_time = time.time()
+
+    def limit(self, phase):
+        if phase == CONNECT:
+            return self.ssh_job.timeout
+        return self.ssh_job.timeouts.get(phase)
+
+    def seconds(self, phase, count=1):
+        """
+        (seconds, phase) for the next 'count' lots of phase, the phase
+        being TOTAL if the whole job's limit comes first. seconds is None
+        if there's no limit. Raises DeadlineExceeded if the job is already
+        out of time.
+        """
+        seconds = self.limit(phase)
+        if seconds is not None:
+            seconds = seconds * count
+        total = self.limit(TOTAL)
+        if total is not None:
+            left = self.start_time + total - time.time()
+            if left <= 0:
+                raise DeadlineExceeded(TOTAL)
+            if seconds is None or left < seconds:
+                return (left, TOTAL)
+        return (seconds, phase)
+
+    def alarm(self, phase, close, count=1):
+        """ Set an Alarm to call close() once phase has run out of time. """
+        seconds, phase = self.seconds(phase, count)
+        if seconds is None:
+            # never goes off, but cancel() and check() still work
+            return Alarm(None, phase, close)
+        alarm = Alarm(time.time() + seconds, phase, close)
+        watchdog().add(alarm)
+        return alarm
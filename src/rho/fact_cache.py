@@ -0,0 +1,139 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" The results of RhoCmds that hardly ever change, kept between scans """
+
+# A RhoCmd with a cache_ttl has its data kept here, keyed by the host's
+# key fingerprint and the command's name. Once we're into a host, any
+# such command with fresh data here isn't sent at all. Keying on the host
+# key rather than the ip means a reinstalled host, or an ip that has
+# moved to another machine, doesn't get somebody else's facts.
+#
+# The cache is handed to the SSHThreads, which only read it (scan worker
+# processes get a copy of it when they fork). It's only written by the
+# report's observer, in the process that owns the report.
+
+import threading
+import time
+
+import state_file
+
+
+class FactCache(object):
+
+    def __init__(self, path):
+        self.path = path
+        # {fingerprint: {command name: {"time": when, "ttl": cache_ttl,
+        #                               "data": its data}}}
+        self.hosts = {}
+        self.lock = threading.Lock()
+        # commands not sent because of us
+        self.hits = 0
+
+    def load(self):
+        self.hosts = state_file.load(self.path)
+
+    def save(self, now=None):
+        """ Write the cache out, less anything that's too old to use. """
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            for host_key in self.hosts.keys():
+                host = self.hosts[host_key]
+                for name in host.keys():
+                    entry = host[name]
+                    if "ttl" not in entry or now - entry["time"] > entry["ttl"]:
+                        del host[name]
+                if not host:
+                    del self.hosts[host_key]
+            state_file.save(self.path, self.hosts)
+        finally:
+            self.lock.release()
+
+    def get(self, host_key, rho_cmd, now=None):
+        """ rho_cmd's data for the host, if it's recent enough. """
+        if rho_cmd.cache_ttl is None or host_key is None:
+            return None
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.hosts.get(host_key, {}).get(rho_cmd.name)
+        finally:
+            self.lock.release()
+        if entry is None or now - entry["time"] > rho_cmd.cache_ttl:
+            return None
+        # only what the command gives now, an older rho may have kept more
+        data = {}
+        for field in rho_cmd.fields:
+            if field in entry["data"]:
+                data[field] = entry["data"][field]
+        if not data:
+            return None
+        return data
+
+    def fill(self, ssh_job, now=None):
+        """
+        Fill in the data of ssh_job's commands that we have fresh data
+        for. Returns the ones that still need running.
+        """
+        to_run = []
+        for rho_cmd in ssh_job.rho_cmds:
+            data = self.get(ssh_job.host_key, rho_cmd, now)
+            if data is None:
+                to_run.append(rho_cmd)
+            else:
+                rho_cmd.data = data
+                rho_cmd.from_cache = True
+        return to_run
+
+    def record(self, ssh_job, now=None):
+        """ Keep what a finished job's cacheable commands found. """
+        if ssh_job.connection_result == "FAILED" or ssh_job.auth is None:
+            return
+        if ssh_job.host_key is None:
+            return
+        if ssh_job.alias_of is not None:
+            # the data is another job's, whatever it was from
+            return
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            for rho_cmd in ssh_job.rho_cmds:
+                if rho_cmd.from_cache:
+                    self.hits = self.hits + 1
+                elif rho_cmd.cache_ttl is not None:
+                    data = _found(rho_cmd)
+                    if data is None:
+                        continue
+                    host = self.hosts.setdefault(ssh_job.host_key, {})
+                    host[rho_cmd.name] = {"time": now,
+                                          "ttl": rho_cmd.cache_ttl,
+                                          "data": data}
+        finally:
+            self.lock.release()
+
+
+def _found(rho_cmd):
+    """
+    rho_cmd's fields, or None if it didn't get them all. A command that
+    failed is run again next time rather than its error being kept.
+    """
+    data = {}
+    for field in rho_cmd.fields:
+        value = rho_cmd.data.get(field)
+        if value is None or value == "error":
+            return None
+        data[field] = value
+    return data
+
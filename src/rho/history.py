@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" What earlier scans saw of each host, used to pick what to scan first """
+
+# Jobs used to go out in the order the ranges listed them, so a mostly
+# dark range filled every slot with connects that would never finish
+# while the hosts we could actually inventory waited. With a history,
+# a scan goes:
+#
+#   1. hosts we got into recently, quickest first
+#   2. everything else, in range order
+#   3. hosts that haven't answered at all for a long time
+#
+# Only 1 and 3 are held in memory, and they're no bigger than the history
+# itself. That takes two goes through the ranges, which is cheap next to
+# the scan.
+
+import time
+
+import state_file
+
+# got into it this recently (seconds), it goes first
+RECENT = 30 * 24 * 60 * 60
+# nothing from it for this long (seconds), it goes last
+LONG_DEAD = 7 * 24 * 60 * 60
+
+GOOD = 0
+UNKNOWN = 1
+DEAD = 2
+
+
+class HostHistory(object):
+
+    def __init__(self, path):
+        self.path = path
+        # {ip: {"ok": when we last got in, "duration": how long that took,
+        #       "down": since when it hasn't answered}}
+        self.hosts = {}
+
+    def load(self):
+        self.hosts = state_file.load(self.path)
+
+    def save(self):
+        state_file.save(self.path, self.hosts)
+
+    def record(self, ssh_job, now=None):
+        """ Note how a finished job went. """
+        if now is None:
+            now = time.time()
+        host = self.hosts.setdefault(ssh_job.ip, {})
+
+        if ssh_job.connection_result != "FAILED" and ssh_job.auth is not None:
+            host["ok"] = now
+            if ssh_job.start_time is not None:
+                host["duration"] = now - ssh_job.start_time
+            host.pop("down", None)
+        elif ssh_job.host_key is None:
+            # not so much as a key exchange. keep when this started.
+            host.setdefault("down", now)
+        else:
+            # it's there, we just couldn't get in
+            host.pop("down", None)
+
+    def rank(self, ip, now=None):
+        if now is None:
+            now = time.time()
+        host = self.hosts.get(ip)
+        if host is None:
+            return UNKNOWN
+        if now - host.get("ok", 0) <= RECENT:
+            return GOOD
+        if "down" in host and now - host["down"] >= LONG_DEAD:
+            return DEAD
+        return UNKNOWN
+
+    def order(self, ips, now=None):
+        """
+        Yield the ips from ips(), a function returning a new iterator over
+        the same ips each time it's called, best bets first.
+        """
+        if now is None:
+            now = time.time()
+
+        good = []
+        for ip in ips():
+            if self.rank(ip, now) == GOOD:
+                duration = self.hosts[ip].get("duration")
+                # ones we don't have a time for after the rest, None
+                # would sort first
+                good.append((duration is None, duration, ip))
+        good.sort()
+        for unknown, duration, ip in good:
+            yield ip
+        # don't hang on to them
+        good = None
+
+        dead = []
+        for ip in ips():
+            rank = self.rank(ip, now)
+            if rank == UNKNOWN:
+                yield ip
+            elif rank == DEAD:
+                dead.append(ip)
+
+        for ip in dead:
+            yield ip
@@ -0,0 +1,104 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" An on-disk record of every host a scan has finished, for scan --resume """
+
+# One line of JSON per host, {"ip": ..., "row": report row or null if we
+# couldn't get in}, each one synced to disk before the next is written,
+# so a scan that dies (kill -9, a crash, the power) loses at most the
+# host it was writing. A torn last line is skipped when the journal is
+# read back.
+#
+# Only the ips of the hosts an earlier run finished are kept in memory,
+# their rows are read back from the file when the scan is resumed.
+
+import os
+import threading
+
+import simplejson as json
+
+import result_store
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        # ips of the hosts finished by the run we're resuming
+        self.done = set()
+        self.file = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        for ip, row in self.rows():
+            self.done.add(ip)
+
+    def rows(self):
+        """
+        (ip, report row or None) for each host in the file, read as
+        they're asked for.
+        """
+        if not os.path.exists(self.path):
+            return
+        f = open(self.path)
+        try:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # cut short when we died
+                    continue
+                yield (entry["ip"], entry["row"])
+        finally:
+            f.close()
+
+    def open(self):
+        """ Open for writing, after whatever's there already. """
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname, 0700)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0600)
+        self.file = os.fdopen(fd, "a")
+        # don't run on from a torn line
+        if os.path.getsize(self.path) > 0:
+            f = open(self.path)
+            try:
+                f.seek(-1, 2)
+                if f.read(1) != "\n":
+                    self._append("\n")
+            finally:
+                f.close()
+
+    def _append(self, text):
+        self.file.write(text)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write(self, ip, row):
+        """ Record that ip is done, with its report row if we got in. """
+        if row is not None:
+            row = result_store.public_row(row)
+        line = json.dumps({"ip": ip, "row": row})
+        self.lock.acquire()
+        try:
+            self._append(line + "\n")
+        finally:
+            self.lock.release()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
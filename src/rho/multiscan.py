@@ -0,0 +1,233 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Spread the ssh jobs of a scan over several processes """
+
+# paramiko's key exchange and ciphers, and the RhoCmd parsing, all want
+# the GIL, so one rho process tops out at one core no matter how many
+# threads it has. Here each worker process runs a normal SshJobs of its
+# own, pulling jobs off a shared queue, and sends every finished job back
+# to the parent, which feeds them to its OutputThread like any other.
+#
+# A worker that dies (killed, out of memory) takes the jobs it had with
+# it. The parent keeps every job it has handed out until it comes back,
+# and reports the ones that never do as failed. Each worker gets its jobs
+# on a queue of its own: one killed while waiting in get() would still
+# hold a shared queue's lock, and the others could never get another job.
+
+import multiprocessing
+import Queue
+import threading
+
+from Crypto import Random
+
+import ssh_jobs
+
+# jobs waiting for a worker, per worker process
+JOBS_PER_PROCESS = 64
+
+# seconds between checks that the workers are still alive
+POLL_INTERVAL = 1.0
+
+JOB = "job"
+SUMMARY = "summary"
+DONE = "done"
+
+
+class ShardReport(object):
+    """ Stands in for ScanReport in a worker, sends everything home. """
+
+    def __init__(self, result_queue, name):
+        self.result_queue = result_queue
+        self.name = name
+
+    def add(self, ssh_job):
+        # sockets don't pickle, and are closed by now anyway
+        ssh_job.sock = None
+        self.result_queue.put((JOB, ssh_job))
+
+    def set_summary(self, name, value):
+        # every worker has its own, keep them apart
+        self.result_queue.put((SUMMARY, ("%s (%s)" % (name, self.name), value)))
+
+
+def _iter_jobs(job_queue):
+    while True:
+        ssh_job = job_queue.get()
+        if ssh_job is None:
+            return
+        yield ssh_job
+
+
+def run_worker(job_queue, result_queue, settings):
+    """ Body of a worker process, settings is from SshJobs.settings() """
+    # paramiko only does this once its transport thread is already
+    # running, which is too late for the first key exchange
+    Random.atfork()
+    try:
+        jobs = ssh_jobs.SshJobs()
+        for name, value in settings.items():
+            setattr(jobs, name, value)
+        jobs.report = ShardReport(result_queue,
+                                  multiprocessing.current_process().name)
+
+        out_queue = jobs.run_jobs(ssh_jobs=_iter_jobs(job_queue))
+        out_queue.join()
+    finally:
+        # the parent waits for one of these from every worker
+        result_queue.put((DONE, multiprocessing.current_process().name))
+
+
+class JobFeeder(threading.Thread):
+    """
+    Hands the jobs out to the live workers, remembering each one in
+    outstanding until it comes back. Once stop() is called, or the workers
+    are all dead, the rest of the jobs only go in outstanding, there's no
+    one left to run them.
+
+    workers is a list of (multiprocessing.Process, its job queue).
+    """
+
+    def __init__(self, workers, jobs):
+        threading.Thread.__init__(self, name="ShardFeeder")
+        self.setDaemon(True)
+        self.workers = workers
+        self.jobs = jobs
+        # round robin, from here
+        self.next = 0
+        # {shard_seq: ssh_job}
+        self.outstanding = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def returned(self, ssh_job):
+        self.lock.acquire()
+        try:
+            self.outstanding.pop(ssh_job.shard_seq, None)
+        finally:
+            self.lock.release()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        seq = 0
+        for ssh_job in self.jobs:
+            seq = seq + 1
+            ssh_job.shard_seq = seq
+            self.lock.acquire()
+            try:
+                self.outstanding[seq] = ssh_job
+            finally:
+                self.lock.release()
+            self._put(ssh_job)
+        for worker, job_queue in self.workers:
+            while not self.stopping.isSet() and worker.is_alive():
+                try:
+                    job_queue.put(None, True, POLL_INTERVAL)
+                    break
+                except Queue.Full:
+                    pass
+
+    def _put(self, ssh_job):
+        while not self.stopping.isSet():
+            live = [(worker, job_queue) for worker, job_queue in self.workers
+                    if worker.is_alive()]
+            if not live:
+                self.stop()
+                return
+            # the first with room, then wait a little on the next in line
+            for i in range(len(live)):
+                worker, job_queue = live[(self.next + i) % len(live)]
+                try:
+                    job_queue.put_nowait(ssh_job)
+                    self.next = self.next + i + 1
+                    return
+                except Queue.Full:
+                    pass
+            try:
+                live[self.next % len(live)][1].put(ssh_job, True, 0.1)
+                self.next = self.next + 1
+                return
+            except Queue.Full:
+                pass
+
+
+def run_jobs(jobs, output_queue, report, processes, settings):
+    """
+    Run the ssh jobs from the 'jobs' iterator in 'processes' worker
+    processes, each an SshJobs with the given settings (see
+    SshJobs.settings()). Finished jobs are put on output_queue, summary
+    lines from the workers are set on report. Returns when every worker
+    is done.
+    """
+    result_queue = multiprocessing.Queue()
+
+    workers = []
+    for i in range(processes):
+        job_queue = multiprocessing.Queue(JOBS_PER_PROCESS)
+        worker = multiprocessing.Process(target=run_worker,
+                name="rho-scan-%d" % i,
+                args=(job_queue, result_queue, settings))
+        worker.daemon = True
+        worker.start()
+        workers.append((worker, job_queue))
+
+    feeder = JobFeeder(workers, jobs)
+    feeder.start()
+
+    # names of the workers that are done, or dead
+    finished = set()
+    while len(finished) < processes:
+        try:
+            kind, item = result_queue.get(True, POLL_INTERVAL)
+        except Queue.Empty:
+            for worker, job_queue in workers:
+                if worker.name not in finished and not worker.is_alive():
+                    finished.add(worker.name)
+            continue
+        _handle(kind, item, feeder, output_queue, report, finished)
+
+    # a worker seen dead may have finished some jobs just before, and
+    # they can still be on their way
+    while True:
+        try:
+            kind, item = result_queue.get(True, 0.1)
+        except Queue.Empty:
+            break
+        _handle(kind, item, feeder, output_queue, report, finished)
+
+    # the feeder has no one to give jobs to now, anything it hasn't sent
+    # (and anything a dead worker had) is lost
+    feeder.stop()
+    feeder.join()
+    lost = feeder.outstanding.values()
+    for ssh_job in lost:
+        ssh_job.connection_result = "FAILED"
+        ssh_job.command_output = _("scan worker process died")
+        output_queue.put(ssh_job)
+    if lost:
+        report.set_summary(_("lost with a dead scan worker"), len(lost))
+    for worker, job_queue in workers:
+        # jobs left for a dead worker would keep us from exiting, waiting
+        # for them to go down its pipe
+        job_queue.cancel_join_thread()
+        worker.join()
+
+
+def _handle(kind, item, feeder, output_queue, report, finished):
+    if kind == JOB:
+        feeder.returned(item)
+        output_queue.put(item)
+    elif kind == SUMMARY:
+        report.set_summary(*item)
+    else:
+        finished.add(item)
@@ -10,13 +10,17 @@
 #
 
 import config
+import deadlines
+import ssh_keys
+import ssh_loop
 #import ssh_jobs
 # Import built-in Python modules
-import getpass, threading, Queue, sys, os, re, datetime
+import getpass, threading, Queue, sys, os, re, datetime, socket, select
 from optparse import OptionParser
 from time import sleep
+import time
 import traceback
-import StringIO
+import binascii
 
 import paramiko
 
@@ -74,6 +78,11 @@ class SSHThread(GenericThread):
       id                    A thread ID
       ssh_connect_queue     Queue.Queue() for receiving orders
       output_queue          Queue.Queue() to output results
+      job_done              optional callable, called with each finished job
+      retry                 optional callable, called with each finished job,
+                            returning True if it will be run again
+      fact_cache            optional fact_cache.FactCache to answer commands from
+      aliases               optional aliases.HostAliases to find aliases with
 
     Here's the list of variables that are added to the output queue before it is put():
         queueObj['host']
@@ -83,10 +92,15 @@ class SSHThread(GenericThread):
         queueObj['connection_result'] - String: 'SUCCESS'/'FAILED'
         queueObj['command_output'] - String: Textual output of commands after execution
     """
-    def __init__ (self, id, ssh_connect_queue, output_queue):
+    def __init__ (self, id, ssh_connect_queue, output_queue, job_done=None,
+                  retry=None, fact_cache=None, aliases=None):
         threading.Thread.__init__(self, name="SSHThread-%d" % (id,))
         self.ssh_connect_queue = ssh_connect_queue
         self.output_queue = output_queue
+        self.job_done = job_done
+        self.retry = retry
+        self.fact_cache = fact_cache
+        self.aliases = aliases
         self.id = id
         self.quitting = False
 
@@ -101,7 +115,8 @@ class SSHThread(GenericThread):
                     self.quit()
                     
 #                success, command_output = attemptConnection(host, username, password, timeout, commands)
-                attemptConnection(queueObj)
+                attemptConnection(queueObj, fact_cache=self.fact_cache,
+                                  aliases=self.aliases)
 
                 #hmm, this is weird...
                 if queueObj.connection_result:
@@ -109,11 +124,16 @@ class SSHThread(GenericThread):
                 else:
                     queueObj.connection_result = "FAILED"
 
-                self.output_queue.put(queueObj)
+                # don't report jobs that are going to be run again
+                retrying = self.retry and self.retry(queueObj)
+                if not retrying:
+                    self.output_queue.put(queueObj)
                 self.ssh_connect_queue.task_done()
                 # just for progress, etc...
-                if queueObj.output_callback:
+                if queueObj.output_callback and not retrying:
                     queueObj.output_callback()
+                if self.job_done:
+                    self.job_done(queueObj)
         except Exception, detail:
             print _("Exception: %s") % detail
             print sys.exc_type()
@@ -137,14 +157,60 @@ def stopOutputThread():
             t.quit()
     return True
 
-def startSSHQueue(output_queue, max_threads):
-    """Setup concurrent threads for testing SSH connectivity.  Must be passed a Queue (output_queue) for writing results."""
-    ssh_connect_queue = Queue.Queue()
-    for thread_num in range(max_threads):
-        ssh_thread = SSHThread(thread_num, ssh_connect_queue, output_queue)
-        ssh_thread.setDaemon(True)
-        ssh_thread.start()
-    return ssh_connect_queue
+class SSHQueue(Queue.Queue):
+    """The queue the SSHThreads take their jobs from.
+
+    The threads are started as the jobs come in, whenever there isn't one
+    free to take the job, up to max_threads. A scan that allows thousands
+    of hosts in flight only has as many threads as it has hosts past the
+    banner at once.
+    """
+    def __init__(self, output_queue, max_threads, job_done=None,
+                 queue_size=0, retry=None, fact_cache=None, aliases=None):
+        Queue.Queue.__init__(self, queue_size)
+        self.output_queue = output_queue
+        self.max_threads = max_threads
+        self.job_done = job_done
+        self.retry = retry
+        self.fact_cache = fact_cache
+        self.aliases = aliases
+        self.threads = 0
+        # threads waiting in get()
+        self.idle = 0
+        self.pool_lock = threading.Lock()
+
+    def put(self, item, block=True, timeout=None):
+        self.pool_lock.acquire()
+        try:
+            if self.threads < self.max_threads and \
+                    self.qsize() + 1 > self.idle:
+                ssh_thread = SSHThread(self.threads, self, self.output_queue,
+                                       self.job_done, self.retry,
+                                       self.fact_cache, self.aliases)
+                ssh_thread.setDaemon(True)
+                ssh_thread.start()
+                self.threads = self.threads + 1
+        finally:
+            self.pool_lock.release()
+        Queue.Queue.put(self, item, block, timeout)
+
+    def get(self, block=True, timeout=None):
+        self.pool_lock.acquire()
+        self.idle = self.idle + 1
+        self.pool_lock.release()
+        try:
+            return Queue.Queue.get(self, block, timeout)
+        finally:
+            self.pool_lock.acquire()
+            self.idle = self.idle - 1
+            self.pool_lock.release()
+
+def startSSHQueue(output_queue, max_threads, job_done=None, queue_size=0,
+                  retry=None, fact_cache=None, aliases=None):
+    """Setup concurrent threads for testing SSH connectivity.  Must be passed a Queue (output_queue) for writing results.
+    If queue_size is set, queueSSHConnection() blocks once that many jobs are waiting."""
+    return SSHQueue(output_queue, max_threads, job_done, queue_size, retry,
+                    fact_cache, aliases)
 
 def stopSSHQueue():
     """Shut down the SSH Threads"""
@@ -154,61 +220,457 @@ def stopSSHQueue():
     return True
 
 def queueSSHConnection(ssh_connect_queue, cmd):
-    """Add files to the SSH Queue (ssh_connect_queue)"""
+    """Add files to the SSH Queue (ssh_connect_queue), blocks if it's full"""
     ssh_connect_queue.put(cmd)
     return True
 
 
 
+def connectSocket(ssh_job):
+    """Open a TCP connection to the job's host, honoring ssh_job.timeout"""
+    seconds, phase = deadlines.Deadlines(ssh_job).seconds(deadlines.CONNECT)
+    if len(ssh_job.ports) > 1:
+        # race them, ssh_job.port ends up as the winner
+        return ssh_loop.probe_ports(ssh_job, seconds)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(seconds)
+    try:
+        sock.connect((ssh_job.ip, ssh_job.port))
+    except socket.timeout:
+        sock.close()
+        if phase == deadlines.TOTAL:
+            raise deadlines.DeadlineExceeded(phase)
+        # not a sign of trouble, most likely there's no host there
+        raise socket.error(_("host did not respond"))
+    sock.settimeout(None)
+    return sock
+
+def authTransport(transport, auth, pkey=None, agent_keys=()):
+    """Authenticate a started transport with a single rho credential.
+
+    Tries the same things, in the same order, that paramiko.SSHClient.connect
+    does: the credential's key, the ssh-agent's keys (agent_keys), then the
+    password (not for ssh_key credentials, where it's the key's passphrase).
+    Raises the last paramiko.SSHException if nothing worked.
+    """
+    saved_exception = paramiko.AuthenticationException(_("no auth methods tried"))
+    if pkey is not None:
+        try:
+            transport.auth_publickey(auth.username, pkey)
+            return
+        except paramiko.SSHException, detail:
+            saved_exception = detail
+
+    for agent_key in agent_keys:
+        try:
+            transport.auth_publickey(auth.username, agent_key)
+            return
+        except paramiko.SSHException, detail:
+            saved_exception = detail
+
+    # an ssh_key credential's password is the key's passphrase, that
+    # doesn't get sent anywhere
+    if auth.type != config.SSH_KEY_TYPE and auth.password is not None:
+        try:
+            transport.auth_password(auth.username, auth.password)
+            return
+        except paramiko.SSHException, detail:
+            saved_exception = detail
+
+    raise saved_exception
+
+def checkHostKey(ssh_job, transport, host_keys):
+    """Check the host's key the way SSHClient.connect() with AutoAddPolicy
+    does.
+
+    host_keys is the paramiko.HostKeys seen so far, a key it doesn't have
+    is added to it. Returns the key's fingerprint, raises
+    paramiko.BadHostKeyException if the host has a different key now.
+    """
+    server_key = transport.get_remote_server_key()
+    if ssh_job.port == 22:
+        hostname = ssh_job.ip
+    else:
+        hostname = "[%s]:%d" % (ssh_job.ip, ssh_job.port)
+    known_key = host_keys.get(hostname, {}).get(server_key.get_name())
+    if known_key is None:
+        host_keys.add(hostname, server_key.get_name(), server_key)
+        known_key = server_key
+    if server_key != known_key:
+        raise paramiko.BadHostKeyException(hostname, server_key, known_key)
+    return binascii.hexlify(server_key.get_fingerprint())
+
+def rememberedAuthFirst(ssh_job, auths):
+    """Move the auth that got into this host last time to the front of auths"""
+    auth_name = ssh_job.auth_hints.get(ssh_job.host_key)
+    if auth_name is None:
+        return
+    for i in range(len(auths)):
+        if auths[i].name == auth_name:
+            auths.insert(0, auths.pop(i))
+            ssh_job.auth_hint = auth_name
+            return
+
+def connectTransport(ssh_job):
+    """Connect to the job's host and do the key exchange, returns the transport"""
+    # the event engine hands us a socket that has already seen the
+    # ssh banner, use it for the first attempt
+    sock = ssh_job.sock
+    ssh_job.sock = None
+    started = time.time()
+    if ssh_job.start_time is None:
+        ssh_job.start_time = started
+    # the time the job waited for a thread isn't the host's doing, so
+    # only the loop's part and ours count
+    loop_latency = 0
+    if sock is None:
+        sock = connectSocket(ssh_job)
+    elif ssh_job.banner_latency is not None:
+        loop_latency = ssh_job.banner_latency
+    transport = paramiko.Transport(sock)
+    try:
+        # the banner and the key exchange both come under the banner limit
+        seconds, phase = deadlines.Deadlines(ssh_job).seconds(deadlines.BANNER)
+        if seconds is not None:
+            transport.banner_timeout = seconds
+        negotiated = threading.Event()
+        transport.start_client(negotiated)
+        negotiated.wait(seconds)
+        if not negotiated.isSet():
+            raise deadlines.DeadlineExceeded(phase)
+        if not transport.is_active():
+            error = transport.get_exception()
+            if error is None:
+                error = paramiko.SSHException(_("Negotiation failed."))
+            raise error
+    except:
+        transport.close()
+        raise
+    if ssh_job.connect_latency is None:
+        ssh_job.connect_latency = loop_latency + time.time() - started
+    return transport
+
 def paramikoConnect(ssh_job):
     """Connects to 'host' and returns a Paramiko transport object to use in further communications"""
     # Uncomment this line to turn on Paramiko debugging (good for troubleshooting why some servers report connection failures)
 #    paramiko.util.log_to_file('paramiko.log')
 
-    for auth in ssh_job.auths:
-        ssh = paramiko.SSHClient()
+    # every auth is tried on the one transport, we only connect again
+    # if the server hangs up on us (sshd's MaxAuthTries, say)
+    auths = list(ssh_job.auths)
+    transport = None
+    # the keys of the host, if we have to connect more than once. like
+    # the SSHClient we used to use, we take whatever key it has the first
+    # time.
+    host_keys = paramiko.HostKeys()
+    # FIXME: we should probably make using the agent configurable
+    agent_keys = None
+    # usernames the agent's keys have been tried for on this transport,
+    # they'd only be turned down again for the next credential
+    agent_tried = []
+    ssh = _("no credentials to try")
+    while auths:
+        if transport is not None and not transport.is_active():
+            transport.close()
+            transport = None
+        if transport is None:
+            # if we can't get through to the host, no credential will
+            try:
+                transport = connectTransport(ssh_job)
+                host_key = checkHostKey(ssh_job, transport, host_keys)
+            except Exception, detail:
+                print _("connection failed: %s") % str(detail)
+                ssh = str(detail)
+                if isinstance(detail, deadlines.DeadlineExceeded):
+                    ssh_job.timed_out = detail.phase
+                break
+            agent_tried = []
+
+            # now we know who we are talking to, we can pick an auth
+            if ssh_job.host_key is None:
+                ssh_job.host_key = host_key
+                rememberedAuthFirst(ssh_job, auths)
+
+        auth = auths[0]
         try:
             pkey = None
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 #            print "auth.name: %s auth.type: %s auth.password: %s" % (auth.name, auth.type, auth.password)
             if auth.type == config.SSH_KEY_TYPE:
-                fo = StringIO.StringIO(auth.key)
-                pkey = paramiko.RSAKey.from_private_key(fo)
-            ssh.connect(ssh_job.ip, port=ssh_job.port, 
-                        username=auth.username,
-                        password=auth.password,
-                        pkey=pkey,
-                        # FIXME: 
-                        # we should probably set this somewhere
-                        #allow_agent=False,
-                        look_for_keys=False,
-                        timeout=ssh_job.timeout)
+                pkey = ssh_keys.key_cache.get(auth)
+
+            keys = []
+            if auth.username not in agent_tried:
+                agent_tried.append(auth.username)
+                if agent_keys is None:
+                    agent_keys = paramiko.Agent().get_keys()
+                keys = agent_keys
+
+            # paramiko would wait for an answer forever
+            alarm = deadlines.Deadlines(ssh_job).alarm(deadlines.AUTH,
+                                                      transport.close)
+            try:
+                authTransport(transport, auth, pkey, keys)
+            finally:
+                alarm.cancel()
+                # whatever closing the transport made paramiko raise, say
+                # what really happened
+                alarm.check()
+            ssh = transport
             # set the successful auth type
             ssh_job.auth = auth
             break
         except Exception, detail:
-            # Connecting failed (for whatever reason)
+            # this credential didn't get us in
             #FIXME: need to popular ssh_job.auth with something when we fail?
             print _("connection failed using auth class: %s %s") % (auth.name, str(detail))
             ssh = str(detail)
+            if isinstance(detail, deadlines.DeadlineExceeded):
+                # out of time for this host, not just this auth
+                ssh_job.timed_out = detail.phase
+                break
+            auths.pop(0)
+
+    if ssh_job.auth is None and transport is not None:
+        transport.close()
     return ssh
 
 
-def executeCommands(transport, rho_commands):
-    host = transport.get_host_keys().keys()[0]
+def execCommand(transport, cmd_string, limits=None, count=1):
+    """Run one command on its own channel, returns (stdout, stderr)
+
+    With limits (a deadlines.Deadlines), the command gets 'count' lots of
+    the command time limit, opening the channel included, after which the
+    transport is closed and DeadlineExceeded raised.
+    """
+    alarm = None
+    if limits is not None:
+        # the server can keep us waiting for the channel, too
+        alarm = limits.alarm(deadlines.COMMAND, transport.close, count)
+    chan = None
+    try:
+        chan = transport.open_session()
+        chan.exec_command(cmd_string)
+        stdout = chan.makefile('rb', -1)
+        stderr = chan.makefile_stderr('rb', -1)
+        output = (stdout.read(), stderr.read())
+    finally:
+        if alarm is not None:
+            alarm.cancel()
+        if chan is not None:
+            chan.close()
+        if alarm is not None:
+            alarm.check()
+    return output
+
+def executeCommands(transport, rho_commands, channels=1, limits=None):
+    """Run the rho_commands and hand each its output.
+
+    With channels > 1, up to that many commands run at once, each on its
+    own channel of the transport. limits, if given, is the job's
+    deadlines.Deadlines.
+    """
+    if channels > 1:
+        return executeCommandsParallel(transport, rho_commands, channels,
+                                       limits)
     for rho_cmd in rho_commands:
         output = []
         for cmd_string in rho_cmd.cmd_strings:
-            stdin, stdout, stderr = transport.exec_command(cmd_string)
             # one item in the list for each cmd stdout
-            output.append((stdout.read(), stderr.read()))
+            output.append(execCommand(transport, cmd_string, limits))
         rho_cmd.populate_data(output)
     return rho_commands
 
-def attemptConnection(ssh_job):
-    # ssh_job is a SshJob object
+class _RunningCommand:
+    """A command running on a channel, and the output read so far"""
+    def __init__(self, chan, index, alarm=None):
+        self.chan = chan
+        self.index = index
+        self.alarm = alarm
+        self.stdout = []
+        self.stderr = []
+
+    def close(self):
+        if self.alarm is not None:
+            self.alarm.cancel()
+        self.chan.close()
+
+    def read(self):
+        """Read whatever is waiting, returns True if there was anything"""
+        got = False
+        while self.chan.recv_ready():
+            self.stdout.append(self.chan.recv(32768))
+            got = True
+        while self.chan.recv_stderr_ready():
+            self.stderr.append(self.chan.recv_stderr(32768))
+            got = True
+        return got
+
+    def finished(self):
+        # the exit status comes after all the data, if the server sends
+        # one at all. a closed channel with nothing left is finished too.
+        return self.chan.exit_status_ready() and not \
+            (self.chan.recv_ready() or self.chan.recv_stderr_ready())
+
+def executeCommandsParallel(transport, rho_commands, channels, limits=None):
+    """Run the commands of rho_commands on up to 'channels' channels at once.
+
+    All from this thread, paramiko's transport thread fills the channel
+    buffers for us. If the server won't open as many channels as we ask
+    for (sshd's MaxSessions), we make do with what it did open.
+    """
+    cmd_strings = []
+    for rho_cmd in rho_commands:
+        cmd_strings.extend(rho_cmd.cmd_strings)
+    results = [None] * len(cmd_strings)
+
+    next_cmd = 0
+    running = []
+    try:
+        while next_cmd < len(cmd_strings) or running:
+            while next_cmd < len(cmd_strings) and len(running) < channels:
+                opening = None
+                if limits is not None:
+                    opening = limits.alarm(deadlines.COMMAND, transport.close)
+                try:
+                    try:
+                        chan = transport.open_session()
+                    finally:
+                        if opening is not None:
+                            opening.cancel()
+                            opening.check()
+                except paramiko.SSHException:
+                    if not running:
+                        raise
+                    # this many is all we get
+                    channels = len(running)
+                    break
+                alarm = None
+                if limits is not None:
+                    alarm = limits.alarm(deadlines.COMMAND, chan.close)
+                running.append(_RunningCommand(chan, next_cmd, alarm))
+                chan.exec_command(cmd_strings[next_cmd])
+                next_cmd = next_cmd + 1
+
+            progress = False
+            for cmd in running[:]:
+                if cmd.read():
+                    progress = True
+                if cmd.finished():
+                    cmd.read()
+                    results[cmd.index] = ("".join(cmd.stdout),
+                                          "".join(cmd.stderr))
+                    cmd.close()
+                    running.remove(cmd)
+                    if cmd.alarm is not None:
+                        cmd.alarm.check()
+                    progress = True
+            if not progress:
+                # wakes up early on stdout, stderr and exit status are
+                # picked up on the next go round
+                select.select([cmd.chan for cmd in running], [], [], 0.05)
+    finally:
+        for cmd in running:
+            cmd.close()
+
+    for rho_cmd in rho_commands:
+        output = results[:len(rho_cmd.cmd_strings)]
+        del results[:len(rho_cmd.cmd_strings)]
+        rho_cmd.populate_data(output)
+    return rho_commands
+
+def batchScript(cmd_strings, token):
+    """Build one sh command line that runs all of cmd_strings in order.
+
+    Each command's stdout and stderr is wrapped in "<token>:<n>:start" and
+    "<token>:<n>:end" lines, and the end line on stdout carries the exit
+    status. Every command gets a subshell of its own, so an exit or a cd in
+    one of them can't affect the rest.
+    """
+    lines = []
+    for i in range(len(cmd_strings)):
+        lines.append("printf '%s:%d:start\\n'" % (token, i))
+        lines.append("printf '%s:%d:start\\n' >&2" % (token, i))
+        # the command on lines of its own, so a trailing comment in it
+        # can't eat the closing paren
+        lines.append("(")
+        lines.append(cmd_strings[i])
+        lines.append(") </dev/null")
+        lines.append("rc=$?")
+        lines.append("printf '\\n%s:%d:end:%%d\\n' $rc" % (token, i))
+        lines.append("printf '\\n%s:%d:end\\n' >&2" % (token, i))
+    script = "\n".join(lines)
+    # whatever the login shell is, run this with sh
+    return "sh -c '%s'" % script.replace("'", "'\\''")
+
+def _unframe(output, token, i):
+    """Pull command i's output out of a batch stream, None if it isn't there"""
+    start = "%s:%d:start\n" % (token, i)
+    end = "\n%s:%d:end" % (token, i)
+    begin = output.find(start)
+    if begin < 0:
+        return None
+    begin = begin + len(start)
+    finish = output.find(end, begin)
+    if finish < 0:
+        return None
+    return (output[begin:finish], output[finish + len(end):])
+
+def splitBatchOutput(stdout, stderr, count, token):
+    """Split the output of a batchScript() back up.
+
+    Returns a list of (stdout, stderr, exit status) per command, or None if
+    any of the framing is missing (the shell died part way through, say).
+    """
+    results = []
+    for i in range(count):
+        out = _unframe(stdout, token, i)
+        err = _unframe(stderr, token, i)
+        if out is None or err is None:
+            return None
+        status = out[1][1:].split("\n", 1)[0]
+        try:
+            status = int(status)
+        except ValueError:
+            return None
+        results.append((out[0], err[0], status))
+    return results
+
+def executeCommandsBatched(transport, rho_commands, limits=None):
+    """Like executeCommands(), but one remote command for the lot.
+
+    Saves a channel open and a round trip per command, which adds up on
+    slow links. If the output doesn't come back framed the way we expect,
+    the commands are run one by one instead.
+    """
+    cmd_strings = []
+    for rho_cmd in rho_commands:
+        cmd_strings.extend(rho_cmd.cmd_strings)
+    if not cmd_strings:
+        return executeCommands(transport, rho_commands, limits=limits)
+
+    token = "RHO-%s" % binascii.hexlify(os.urandom(8))
+    # as long as the commands would get if they were run one by one
+    stdout, stderr = execCommand(transport, batchScript(cmd_strings, token),
+                                 limits, len(cmd_strings))
+    results = splitBatchOutput(stdout, stderr, len(cmd_strings), token)
+    if results is None:
+        return executeCommands(transport, rho_commands, limits=limits)
+
+    for rho_cmd in rho_commands:
+        output = []
+        for cmd_string in rho_cmd.cmd_strings:
+            out, err, status = results.pop(0)
+            output.append((out, err))
+        rho_cmd.populate_data(output)
+    return rho_commands
+
+def attemptConnection(ssh_job, fact_cache=None, aliases=None):
+    # ssh_job is a SshJob object, fact_cache a fact_cache.FactCache or None,
+    # aliases an aliases.HostAliases or None
 
     if ssh_job.ip != "":
+        ssh = None
         try:
             ssh = paramikoConnect(ssh_job)
             if type(ssh) == type(""): # If ssh is a string that means the connection failed and 'ssh' is the details as to why
@@ -216,9 +678,33 @@ def attemptConnection(ssh_job):
                 ssh_job.connection_result = False
                 return
             command_output = []
-            executeCommands(transport=ssh, rho_commands=ssh_job.rho_cmds)
-            ssh.close()
+            limits = deadlines.Deadlines(ssh_job)
+            # we know the host key now, so what we already know about the
+            # host needn't be asked again
+            if aliases is not None and aliases.fill(ssh_job):
+                rho_cmds = []
+            elif fact_cache is not None:
+                rho_cmds = fact_cache.fill(ssh_job)
+            else:
+                rho_cmds = ssh_job.rho_cmds
+            try:
+                if ssh_job.batch:
+                    executeCommandsBatched(transport=ssh, rho_commands=rho_cmds,
+                                           limits=limits)
+                else:
+                    executeCommands(transport=ssh, rho_commands=rho_cmds,
+                                    channels=ssh_job.channels, limits=limits)
+            finally:
+                ssh.close()
+            if aliases is not None:
+                aliases.add(ssh_job)
 
+        except deadlines.DeadlineExceeded, detail:
+            # the host is slow or stuck, not something to print a
+            # traceback about
+            ssh_job.timed_out = detail.phase
+            ssh_job.connection_result = False
+            ssh_job.command_output = str(detail)
         except Exception, detail:
             # Connection failed
             print _("Exception: %s") % detail
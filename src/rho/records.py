@@ -0,0 +1,147 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Small, shared-schema records for the rows of a ScanReport """
+
+# A dict per host carries its own hash table of keys, and every host's
+# "Linux", "5Server", "x86_64" is a string of its own. A HostRecord is
+# just a list of values in the order of a Schema that all the records
+# share. Records made with the same Values share their strings, so a big
+# scan's report holds one copy of each OS name, release and so on, for
+# as long as the report is around.
+#
+# Records behave enough like a dict (get, items, keys, [], update) for
+# the report format, the sinks, the journal and the result store.
+
+import threading
+
+_NOTHING = object()
+
+# different for every host, no use sharing them
+UNIQUE_FIELDS = ["ip", "uname.hostname"]
+
+
+
+class Values(object):
+    """ The strings a set of records share, one copy of each. """
+
+    def __init__(self):
+        self.values = {}
+
+    def share(self, field, value):
+        """ The copy of value to keep for field. """
+        if field in UNIQUE_FIELDS or not isinstance(value, basestring):
+            return value
+        # setdefault is one step for the GIL, no lock needed
+        return self.values.setdefault(value, value)
+
+
+class Schema(object):
+    """ Field names, in the order HostRecords keep their values. """
+
+    def __init__(self, fields=()):
+        self.fields = []
+        self.indexes = {}
+        self.lock = threading.Lock()
+        for field in fields:
+            self.index(field)
+
+    def index(self, field):
+        """ The position of field, adding it if it's new. """
+        index = self.indexes.get(field)
+        if index is not None:
+            return index
+        self.lock.acquire()
+        try:
+            if field not in self.indexes:
+                self.indexes[field] = len(self.fields)
+                self.fields.append(field)
+            return self.indexes[field]
+        finally:
+            self.lock.release()
+
+
+# the fields every scanned host has, first
+schema = Schema(["ip", "port", "auth.type", "auth.name", "auth.username",
+                 "source"])
+
+
+class HostRecord(object):
+
+    __slots__ = ["values"]
+
+    # shared by every record, it's what makes them small
+    schema = schema
+
+    def __init__(self, fields=None, values=None):
+        """
+        fields is a dict (or record) of the host's fields. values, a
+        Values, is what the strings are shared through.
+        """
+        self.values = ()
+        if fields is not None:
+            self.update(fields, values)
+
+    def __setitem__(self, field, value):
+        # builds the tuple again, fill a dict and make the record from
+        # that where you can
+        self.update({field: value})
+
+    def get(self, field, default=None):
+        index = self.schema.indexes.get(field)
+        if index is None or index >= len(self.values):
+            return default
+        value = self.values[index]
+        if value is _NOTHING:
+            return default
+        return value
+
+    def __getitem__(self, field):
+        # fields a host doesn't have come out empty, like in the report
+        return self.get(field, "")
+
+    def __contains__(self, field):
+        return self.get(field, _NOTHING) is not _NOTHING
+
+    def keys(self):
+        keys = []
+        for i in range(len(self.values)):
+            if self.values[i] is not _NOTHING:
+                keys.append(self.schema.fields[i])
+        return keys
+
+    def items(self):
+        items = []
+        for i in range(len(self.values)):
+            if self.values[i] is not _NOTHING:
+                items.append((self.schema.fields[i], self.values[i]))
+        return items
+
+    def update(self, fields, shared=None):
+        values = list(self.values)
+        for field, value in fields.items():
+            index = self.schema.index(field)
+            if index >= len(values):
+                values.extend([_NOTHING] * (index + 1 - len(values)))
+            if shared is not None:
+                value = shared.share(field, value)
+            values[index] = value
+        # a tuple takes less room than a list
+        self.values = tuple(values)
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "HostRecord(%r)" % dict(self.items())
@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Looks up the ips of hostnames, a few at a time, remembering them """
+
+# gethostbyname blocks and doesn't tell us the record's TTL, so lookups
+# are run by a small pool of threads and their answers (failures too)
+# are kept for a fixed TTL.
+
+import Queue
+import socket
+import threading
+import time
+
+DEFAULT_THREADS = 10
+# seconds an answer is good for
+DEFAULT_TTL = 300
+
+
+class Resolver(object):
+
+    def __init__(self, threads=DEFAULT_THREADS, ttl=DEFAULT_TTL,
+                 gethostbyname=socket.gethostbyname):
+        self.threads = threads
+        self.ttl = ttl
+        self.gethostbyname = gethostbyname
+
+        # {hostname: (ip, or None if it didn't resolve, when it expires)}
+        self.cache = {}
+        self.lock = threading.Lock()
+
+        # (hostname, queue for the answer), for the pool
+        self.lookups = Queue.Queue()
+        self.pool = []
+
+    def cached(self, hostname, now=None):
+        """ (True, ip) if we have a fresh answer for hostname. """
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.cache.get(hostname)
+        finally:
+            self.lock.release()
+        if entry is None or entry[1] < now:
+            return (False, None)
+        return (True, entry[0])
+
+    def lookup(self, hostname):
+        """
+        The ip of hostname, looked up here and now if need be. Raises
+        socket.error if it has none.
+        """
+        found, ip = self.cached(hostname)
+        if not found:
+            ip = self._lookup(hostname)
+        if ip is None:
+            raise socket.gaierror(socket.EAI_NONAME,
+                                  "unable to find ip for %s" % hostname)
+        return ip
+
+    def _lookup(self, hostname):
+        try:
+            ip = self.gethostbyname(hostname)
+        except socket.error:
+            ip = None
+        self.lock.acquire()
+        try:
+            self.cache[hostname] = (ip, time.time() + self.ttl)
+        finally:
+            self.lock.release()
+        return ip
+
+    def resolve(self, hostnames):
+        """
+        Start looking up all of hostnames. Returns a Lookups of their
+        (hostname, ip) pairs, ip being None for ones that didn't resolve,
+        in the order the answers come in.
+        """
+        answers = Queue.Queue()
+        pending = 0
+        for hostname in hostnames:
+            found, ip = self.cached(hostname)
+            if found:
+                answers.put((hostname, ip))
+            else:
+                self._start_pool()
+                self.lookups.put((hostname, answers))
+            pending = pending + 1
+        return Lookups(answers, pending)
+
+    def _start_pool(self):
+        self.lock.acquire()
+        try:
+            while len(self.pool) < self.threads:
+                thread = threading.Thread(target=self._run,
+                        name="Resolver-%d" % len(self.pool))
+                thread.setDaemon(True)
+                thread.start()
+                self.pool.append(thread)
+        finally:
+            self.lock.release()
+
+    def _run(self):
+        while True:
+            hostname, answers = self.lookups.get()
+            answers.put((hostname, self._lookup(hostname)))
+
+
+class Lookups(object):
+    """ The answers to a Resolver.resolve(), as they come in. """
+
+    def __init__(self, answers, pending):
+        # the Queue.Queue they're put on
+        self.answers = answers
+        # how many are still to come
+        self.pending = pending
+
+    def __iter__(self):
+        """ All the answers, waiting for each as need be. """
+        while self.pending:
+            yield self.wait()
+
+    def wait(self):
+        """ The next answer, waiting for it if need be. """
+        answer = self.answers.get()
+        self.pending = self.pending - 1
+        return answer
+
+    def ready(self):
+        """ The answers that are in, without waiting for the rest. """
+        while self.pending:
+            try:
+                answer = self.answers.get(False)
+            except Queue.Empty:
+                return
+            self.pending = self.pending - 1
+            yield answer
@@ -0,0 +1,109 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Keeps the last good report row for each host, for scan --max-age """
+
+# Only hosts we got into are kept; one that failed last time has nothing
+# here (even if an earlier scan got in) and is scanned again. Passwords are never written out.
+
+import time
+
+import records
+import state_file
+
+# never written out. rows no longer have them, but older files might.
+PRIVATE_FIELDS = ["auth.password"]
+
+# fields the report fills in itself, they needn't be stored
+REPORT_FIELDS = ["source", "alias_of", "timed_out"]
+
+
+def public_row(row):
+    """ A copy of a report row that's fit to write to disk. """
+    row = dict(row)
+    for field in PRIVATE_FIELDS:
+        row.pop(field, None)
+    return row
+
+
+class ResultStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        # {ip: (when it was scanned, its row as a records.HostRecord, the
+        #       fields that scan reported)}. the row is the report's own
+        # and the fields are shared, so a host costs us next to nothing
+        # on top of its report row.
+        self.hosts = {}
+        self.values = records.Values()
+        # {fields: the same, the copy the hosts share}
+        self.field_lists = {}
+
+    def load(self):
+        self.hosts = {}
+        for ip, host in state_file.load(self.path).items():
+            row = records.HostRecord(public_row(host["row"]), self.values)
+            fields = host.get("fields") or host["row"].keys()
+            self.hosts[ip] = (host["time"], row, self._share(fields))
+
+    def save(self):
+        # written out a host at a time, not as a copy of the lot
+        state_file.save_items(self.path, self._entries())
+
+    def _entries(self):
+        for ip, (when, row, fields) in self.hosts.iteritems():
+            yield ip, {"time": when, "row": dict(row.items()),
+                       "fields": list(fields)}
+
+    def _share(self, fields):
+        fields = tuple(fields)
+        return self.field_lists.setdefault(fields, fields)
+
+    def put(self, row, now=None, fields=None):
+        """
+        Keep a report row from a host we just scanned, for a report of
+        the given fields (all of the row's, by default).
+        """
+        if now is None:
+            now = time.time()
+        for field in PRIVATE_FIELDS:
+            if field in row:
+                row = public_row(row)
+                break
+        if not isinstance(row, records.HostRecord):
+            row = records.HostRecord(row, self.values)
+        if fields is None:
+            fields = row.keys()
+        self.hosts[row["ip"]] = (now, row, self._share(fields))
+
+    def forget(self, ip):
+        """ Drop ip's row, its last scan didn't get in. """
+        self.hosts.pop(ip, None)
+
+    def fresh(self, ip, max_age, now=None, fields=None):
+        """
+        The row for ip if it was scanned in the last max_age seconds, by
+        a scan that looked for all of fields (if given).
+        """
+        if now is None:
+            now = time.time()
+        host = self.hosts.get(ip)
+        if host is None:
+            return None
+        when, row, stored = host
+        if now - when > max_age:
+            return None
+        if fields is not None:
+            # a --fields scan's row would leave the rest of ours empty
+            for field in fields:
+                if field not in stored and field not in REPORT_FIELDS:
+                    return None
+        return dict(row.items())
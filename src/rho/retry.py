@@ -0,0 +1,137 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Runs ssh jobs again when they fail in a way that might not last """
+
+# A host that is busy (sshd's MaxStartups, a full accept queue, a slow
+# key exchange) fails the same way as one that is overloaded for good,
+# so jobs that fail like that are tried again a few times, further apart
+# each time. Hosts that refuse us, don't answer at all, or turn down all
+# the credentials are not.
+
+import heapq
+import random
+import threading
+import time
+
+import concurrency
+
+# attempts in all, including the first
+DEFAULT_MAX_ATTEMPTS = 3
+# seconds before the first retry, doubling for each one after that
+DEFAULT_RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 60.0
+
+# failures worth another go, on top of concurrency.CONGESTION_ERRORS.
+# sshd drops connections past MaxStartups before sending a banner.
+TRANSIENT_ERRORS = [
+    "connection closed before ssh banner",
+]
+
+
+def is_transient(ssh_job):
+    """ Might the job work if we tried it again later? """
+    if concurrency.is_congestion(ssh_job):
+        return True
+    if ssh_job.connection_result != "FAILED" or ssh_job.timed_out is not None:
+        # a slow command or auth will be just as slow next time
+        return False
+    detail = str(ssh_job.command_output).lower()
+    for error in TRANSIENT_ERRORS:
+        if error in detail:
+            return True
+    return False
+
+
+class RetryQueue(threading.Thread):
+    """
+    Holds failed jobs until it's time to try them again, then hands them
+    to add(), which should take them like any new job.
+
+    The engines call retry() with each finished job, before releasing its
+    slot. If it returns True the job has been taken for another go and
+    shouldn't be reported. Jobs are park()ed on the limiter while they
+    wait, so they don't hold up any new hosts, but the limiter's wait()
+    still waits for them.
+    """
+
+    def __init__(self, limiter, add, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 delay=DEFAULT_RETRY_DELAY, max_delay=MAX_RETRY_DELAY):
+        threading.Thread.__init__(self, name="RetryQueue")
+        self.setDaemon(True)
+        self.limiter = limiter
+        self.add = add
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.max_delay = max_delay
+
+        self.waiting = []
+        self.count = 0
+        self.cond = threading.Condition()
+        self.quitting = False
+        # how many retries we've done
+        self.retried = 0
+
+    def backoff(self, attempt):
+        """ Seconds to wait before the given attempt (2 is the first retry). """
+        delay = min(self.max_delay, self.delay * 2 ** (attempt - 2))
+        # spread them out, so a crowd of jobs that failed together
+        # don't all come back together
+        return random.uniform(delay / 2, delay)
+
+    def retry(self, ssh_job):
+        if ssh_job.attempts >= self.max_attempts or not is_transient(ssh_job):
+            return False
+
+        self.limiter.park()
+        due = time.time() + self.backoff(ssh_job.attempts + 1)
+        self.cond.acquire()
+        try:
+            # count breaks ties, jobs don't compare
+            self.count = self.count + 1
+            heapq.heappush(self.waiting, (due, self.count, ssh_job))
+            self.retried = self.retried + 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        return True
+
+    def quit(self):
+        self.cond.acquire()
+        try:
+            self.quitting = True
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.quitting:
+                    if not self.waiting:
+                        self.cond.wait()
+                        continue
+                    left = self.waiting[0][0] - time.time()
+                    if left <= 0:
+                        break
+                    self.cond.wait(left)
+                if self.quitting:
+                    return
+                due, count, ssh_job = heapq.heappop(self.waiting)
+            finally:
+                self.cond.release()
+
+            # the limiter saw how this attempt went when it was released,
+            # now start the next one afresh
+            ssh_job.reset()
+            ssh_job.attempts = ssh_job.attempts + 1
+            self.add(ssh_job)
@@ -27,13 +27,36 @@
 # everything as strings, since the primary target seems to be csv 
 # output. 
 
+import itertools
+
+# report fields that come from the scan itself, not from any command
+BASE_FIELDS = ["ip", "port", "auth.type", "auth.name", "auth.username",
+               "source", "alias_of"]
+
+
+class UnknownFieldsError(Exception):
+
+    def __init__(self, fields):
+        Exception.__init__(self, fields)
+        self.fields = fields
+
+    def __str__(self):
+        return _("no command gives: %s") % ", ".join(self.fields)
+
 
 class RhoCmd():
     name = "base"
+    # the data keys parse_data() can fill in
+    fields = []
+    # if set, the data can be reused for this many seconds on the same
+    # host (same host key) instead of running the commands again
+    cache_ttl = None
     def __init__(self):
 #        self.cmd_strings = cmd
         self.cmd_results = []
         self.data = {}
+        # set if data came from a fact_cache.FactCache
+        self.from_cache = False
 
 
     # we're not actually running the class on the hosts, so
@@ -60,19 +83,34 @@ class RhoCmd():
     
 class UnameRhoCmd(RhoCmd):
     name = "uname"
-    cmd_strings = ["uname -s", "uname -n", "uname -p", "uname -i"]
+    cmd_strings = ["uname -s", "uname -p", "uname -i"]
+    fields = ["uname.os", "uname.processor", "uname.hardware_platform"]
+    cache_ttl = 7 * 24 * 60 * 60
 
     def parse_data(self):
         self.data['%s.os' % self.name] = self.cmd_results[0][0].strip()
-        self.data['%s.hostname' % self.name] = self.cmd_results[1][0].strip()
-        self.data['%s.processor' % self.name] = self.cmd_results[2][0].strip()
-        if not self.cmd_results[3][1]:
-            self.data['%s.hardware_platform' % self.name] = self.cmd_results[3][0].strip()
+        self.data['%s.processor' % self.name] = self.cmd_results[1][0].strip()
+        if not self.cmd_results[2][1]:
+            self.data['%s.hardware_platform' % self.name] = self.cmd_results[2][0].strip()
+
+
+# on its own so it's never cached, a host can be renamed any time
+class HostnameRhoCmd(RhoCmd):
+    name = "hostname"
+    cmd_strings = ["uname -n"]
+    fields = ["uname.hostname"]
+
+    def parse_data(self):
+        self.data['uname.hostname'] = self.cmd_results[0][0].strip()
 
 
 class RedhatReleaseRhoCmd(RhoCmd):
     name = "redhat-release"
     cmd_strings = ["""rpm -q --queryformat "%{NAME}\n%{VERSION}\n%{RELEASE}\n" --whatprovides redhat-release"""]
+    fields = ["redhat-release.name", "redhat-release.version",
+              "redhat-release.release"]
+    # changes when the host is upgraded
+    cache_ttl = 3 * 24 * 60 * 60
 
     def parse_data(self):
         # new line seperated string, one result only
@@ -88,6 +126,7 @@ class RedhatReleaseRhoCmd(RhoCmd):
 class ScriptRhoCmd(RhoCmd):
     name = "script"
     cmd_strings = []
+    fields = ["script.output", "script.error", "script.command"]
 
     def __init__(self, command):
         self.command = command
@@ -99,8 +138,51 @@ class ScriptRhoCmd(RhoCmd):
         self.data['%s.error' % self.name] = self.cmd_results[0][1]
         self.data['%s.command' % self.name] = self.command
 
+def plan_rho_cmds(fields, rho_cmd_classes):
+    """
+    The fewest of rho_cmd_classes, counting each by how many commands it
+    runs on a host, that between them give all of fields. Raises
+    UnknownFieldsError if some of the fields can't be had at all.
+    """
+    wanted = []
+    for field in fields:
+        if field not in BASE_FIELDS and field not in wanted:
+            wanted.append(field)
+
+    unknown = []
+    for field in wanted:
+        for rho_cmd_class in rho_cmd_classes:
+            if field in rho_cmd_class.fields:
+                break
+        else:
+            unknown.append(field)
+    if unknown:
+        raise UnknownFieldsError(unknown)
+
+    # there are only ever a handful of classes, so try every combination
+    # (keeping the given order) and take the cheapest that covers it all
+    best = None
+    best_cost = None
+    for count in range(len(rho_cmd_classes) + 1):
+        for classes in itertools.combinations(rho_cmd_classes, count):
+            cost = 0
+            covered = []
+            for rho_cmd_class in classes:
+                cost = cost + len(rho_cmd_class.cmd_strings)
+                covered.extend(rho_cmd_class.fields)
+            if best_cost is not None and cost >= best_cost:
+                continue
+            for field in wanted:
+                if field not in covered:
+                    break
+            else:
+                best = list(classes)
+                best_cost = cost
+    return best
+
 # the list of commands to run on each host
 class RhoCmdList():
     def __init__(self):
         self.cmds = {}
         self.cmds['uname'] = UnameRhoCmd()
+        self.cmds['hostname'] = HostnameRhoCmd()
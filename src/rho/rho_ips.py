@@ -8,8 +8,10 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 #
 
+import bisect
 import re
 import socket
+import struct
 
 import netaddr
 
@@ -17,15 +19,45 @@ import netaddr
 ip_regex = re.compile(r'\d+\.\d+\.\d+\.\d+')
 
 
+def is_hostname(range_str):
+    """ True if range_str doesn't look like any kind of range or ip. """
+    for marker in [' - ', '/', '*']:
+        if range_str.find(marker) > -1:
+            return False
+    return not ip_regex.search(range_str)
+
+
+def int_to_ip(value, addr_type=netaddr.AT_INET):
+    """ The string form of an integer ip address. """
+    if addr_type == netaddr.AT_INET:
+        return socket.inet_ntoa(struct.pack("!I", value))
+    return str(netaddr.IP(value, addr_type))
+
+
+def _iter_interval(first, last, addr_type):
+    # not xrange, an ipv6 range can be past a C long
+    value = first
+    while value <= last:
+        yield int_to_ip(value, addr_type)
+        value = value + 1
+
+
 class RhoIpRange(object):
-    def __init__(self, iprange):
+    # The range is kept as (first, last) integer intervals, and only turned
+    # into addresses as it's iterated over, so a /8 costs the same as a
+    # single ip.
+
+    def __init__(self, iprange, resolver=None):
         self.range_str = iprange
+        # a resolver.Resolver to look hostnames up with, the scan's so
+        # the answers are shared. without one they're looked up here.
+        self.resolver = resolver
 
-        # Iterator that returns netaddr.IP objects:
-        self.ips = []
+        # [(first, last)] as ints, both ends included
+        self.intervals = []
+        self.addr_type = netaddr.AT_INET
 
         self.parse_iprange(iprange)
-        # list of netaddr.IP() objects
 
     # make sure we end up with an ip
     def _find_ip(self, iprange):
@@ -33,10 +65,13 @@ class RhoIpRange(object):
         if ip_regex.search(iprange):
             return iprange
         # try to resolve if it looks like a hostname
-        # FIXME: thisis blocky and generally icky and failureprone -akl
-        ip = socket.gethostbyname(iprange)
+        if self.resolver is None:
+            return socket.gethostbyname(iprange)
+        return self.resolver.lookup(iprange)
 
-        return ip
+    def _set_interval(self, first, last, addr_type=netaddr.AT_INET):
+        self.intervals = [(first, last)]
+        self.addr_type = addr_type
 
     def parse_iprange(self, iprange):
         # FIXME: NOTE: all of this stuff is pretty much untested ;-> -akl
@@ -56,8 +91,8 @@ class RhoIpRange(object):
 
             if self.start_ip and self.end_ip:
                 ipr = netaddr.IPRange(self.start_ip, self.end_ip)
-                self.ips = list(ipr)
-            return self.ips
+                self._set_interval(ipr.first, ipr.last, ipr.addr_type)
+            return self.intervals
         
         # FIXME: not sure what to do about cases like 
         # foo.example.com/24 or "*.example.com". punt? -akl
@@ -65,36 +100,134 @@ class RhoIpRange(object):
         if self.range_str.find('/') > -1:
             # looks like a cidr
             cidr = netaddr.CIDR(self.range_str)
-            self.ips = list(cidr)
-            return self.ips
+            self._set_interval(cidr.first, cidr.last, cidr.addr_type)
+            return self.intervals
 
         if self.range_str.find('*') > -1:
             wildcard = netaddr.Wildcard(self.range_str)
-            self.ips = list(wildcard)
-            return self.ips
+            self._set_interval(wildcard.first, wildcard.last,
+                               wildcard.addr_type)
+            return self.intervals
 
         if ip_regex.search(self.range_str):
             # must be a single ip
             self.start_ip = self._find_ip(self.range_str)
-            self.ips = [netaddr.IP(self.start_ip)]
+            ip = netaddr.IP(self.start_ip)
+            self._set_interval(ip.value, ip.value, ip.addr_type)
+            return self.intervals
         
         # doesn't look like anything else, try treating it as a hostname
         try:
             self.start_ip = self._find_ip(self.range_str)
-            self.ips = [netaddr.IP(self.start_ip)]
+            ip = netaddr.IP(self.start_ip)
+            self._set_interval(ip.value, ip.value, ip.addr_type)
         except:
             return None
 
         return None
 
+    def __len__(self):
+        count = 0
+        for first, last in self.intervals:
+            count = count + last - first + 1
+        return count
+
+    def __iter__(self):
+        """ The string ip addresses of the range, in order. """
+        for first, last in self.intervals:
+            for ip in _iter_interval(first, last, self.addr_type):
+                yield ip
+
+    def _get_ips(self):
+        for ip in self:
+            yield netaddr.IP(ip)
+
+    # netaddr.IP objects, made as they're needed
+    ips = property(_get_ips)
+
     def list_ips(self):
         """ Return a list of individual string IP addresses for this range. """
-        return map(str, list(self.ips))
-        
-    def _gen_list(self):
-        pass
-    
-    def next(self):
-        pass
-
-    # implement list style bits?
+        return list(self)
+
+
+class IpSet(object):
+    """
+    A set of ips, kept as sorted, non-overlapping integer intervals.
+    Overlapping ranges added to it only count once.
+    """
+
+    def __init__(self):
+        # {netaddr addr type: [(first, last)]}
+        self.intervals = {}
+
+    def add(self, first, last, addr_type=netaddr.AT_INET):
+        intervals = self.intervals.setdefault(addr_type, [])
+        lo = bisect.bisect_left(intervals, (first,))
+        if lo > 0 and intervals[lo - 1][1] >= first - 1:
+            lo = lo - 1
+        # swallow everything that overlaps or touches it
+        hi = lo
+        while hi < len(intervals) and intervals[hi][0] <= last + 1:
+            first = min(first, intervals[hi][0])
+            last = max(last, intervals[hi][1])
+            hi = hi + 1
+        intervals[lo:hi] = [(first, last)]
+
+    def add_ip(self, ip):
+        """ Add a string ip address. """
+        ip = netaddr.IP(ip)
+        self.add(ip.value, ip.value, ip.addr_type)
+
+    def add_range(self, ipr):
+        """ Add the ips of a RhoIpRange. """
+        for first, last in ipr.intervals:
+            self.add(first, last, ipr.addr_type)
+
+    def update(self, other):
+        for addr_type, intervals in other.intervals.items():
+            for first, last in intervals:
+                self.add(first, last, addr_type)
+
+    def difference(self, other):
+        """ A new IpSet of our ips that aren't in other. """
+        result = IpSet()
+        for addr_type, intervals in self.intervals.items():
+            others = other.intervals.get(addr_type, [])
+            j = 0
+            for first, last in intervals:
+                while j < len(others) and others[j][1] < first:
+                    j = j + 1
+                k = j
+                while k < len(others) and others[k][0] <= last:
+                    if others[k][0] > first:
+                        result.add(first, others[k][0] - 1, addr_type)
+                    first = max(first, others[k][1] + 1)
+                    k = k + 1
+                if first <= last:
+                    result.add(first, last, addr_type)
+        return result
+
+    def __contains__(self, ip):
+        """ True if the string ip address ip is in the set. """
+        ip = netaddr.IP(ip)
+        intervals = self.intervals.get(ip.addr_type, [])
+        i = bisect.bisect_right(intervals, (ip.value, ip.value))
+        if i > 0 and intervals[i - 1][1] >= ip.value:
+            return True
+        return i < len(intervals) and intervals[i][0] == ip.value
+
+    def __len__(self):
+        count = 0
+        for intervals in self.intervals.values():
+            for first, last in intervals:
+                count = count + last - first + 1
+        return count
+
+    def __iter__(self):
+        """ The string ip addresses of the set, ipv4 first, in order. """
+        addr_types = self.intervals.keys()
+        addr_types.sort()
+        for addr_type in addr_types:
+            for first, last in self.intervals[addr_type]:
+                for ip in _iter_interval(first, last, addr_type):
+                    yield ip
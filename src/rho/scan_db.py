@@ -0,0 +1,179 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Every scan's results, kept in an SQLite database """
+
+# One writer thread owns the connection. Rows are queued to it, and it
+# inserts whatever has piled up in one transaction, so a burst of hosts
+# costs one commit and the OutputThread only waits on the disk if the
+# writer falls a long way behind.
+#
+#   scans  - one per run of rho scan
+#   hosts  - one per host per scan, with how we got in
+#   facts  - the command results for each host, one per field
+
+import Queue
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import result_store
+
+# rows put in one transaction, at most
+BATCH_SIZE = 500
+# rows waiting for the writer, at most, before write() waits
+QUEUE_SIZE = 10000
+
+# row fields that go in the hosts table, the rest are facts
+HOST_FIELDS = ["ip", "port", "auth.type", "auth.name", "auth.username",
+               "source"]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY,
+        started REAL NOT NULL,
+        finished REAL,
+        hosts INTEGER NOT NULL DEFAULT 0)""",
+    """CREATE TABLE IF NOT EXISTS hosts (
+        id INTEGER PRIMARY KEY,
+        scan_id INTEGER NOT NULL REFERENCES scans(id),
+        ip TEXT NOT NULL,
+        port INTEGER,
+        auth_type TEXT,
+        auth_name TEXT,
+        auth_username TEXT,
+        source TEXT,
+        scanned REAL NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS facts (
+        host_id INTEGER NOT NULL REFERENCES hosts(id),
+        key TEXT NOT NULL,
+        value TEXT)""",
+    "CREATE INDEX IF NOT EXISTS hosts_ip ON hosts (ip)",
+    "CREATE INDEX IF NOT EXISTS hosts_scan_id ON hosts (scan_id)",
+    "CREATE INDEX IF NOT EXISTS facts_host_id ON facts (host_id)",
+    "CREATE INDEX IF NOT EXISTS facts_key ON facts (key)",
+]
+
+
+def connect(path):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname, 0700)
+    if not os.path.exists(path):
+        # it has everything we found out about every host
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0600))
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+class DatabaseError(Exception):
+    """ What close() raises if the scan couldn't be written. """
+    pass
+
+
+class ScanDatabase(object):
+    """
+    Records one scan in the database at path. It takes the report's rows
+    like a sinks.ResultSink, write() for each and close() when the scan
+    is done. scan_id is set after that.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = Queue.Queue(QUEUE_SIZE)
+        self.scan_id = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="ScanDatabase")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def write(self, row):
+        if self.error is not None:
+            # no one to write it
+            return
+        self.queue.put((time.time(), row))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise DatabaseError(str(self.error))
+
+    def _failed(self, detail):
+        self.error = detail
+        print >> sys.stderr, _("Not saving any more results to the database: %s") % detail
+
+    def _run(self):
+        try:
+            conn = connect(self.path)
+        except Exception, detail:
+            self._failed(detail)
+            # keep taking rows, so nobody waits on us
+            while self.queue.get() is not None:
+                pass
+            return
+
+        done = False
+        try:
+            cursor = conn.execute("INSERT INTO scans (started) VALUES (?)",
+                                  (time.time(),))
+            self.scan_id = cursor.lastrowid
+            conn.commit()
+
+            count = 0
+            while not done:
+                batch = [self.queue.get()]
+                while len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                if None in batch:
+                    done = True
+                    batch = batch[:batch.index(None)]
+
+                for scanned, row in batch:
+                    self._insert(conn, scanned, row)
+                count = count + len(batch)
+                if done:
+                    conn.execute("UPDATE scans SET finished = ?, hosts = ? "
+                                 "WHERE id = ?",
+                                 (time.time(), count, self.scan_id))
+                conn.commit()
+        except Exception, detail:
+            # whatever it was (a row sqlite can't take, say), the scan
+            # carries on without us
+            self._failed(detail)
+            while not done and self.queue.get() is not None:
+                pass
+        conn.close()
+
+    def _insert(self, conn, scanned, row):
+        cursor = conn.execute(
+            "INSERT INTO hosts (scan_id, ip, port, auth_type, auth_name, "
+            "auth_username, source, scanned) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.scan_id, row["ip"], row.get("port"), row.get("auth.type"),
+             row.get("auth.name"), row.get("auth.username"),
+             row.get("source"), scanned))
+        host_id = cursor.lastrowid
+
+        facts = []
+        for key, value in row.items():
+            if key in HOST_FIELDS or key in result_store.PRIVATE_FIELDS:
+                continue
+            facts.append((host_id, key, value))
+        conn.executemany("INSERT INTO facts (host_id, key, value) "
+                         "VALUES (?, ?, ?)", facts)
@@ -6,55 +6,408 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 #
 
+import re
+import socket
+import sys
+
 import config
+import aliases
+import deadlines
+import records
 import rho_cmds
+import resolver
 import rho_ips
 import ssh_jobs
 
 
+def _ip_sort_key(ip):
+    # numeric order for addresses, anything else after them
+    try:
+        return (0, socket.inet_aton(ip))
+    except socket.error:
+        return (1, ip)
+
+
+# where a row in the report came from
+SCANNED = "scanned"
+CACHED = "cached"
+
+# columns only in the report once a row has something in them, so a
+# scan without aliases or slow hosts looks the same as it always has
+OPTIONAL_FIELDS = ["alias_of", "timed_out"]
+
+
 class ScanReport():
 
-    format = """%(ip)s,%(uname.os)s,%(uname.processor)s,%(uname.hardware_platform)s,%(redhat-release.name)s,%(redhat-release.version)s,%(redhat-release.release)s,%(auth.type)s,%(auth.username)s,%(auth.name)s"""
+    format = """%(ip)s,%(port)s,%(uname.os)s,%(uname.processor)s,%(uname.hardware_platform)s,%(redhat-release.name)s,%(redhat-release.version)s,%(redhat-release.release)s,%(auth.type)s,%(auth.username)s,%(auth.name)s"""
     def __init__(self):
         self.ips = {}
-        # ips is a dict of 
+        # ips is a dict of {ip: records.HostRecord}, the record being like
         # {'ip:ip', 'uanme.os':unameresults... etc}
 
+        # (name, value) pairs about the scan itself, printed after the hosts
+        self.summary = []
+
+        # things with a record(ssh_job) to tell about every finished job,
+        # like an AuthMemory or a HostHistory
+        self.observers = []
+
+        # {phase: how many jobs ran out of time in it}
+        self.timed_out = {}
+        # if set, hosts that ran out of time after the connect get a row
+        # too, saying in which phase
+        self.mark_timed_out = False
+
+        # a ResultStore to keep every host's row in, for --max-age
+        self.result_store = None
+        # if set, each row says whether it was scanned or came from the
+        # result store
+        self.mark_cached = False
+        self.cached = 0
+
+        # if set, rows say which other ip a host was found at first, for
+        # hosts with more than one
+        self.mark_aliases = False
+        self.aliases = 0
+
+        # a Journal to write every finished host to as it comes in
+        self.journal = None
+        self.resumed = 0
+
+        # ips left out for being in more than one range of the scan
+        self.duplicates = 0
+        # hostnames with no ip, which weren't scanned
+        self.unresolved = 0
+
+        # the OPTIONAL_FIELDS some row has a value for
+        self.present = set()
+
+        # the strings the rows share, see records
+        self.values = records.Values()
+
+        # sinks.ResultSinks to write each row to as it comes in
+        self.sinks = []
+        # if not, rows only go to the sinks, report() just prints the
+        # summary. a result_store, or an observer like HostHistory, still
+        # keeps something for every host.
+        self.keep_rows = True
+
+    def fields(self):
+        """ The names of the fields in a row of the report, in order. """
+        fields = re.findall(r"%\((.*?)\)s", self.format)
+        if self.mark_cached and "source" not in fields:
+            fields.append("source")
+        # rows that go straight out can't wait to see if they're needed
+        if self.mark_aliases and "alias_of" not in fields and \
+                ("alias_of" in self.present or not self.keep_rows):
+            fields.append("alias_of")
+        if self.mark_timed_out and "timed_out" not in fields and \
+                ("timed_out" in self.present or not self.keep_rows):
+            fields.append("timed_out")
+        return fields
+
+    def set_fields(self, fields):
+        """ Report just these fields, in this order. """
+        formats = []
+        for field in fields:
+            formats.append("%%(%s)s" % field)
+        self.format = ",".join(formats)
+
+    def _add_row(self, row):
+        for field in OPTIONAL_FIELDS:
+            if row.get(field) is not None:
+                self.present.add(field)
+        for sink in self.sinks:
+            sink.write(row)
+        if self.keep_rows:
+            self.ips[row['ip']] = row
+
     def add(self, ssh_job):
+        for observer in self.observers:
+            observer.record(ssh_job)
+        if ssh_job.timed_out is not None:
+            self.timed_out[ssh_job.timed_out] = \
+                self.timed_out.get(ssh_job.timed_out, 0) + 1
+
+        # nothing to report for hosts we couldn't get into, unless they
+        # were there but too slow. one that never answered the connect
+        # most likely isn't there at all.
+        if ssh_job.connection_result == "FAILED" or ssh_job.auth is None:
+            # whatever we had for it is out of date now, --max-age
+            # mustn't hand it out in place of scanning it
+            if self.result_store is not None:
+                self.result_store.forget(ssh_job.ip)
+            if self.mark_timed_out and \
+                    ssh_job.timed_out not in (None, deadlines.CONNECT):
+                self._add_timed_out(ssh_job)
+            elif self.journal is not None:
+                self.journal.write(ssh_job.ip, None)
+            return
+
         data = {}
         for rho_cmd in ssh_job.rho_cmds:
             data.update(rho_cmd.data)
 #        print data
-        self.ips[ssh_job.ip] = {'ip': ssh_job.ip,
-                                'port':ssh_job.port,
-                                'auth.type': ssh_job.auth.type,
-                                'auth.name': ssh_job.auth.name,
-                                'auth.username': ssh_job.auth.username,
-                                'auth.password': ssh_job.auth.password}
-        self.ips[ssh_job.ip].update(data)
+        # no passwords, the rows are kept and written out
+        data.update({'ip': ssh_job.ip,
+                     'port':ssh_job.port,
+                     'auth.type': ssh_job.auth.type,
+                     'auth.name': ssh_job.auth.name,
+                     'auth.username': ssh_job.auth.username})
+        data['source'] = SCANNED
+        if ssh_job.alias_of is not None:
+            data['alias_of'] = ssh_job.alias_of
+            self.aliases = self.aliases + 1
+        row = records.HostRecord(data, self.values)
+        if self.result_store is not None:
+            self.result_store.put(row, fields=self.fields())
+        if self.journal is not None:
+            self.journal.write(ssh_job.ip, row)
+        self._add_row(row)
 #        print self.ips[ssh_job.ip]
                                 
 
+    def _add_timed_out(self, ssh_job):
+        # what we know of how we got in, none of the commands' data
+        data = {'ip': ssh_job.ip, 'port': ssh_job.port, 'source': SCANNED,
+                'timed_out': ssh_job.timed_out}
+        if ssh_job.auth is not None:
+            data.update({'auth.type': ssh_job.auth.type,
+                         'auth.name': ssh_job.auth.name,
+                         'auth.username': ssh_job.auth.username})
+        row = records.HostRecord(data, self.values)
+        if self.journal is not None:
+            self.journal.write(ssh_job.ip, row)
+        self._add_row(row)
+
+    def add_cached(self, row):
+        """ Report a row from a ResultStore, for a host we didn't scan. """
+        row = dict(row)
+        row['source'] = CACHED
+        row = records.HostRecord(row, self.values)
+        self.cached = self.cached + 1
+        if self.journal is not None:
+            self.journal.write(row['ip'], row)
+        self._add_row(row)
+
+    def resume(self, journal):
+        """ Report the hosts an earlier run wrote to journal. """
+        for ip, row in journal.rows():
+            self.resumed = self.resumed + 1
+            if row is not None:
+                self._add_row(records.HostRecord(row, self.values))
+
+    def close(self):
+        """
+        Close the sinks, once there's nothing more to report. If any of
+        them fail, the rest are still closed and the first error raised.
+        """
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def set_summary(self, name, value):
+        for i in range(len(self.summary)):
+            if self.summary[i][0] == name:
+                self.summary[i] = (name, value)
+                return
+        self.summary.append((name, value))
+
     def report(self):
+        if self.timed_out:
+            counts = []
+            for phase in deadlines.PHASES:
+                if phase in self.timed_out:
+                    counts.append("%s %s" % (self.timed_out[phase], phase))
+            self.set_summary(_("out of time"), ", ".join(counts))
+        if self.cached:
+            self.set_summary(_("from cache"), self.cached)
+        if self.resumed:
+            self.set_summary(_("from journal"), self.resumed)
+        if self.aliases:
+            self.set_summary(_("aliases"), self.aliases)
+        if self.duplicates:
+            self.set_summary(_("duplicates removed"), self.duplicates)
+        if self.unresolved:
+            self.set_summary(_("unresolved hostnames"), self.unresolved)
+
+        if not self.keep_rows:
+            # the rows have gone out already, keep the summary out of
+            # their way
+            for name, value in self.summary:
+                print >> sys.stderr, "# %s: %s" % (name, value)
+            return
+
+        formats = []
+        for field in self.fields():
+            formats.append("%%(%s)s" % field)
+        format = ",".join(formats)
 
         # hah, need to print out a real header
         print
-        print "#,%s" % self.format
-        for ip in self.ips.keys():
-            print self.format % self.ips[ip]
+        print "#,%s" % format
+        # sorted, so the report doesn't depend on what finished first
+        ips = self.ips.keys()
+        ips.sort(key=_ip_sort_key)
+        for ip in ips:
+            print format % self.ips[ip]
             # ip, uname.os, uname.process, uname.hardware_platform, redhat-release.name, redhat-release.version, redhat-release.release
+        for name, value in self.summary:
+            print "# %s: %s" % (name, value)
+
+def _union(first, second):
+    """ first, then whatever of second isn't in it. """
+    union = list(first)
+    for item in second:
+        if item not in union:
+            union.append(item)
+    return union
+
+
+class ScanIps(object):
+    """
+    Which profile of a scan each ip is scanned with, the first that has
+    it by range or by hostname. The hostnames are looked up while the
+    scan runs, and each answer is handed to a profile as it comes in.
+    """
+
+    def __init__(self, scanner, profiles):
+        self.report = scanner.ssh_jobs.report
+        # an rho_ips.IpSet for each profile of all its ips, hostnames as
+        # they're answered, and one of the range ips it's to scan
+        self.all_sets, self.ip_sets, duplicates = \
+            scanner._merge_profiles(profiles)
+        self.report.duplicates = self.report.duplicates + duplicates
+        # range ips that a hostname of an earlier profile has taken
+        self.moved = rho_ips.IpSet()
+        # the hostname ips each profile is to scan, in the order they came
+        self.hostname_ips = []
+        # {hostname ip: the profile that scans it}
+        self.owners = {}
+        # {hostname: the profile of each time it's listed}
+        self.listed = {}
+        # how many of each profile's hostnames are still to be answered
+        self.unanswered = []
+
+        hostnames = []
+        for i in range(len(profiles)):
+            self.hostname_ips.append([])
+            self.unanswered.append(0)
+            for hostname in scanner._hostnames(profiles[i]):
+                if hostname not in self.listed:
+                    self.listed[hostname] = []
+                    hostnames.append(hostname)
+                self.listed[hostname].append(i)
+                self.unanswered[i] = self.unanswered[i] + 1
+        self.lookups = scanner.resolver.resolve(hostnames)
+
+    def take_answers(self):
+        """ Hand out the answers that are in. """
+        if self.lookups.pending:
+            for hostname, ip in self.lookups.ready():
+                self._answer(hostname, ip)
+
+    def wait(self, i):
+        """ Wait for another of profile i's answers, if it has any to come. """
+        if self.unanswered[i]:
+            hostname, ip = self.lookups.wait()
+            self._answer(hostname, ip)
+        self.take_answers()
+
+    def _owner(self, ip):
+        if ip in self.owners:
+            return self.owners[ip]
+        if ip in self.moved:
+            return None
+        for i in range(len(self.ip_sets)):
+            if ip in self.ip_sets[i]:
+                return i
+        return None
+
+    def _answer(self, hostname, ip):
+        listed = self.listed[hostname]
+        for i in listed:
+            self.unanswered[i] = self.unanswered[i] - 1
+        if ip is None:
+            self.report.unresolved = self.report.unresolved + len(listed)
+            return
+        # so the ip's job, if it's still to come, has all their ports and
+        # auths
+        for i in listed:
+            self.all_sets[i].add_ip(ip)
+
+        # each profile has all its hostnames answered before it's done, so
+        # none of listed have been scanned yet
+        first = listed[0]
+        owner = self._owner(ip)
+        duplicates = len(listed)
+        if owner is None or owner > first:
+            if owner is not None:
+                # a later profile's range, it isn't being scanned yet
+                self.moved.add_ip(ip)
+            else:
+                duplicates = duplicates - 1
+            self.owners[ip] = first
+            self.hostname_ips[first].append(ip)
+        self.report.duplicates = self.report.duplicates + duplicates
+
 
 class Scanner():
     def __init__(self, config=None):
         self.config = config
         self.profiles = []
 #        self.default_rho_cmd_classes= [rho_cmds.UnameRhoCmd]
-        self.default_rho_cmd_classes = [rho_cmds.UnameRhoCmd, rho_cmds.RedhatReleaseRhoCmd]
+        self.default_rho_cmd_classes = [rho_cmds.UnameRhoCmd,
+                                        rho_cmds.HostnameRhoCmd,
+                                        rho_cmds.RedhatReleaseRhoCmd]
+        # what get_rho_cmds() gives every job
+        self.rho_cmd_classes = self.default_rho_cmd_classes
         self.ssh_jobs = ssh_jobs.SshJobs()
         self.output = []
         self.auths = []
         self.missing_auths = []
 
+        # settings for every SshJob we make
+        self.batch = False
+        self.channels = 1
+        # {deadlines phase: seconds}, for SshJob.set_timeout()
+        self.timeouts = {}
+
+        # an auth_memory.AuthMemory, to try the auth that worked last time
+        # first
+        self.auth_memory = None
+        # a history.HostHistory, to scan the hosts most likely to answer
+        # first
+        self.history = None
+
+        # with a result_store.ResultStore, hosts scanned in the last max_age
+        # seconds aren't scanned again, their stored rows are reported
+        self.result_store = None
+        self.max_age = None
+
+        # a fact_cache.FactCache, so commands with a cache_ttl aren't run
+        # on hosts we have recent answers for
+        self.fact_cache = None
+
+        # if set, hosts found at more than one ip are only inventoried at
+        # the first
+        self.find_aliases = False
+        # the aliases.HostAliases of the scan being run, if find_aliases
+        self.aliases = None
+
+        # a journal.Journal, open for writing. hosts already in it (from a
+        # run we're resuming) aren't scanned again.
+        self.journal = None
+
+        # a resolver.Resolver to look up the hostnames in profiles with
+        self.resolver = resolver.Resolver()
+
     def _find_auths(self, authnames):
         # FIXME: this seems like a reasonable place to plug in a "default" auth
         # if we like, maybe?  -akl
@@ -68,37 +421,219 @@ class Scanner():
             else:
                 self.missing_auths.append(authname) 
 
+    def _profile_auths(self, profile):
+        """ The credentials of profile that the config has. """
+        auths = []
+        for authname in profile.credential_names:
+            auth = self.config.get_credentials(authname)
+            if auth:
+                auths.append(auth)
+        return auths
+
+    def _overlaps(self, profiles, all_sets):
+        """
+        (ips, ports, auths) for each of profiles, so an ip that's in one
+        of them as well can be scanned with what it gives too.
+        """
+        overlaps = []
+        for profile, ips in zip(profiles, all_sets):
+            overlaps.append((ips, self._ports(profile),
+                             self._profile_auths(profile)))
+        return overlaps
+
     # FIXME: auth will go away, look it up based on lists of auth
     # associated with each profile -akl
     def scan_profiles(self, profilenames):
         missing_profiles = []
-        ssh_job_list = []
+        if self.journal is not None and self.ssh_jobs.report.journal is None:
+            # before anything new is written to it
+            self.ssh_jobs.report.resume(self.journal)
+            self.ssh_jobs.report.journal = self.journal
+
+        profiles = []
         for profilename in profilenames:
             profile = self.config.get_group(profilename)
             if profile is None:
                 missing_profiles.append(profilename)
-                continue
-            ips = []
-            for range_str in profile.ranges:
-                ipr = rho_ips.RhoIpRange(range_str)
-                ips.extend(ipr.list_ips())
+            else:
+                profiles.append(profile)
+        # each scan starts knowing of no hosts
+        if self.find_aliases:
+            self.aliases = aliases.HostAliases()
+        else:
+            self.aliases = None
 
+        # an ip in more than one profile, as a range or a hostname, is
+        # scanned once, as part of the first, but with the ports and auths
+        # of all of them. the hostnames are looked up from here on, as the
+        # ranges are scanned.
+        scan_ips = ScanIps(self, profiles)
+
+        for i in range(len(profiles)):
+            profile = profiles[i]
             self._find_auths(profile.credential_names)
-            for ip in ips:
-                #FIXME: look up auth -akl
-                sshj = ssh_jobs.SshJob(ip=ip, rho_cmds=self.get_rho_cmds(), auths=self.auths)
-                ssh_job_list.append(sshj)
-            self.ssh_jobs.ssh_jobs = ssh_job_list
+            overlaps = self._overlaps(profiles[i + 1:],
+                                      scan_ips.all_sets[i + 1:])
+            # jobs are generated as the ssh workers ask for them, a copy
+            # of the auths as the next profile's are added to them
+            self.ssh_jobs.ssh_jobs = self._gen_ssh_jobs(profile,
+                                                        list(self.auths),
+                                                        scan_ips, i, overlaps)
+            self.ssh_jobs.report.observers = []
+            if self.auth_memory is not None:
+                self.ssh_jobs.report.observers.append(self.auth_memory)
+            if self.history is not None:
+                self.ssh_jobs.report.observers.append(self.history)
+            if self.fact_cache is not None:
+                self.ssh_jobs.report.observers.append(self.fact_cache)
+            self.ssh_jobs.fact_cache = self.fact_cache
+            self.ssh_jobs.report.result_store = self.result_store
+            self.ssh_jobs.report.mark_cached = self.max_age is not None
+            self.ssh_jobs.report.mark_aliases = self.find_aliases
+            self.ssh_jobs.aliases = self.aliases
             self.run_scan()
+            if self.auth_memory is not None:
+                self.auth_memory.save()
+                self.ssh_jobs.report.set_summary(_("credential memory"),
+                                                 self.auth_memory.summary())
+            if self.history is not None:
+                self.history.save()
+            if self.result_store is not None:
+                self.result_store.save()
+            if self.fact_cache is not None:
+                self.fact_cache.save()
+                self.ssh_jobs.report.set_summary(_("fact cache hits"),
+                                                 self.fact_cache.hits)
             self.report()
 
         return missing_profiles
 
+    def _hostnames(self, profile):
+        hostnames = []
+        for range_str in profile.ranges:
+            if rho_ips.is_hostname(range_str):
+                hostnames.append(range_str)
+        return hostnames
+
+    def _merge_profiles(self, profiles):
+        """
+        Two lists with an rho_ips.IpSet for each profile, the first of all
+        its ips, the second leaving out the ips of earlier profiles, and
+        how many ips were left out as duplicates, within a profile or
+        across them. Hostnames are left to ScanIps.
+        """
+        seen = rho_ips.IpSet()
+        all_sets = []
+        ip_sets = []
+        duplicates = 0
+        for profile in profiles:
+            ips = rho_ips.IpSet()
+            for range_str in profile.ranges:
+                if rho_ips.is_hostname(range_str):
+                    continue
+                ipr = rho_ips.RhoIpRange(range_str, self.resolver)
+                duplicates = duplicates + len(ipr)
+                ips.add_range(ipr)
+            all_sets.append(ips)
+            ips = ips.difference(seen)
+            seen.update(ips)
+            duplicates = duplicates - len(ips)
+            ip_sets.append(ips)
+        return all_sets, ip_sets, duplicates
+
+    def _ports(self, profile):
+        ports = []
+        for port in profile.ports:
+            ports.append(int(port))
+        return ports
+
+    def _profile_ips(self, scan_ips, i):
+        """
+        The ips to scan as profile i of scan_ips: its ranges, then its
+        hostnames as they're answered, each lot in history order.
+        """
+        ranges = scan_ips.ip_sets[i]
+        done = 0
+        while True:
+            scan_ips.take_answers()
+            hostname_ips = scan_ips.hostname_ips[i][done:]
+            done = done + len(hostname_ips)
+
+            def lot(ranges=ranges, hostname_ips=hostname_ips):
+                for ip in ranges:
+                    if ip not in scan_ips.moved:
+                        yield ip
+                for ip in hostname_ips:
+                    yield ip
+            if self.history is not None:
+                ips = self.history.order(lot)
+            else:
+                ips = lot()
+            for ip in ips:
+                # so the later profiles' hostnames have their say in the
+                # jobs still to come
+                scan_ips.take_answers()
+                yield ip
+
+            if not scan_ips.unanswered[i] and \
+                    done == len(scan_ips.hostname_ips[i]):
+                return
+            ranges = ()
+            scan_ips.wait(i)
+
+    def _gen_ssh_jobs(self, profile, auths, scan_ips=None, i=0,
+                      overlaps=()):
+        # overlaps is from _overlaps(), for the profiles after profile i
+        ports = self._ports(profile)
+
+        if scan_ips is None:
+            scan_ips = ScanIps(self, [profile])
+        # a stored row has to have everything this report wants
+        fields = self.ssh_jobs.report.fields()
+
+        for ip in self._profile_ips(scan_ips, i):
+            if self.journal is not None and ip in self.journal.done:
+                continue
+            if self.max_age is not None and self.result_store is not None:
+                row = self.result_store.fresh(ip, self.max_age,
+                                              fields=fields)
+                if row is not None:
+                    self.ssh_jobs.report.add_cached(row)
+                    continue
+
+            job_ports = ports
+            job_auths = auths
+            for other_ips, other_ports, other_auths in overlaps:
+                if ip in other_ips:
+                    job_ports = _union(job_ports, other_ports)
+                    job_auths = _union(job_auths, other_auths)
+
+            #FIXME: look up auth -akl
+            ssh_job = ssh_jobs.SshJob(ip=ip, ports=job_ports,
+                                      rho_cmds=self.get_rho_cmds(),
+                                      auths=job_auths)
+            ssh_job.batch = self.batch
+            ssh_job.channels = self.channels
+            for phase, seconds in self.timeouts.items():
+                ssh_job.set_timeout(phase, seconds)
+            if self.auth_memory is not None:
+                ssh_job.auth_hints = self.auth_memory.hints(ip)
+            yield ssh_job
+
+    def set_fields(self, fields):
+        """
+        Report only these fields, and only run the commands they need.
+        Raises rho_cmds.UnknownFieldsError if no command gives some of them.
+        """
+        self.rho_cmd_classes = rho_cmds.plan_rho_cmds(fields,
+                self.default_rho_cmd_classes)
+        self.ssh_jobs.report.set_fields(fields)
+
     def get_rho_cmds(self, rho_cmd_classes=None):
         if not rho_cmd_classes:
-            self.rho_cmd_classes = self.default_rho_cmd_classes
+            rho_cmd_classes = self.rho_cmd_classes
         rho_cmds  = []
-        for rho_cmd_class in self.rho_cmd_classes:
+        for rho_cmd_class in rho_cmd_classes:
             rho_cmds.append(rho_cmd_class())
         return rho_cmds
 
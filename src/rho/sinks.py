@@ -0,0 +1,113 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Writers that put each host's report row out as soon as it's done """
+
+# ScanReport hands every row to its sinks as the host finishes, instead of
+# keeping them all to print at the end. Each row is flushed as it's
+# written, so the output can be tailed while the scan runs. Fields a row
+# doesn't have (a command that failed, say) are written empty.
+
+import csv
+import threading
+
+import simplejson as json
+
+CSV = "csv"
+JSON_LINES = "jsonl"
+FORMATS = [CSV, JSON_LINES]
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+class ResultSink(object):
+    """
+    Takes report rows one at a time. Subclasses write them out in
+    _write(). write() may be called from more than one thread.
+    """
+
+    def __init__(self, out, fields):
+        self.out = out
+        self.fields = fields
+        self.lock = threading.Lock()
+        self.started = False
+
+    def write(self, row):
+        self.lock.acquire()
+        try:
+            if not self.started:
+                self._start()
+                self.started = True
+            self._write(row)
+            self.out.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ Finish off the output. The caller closes out. """
+        self.lock.acquire()
+        try:
+            if not self.started:
+                self._start()
+                self.started = True
+            self.out.flush()
+        finally:
+            self.lock.release()
+
+    def _start(self):
+        pass
+
+    def _write(self, row):
+        raise NotImplementedError
+
+
+class CsvSink(ResultSink):
+    """ CSV with a header line of field names. """
+
+    def __init__(self, out, fields):
+        ResultSink.__init__(self, out, fields)
+        self.writer = csv.writer(out)
+
+    def _start(self):
+        self.writer.writerow(self.fields)
+
+    def _write(self, row):
+        values = []
+        for field in self.fields:
+            values.append(_text(row.get(field)))
+        self.writer.writerow(values)
+
+
+class JsonLinesSink(ResultSink):
+    """ One JSON object per line, with the fields as keys. """
+
+    def _write(self, row):
+        values = {}
+        for field in self.fields:
+            value = row.get(field)
+            if value is None:
+                value = ""
+            values[field] = value
+        self.out.write(json.dumps(values) + "\n")
+
+
+def make_sink(format, out, fields):
+    if format == CSV:
+        return CsvSink(out, fields)
+    if format == JSON_LINES:
+        return JsonLinesSink(out, fields)
+    raise ValueError(format)
@@ -12,6 +12,11 @@
 import my_sshpt
 import scanner
 import config
+import ssh_loop
+import concurrency
+import deadlines
+import multiscan
+import retry
 
 import os
 import posix
@@ -38,12 +43,15 @@ class SshAuth(Auth):
 #FIXME: SshJob needs to have a RhoJobsList, where each RhoJob item actually has
 # a list of cli commands to run
 class SshJob():
-    def __init__(self, ip=None, port=22, rho_cmds=None, auths=None, timeout=30):
+    def __init__(self, ip=None, port=22, rho_cmds=None, auths=None,
+                 timeout=deadlines.DEFAULT_CONNECT_TIMEOUT, ports=None):
         # rho_cmds really needs to be list like, easy mistake to make...
         assert getattr(rho_cmds, "__iter__")
 
         self.ip = ip
-        self.port = port
+        # the ports to try, and once connected, the one that worked
+        self.ports = ports or [port]
+        self.port = self.ports[0]
 
         # rho commands is RhoCmdList, aka, a list of RhoCmds (duh)
         self.rho_cmds = rho_cmds
@@ -54,12 +62,70 @@ class SshJob():
         # the auth we actually used
         self.auth = None
 
+        # timeout is for the connect, the rest of the phases' time limits
+        # are in timeouts, by deadlines phase
         self.timeout = timeout
+        self.timeouts = dict(deadlines.DEFAULT_TIMEOUTS)
+        # the phase we ran out of time in, if we did
+        self.timed_out = None
+        # which go at the job this is, see retry.RetryQueue
+        self.attempts = 1
         self.command_output = None
         self.connection_result = True
         self.returncode = None
         self.auth_used = None
 
+        # when we started connecting, how long the event loop took to
+        # connect and see the banner, and how long it took to get through
+        # key exchange (not counting any wait for an SSHThread)
+        self.start_time = None
+        self.banner_latency = None
+        self.connect_latency = None
+
+        # an already connected socket, if something (the event loop) did
+        # the tcp connect for us
+        self.sock = None
+
+        # run all the rho_cmds in one remote command
+        self.batch = False
+        # or run this many at once, each on a channel of its own
+        self.channels = 1
+
+        # {host key fingerprint: auth name} of auths that worked before,
+        # the host's fingerprint once we have it, and the auth we tried
+        # first because of it
+        self.auth_hints = {}
+        self.host_key = None
+        self.auth_hint = None
+
+        # another ip we found the same host at, and took the data from
+        self.alias_of = None
+
+        # which job this is to multiscan, while a worker process has it
+        self.shard_seq = None
+
+    def reset(self):
+        """ Forget how the last attempt went, so the job can be run again. """
+        self.port = self.ports[0]
+        self.auth = None
+        self.command_output = None
+        self.connection_result = True
+        self.returncode = None
+        self.start_time = None
+        self.banner_latency = None
+        self.connect_latency = None
+        self.sock = None
+        self.host_key = None
+        self.auth_hint = None
+        self.timed_out = None
+        self.alias_of = None
+
+    def set_timeout(self, phase, seconds):
+        if phase == deadlines.CONNECT:
+            self.timeout = seconds
+        else:
+            self.timeouts[phase] = seconds
+
     def output(self):
         print "ip: %s\n" % self.ip 
         print "command_output: %s" % self.command_output
@@ -82,13 +148,43 @@ class SshJob():
 
 class SshJobs():
     def __init__(self, ssh_job_src=[]):
-        # cmdSrc is some sort of list/iterator thing
+        # cmdSrc is some sort of list/iterator thing, it's only iterated
+        # once, as fast as the jobs can be run
         self.ssh_jobs = ssh_job_src
 
         self.verbose = True
         self.output = scanner.ScanReport()
         self.max_threads = 10  
 
+        # "events" waits on connects and banners in one poll() loop, and
+        # only uses the threads for the paramiko work. "threads" is the
+        # original one connection per thread engine.
+        self.engine = "events"
+        # how many hosts to have in flight, an int, "auto" to let an
+        # AimdLimiter work it out, or None for the engine's default
+        self.concurrency = None
+        self.limiter = None
+
+        # more than one splits the jobs over that many worker processes,
+        # each running its own engine
+        self.processes = 1
+
+        # if set, do the tcp connect with a non-blocking sweep that gives
+        # up on a host after this many seconds
+        self.sweep_timeout = None
+
+        # jobs that fail in a way that might not last get this many goes
+        # in all, the retries retry_delay seconds apart and doubling
+        self.max_attempts = retry.DEFAULT_MAX_ATTEMPTS
+        self.retry_delay = retry.DEFAULT_RETRY_DELAY
+        self.retries = None
+
+        # a fact_cache.FactCache the threads answer commands from, if set
+        self.fact_cache = None
+        # an aliases.HostAliases, if hosts seen at another ip are to be
+        # reported as aliases of it
+        self.aliases = None
+
         self.report = scanner.ScanReport()
 
     def run_jobs(self, ssh_jobs=None, callback=None):
@@ -96,18 +192,120 @@ class SshJobs():
             self.ssh_jobs = ssh_jobs
         
         self.output_queue = my_sshpt.startOutputThread(self.verbose, self.output, report=self.report)
-        self.ssh_connect_queue = my_sshpt.startSSHQueue(self.output_queue, self.max_threads)
-
-        while self.ssh_jobs:
-            for ssh_job in self.ssh_jobs:
-                
-                if self.ssh_connect_queue.qsize()  <= self.max_threads:
-                    my_sshpt.queueSSHConnection(self.ssh_connect_queue, ssh_job)
-                    self.ssh_jobs.remove(ssh_job)
-#            time.sleep(1)
-        self.ssh_connect_queue.join()
+        if self.processes > 1:
+            multiscan.run_jobs(self.ssh_jobs, self.output_queue, self.report,
+                               self.processes, self.settings())
+            self.ssh_jobs = []
+            return self.output_queue
+
+        if self.engine == "events":
+            self._run_jobs_loop(ssh_loop.DEFAULT_CONCURRENCY)
+            return self.output_queue
+        if self.sweep_timeout:
+            # the loop as a plain tcp sweep in front of the threads. the
+            # connects are as cheap as with the events engine, only the
+            # ssh work is held to max_threads
+            self._run_jobs_loop(ssh_loop.DEFAULT_CONCURRENCY,
+                                threads=self.max_threads,
+                                wait_for_banner=False)
+            return self.output_queue
+
+        self.limiter = self._make_limiter(self.max_threads)
+        retry_job = self._start_retries(self._requeue)
+        # only keep as many jobs waiting as there are threads, so we block
+        # here instead of reading the whole job source in
+        self.ssh_connect_queue = my_sshpt.startSSHQueue(self.output_queue,
+                                                        self.limiter.maximum,
+                                                        job_done=self.limiter.release,
+                                                        queue_size=self.limiter.maximum,
+                                                        retry=retry_job,
+                                                        fact_cache=self.fact_cache,
+                                                        aliases=self.aliases)
+
+        for ssh_job in self.ssh_jobs:
+            self.limiter.acquire()
+            my_sshpt.queueSSHConnection(self.ssh_connect_queue, ssh_job)
+        self.ssh_jobs = []
+
+        # retries included
+        self.limiter.wait()
+        self._stop_retries()
+        self._report_concurrency()
         return self.output_queue
 
+    # what a worker process needs to run jobs the way we would
+    SETTINGS = ["engine", "concurrency", "max_threads", "sweep_timeout",
+                "max_attempts", "retry_delay", "fact_cache", "aliases"]
+
+    def settings(self):
+        settings = {}
+        for name in self.SETTINGS:
+            settings[name] = getattr(self, name)
+        return settings
+
+    def _requeue(self, ssh_job):
+        self.limiter.acquire(parked=True)
+        my_sshpt.queueSSHConnection(self.ssh_connect_queue, ssh_job)
+
+    def _start_retries(self, add):
+        """ Start a RetryQueue feeding add(), returns its retry() or None """
+        if self.max_attempts <= 1:
+            return None
+        self.retries = retry.RetryQueue(self.limiter, add,
+                                        max_attempts=self.max_attempts,
+                                        delay=self.retry_delay)
+        self.retries.start()
+        return self.retries.retry
+
+    def _stop_retries(self):
+        if self.retries is None:
+            return
+        self.retries.quit()
+        self.retries.join()
+        if self.retries.retried:
+            self.report.set_summary(_("retries"), self.retries.retried)
+
+    def _make_limiter(self, default):
+        if self.concurrency == "auto":
+            return concurrency.AimdLimiter()
+        return concurrency.ConcurrencyLimiter(self.concurrency or default)
+
+    def _report_concurrency(self):
+        if self.concurrency == "auto":
+            self.report.set_summary(_("concurrency"), self.limiter.limit)
+
+    def _run_jobs_loop(self, default_concurrency, threads=None,
+                       wait_for_banner=True):
+        self.limiter = self._make_limiter(default_concurrency)
+        if threads is None:
+            threads = self.limiter.maximum
+        loop = ssh_loop.SshEventLoop(self.output_queue, self.limiter,
+                                     connect_timeout=self.sweep_timeout,
+                                     wait_for_banner=wait_for_banner,
+                                     threads=threads)
+        loop.retry = self._start_retries(loop.add_parked)
+        # by default a thread for every job that can be in flight, they're
+        # only started as hosts get past the banner
+        self.ssh_connect_queue = my_sshpt.startSSHQueue(self.output_queue,
+                                                        threads,
+                                                        job_done=loop.job_done,
+                                                        retry=loop.retry,
+                                                        fact_cache=self.fact_cache,
+                                                        aliases=self.aliases)
+        loop.ssh_connect_queue = self.ssh_connect_queue
+        loop.start()
+
+        for ssh_job in self.ssh_jobs:
+            loop.add(ssh_job)
+        self.ssh_jobs = []
+
+        # retries included
+        loop.wait()
+        self._stop_retries()
+        loop.quit()
+        loop.join()
+        self._report_concurrency()
+
 
 if __name__ == "__main__":  
 
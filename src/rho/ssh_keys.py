@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Private keys for ssh_key credentials, parsed once and shared """
+
+import StringIO
+import threading
+
+import paramiko
+
+# the key classes to try, most likely first. the newer key types are
+# only there with newer paramikos.
+KEY_CLASS_NAMES = ["RSAKey", "DSSKey", "ECDSAKey", "Ed25519Key"]
+
+
+def key_classes():
+    classes = []
+    for name in KEY_CLASS_NAMES:
+        key_class = getattr(paramiko, name, None)
+        if key_class is not None:
+            classes.append(key_class)
+    return classes
+
+
+def parse_key(key, passphrase=None):
+    """
+    Parse a private key of any type paramiko knows, decrypting it with
+    passphrase if need be. Raises paramiko.SSHException if it can't.
+    """
+    error = paramiko.SSHException(_("not a private key rho can use"))
+    for key_class in key_classes():
+        try:
+            return key_class.from_private_key(StringIO.StringIO(key),
+                                              passphrase)
+        except paramiko.PasswordRequiredException, detail:
+            # it's this type, but we can't get into it
+            raise
+        except paramiko.SSHException, detail:
+            error = detail
+    raise error
+
+
+class KeyCache(object):
+    """
+    Parsed keys, keyed by the key text and passphrase, so each one is
+    decrypted once no matter how many hosts we try it on. Keys that won't
+    parse are remembered too, and get the same exception every time.
+
+    paramiko only reads the key objects when signing, so the SSHThreads can
+    share them.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def get(self, auth):
+        """ The paramiko key for an ssh_key credential. """
+        # an empty passphrase means the key isn't encrypted
+        cache_key = (auth.key, auth.password or None)
+        self.lock.acquire()
+        try:
+            if cache_key not in self.keys:
+                try:
+                    self.keys[cache_key] = parse_key(*cache_key)
+                except paramiko.SSHException, detail:
+                    self.keys[cache_key] = detail
+            pkey = self.keys[cache_key]
+        finally:
+            self.lock.release()
+
+        if isinstance(pkey, Exception):
+            raise pkey
+        return pkey
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.keys = {}
+        finally:
+            self.lock.release()
+
+
+# one for everything in this process
+key_cache = KeyCache()
@@ -0,0 +1,459 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" epoll()/poll() driven connection loop for the "events" scan engine """
+
+# Most of the wall clock time of a scan is spent waiting on the network,
+# either for a tcp connect to finish (or never finish) or for sshd to send
+# its banner. None of that needs a thread, so one thread here keeps every
+# in-flight connection in an epoll (or poll) set. Once the banner is
+# waiting on the socket, the job (and the socket) is handed to the
+# SSHThreads in my_sshpt for the paramiko part, which is thread based no
+# matter what we do.
+#
+# The thread engine can use the same loop as a tcp sweep in front of its
+# threads, without waiting for the banner, so hosts that aren't there
+# fail after the (short) sweep timeout instead of tying up a thread.
+
+import collections
+import errno
+import heapq
+import os
+import select
+import socket
+import threading
+import time
+import Queue
+
+import concurrency
+import deadlines
+
+# how many jobs may be in flight (connecting, waiting on a banner, or
+# being run by a SSHThread) at once
+DEFAULT_CONCURRENCY = 1000
+
+CONNECTING = "connecting"
+BANNER = "banner"
+
+
+class Poller(object):
+    """ epoll where we have it, poll otherwise. Timeouts in seconds. """
+
+    def __init__(self):
+        if hasattr(select, "epoll"):
+            self._poller = select.epoll()
+            self.READ = select.EPOLLIN
+            self.WRITE = select.EPOLLOUT
+            self._scale = 1
+            self._forever = -1
+        else:
+            self._poller = select.poll()
+            self.READ = select.POLLIN
+            self.WRITE = select.POLLOUT
+            self._scale = 1000
+            self._forever = None
+
+    def register(self, fd, events):
+        self._poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self._poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            return self._poller.poll(self._forever)
+        return self._poller.poll(timeout * self._scale)
+
+    def close(self):
+        if hasattr(self._poller, "close"):
+            self._poller.close()
+
+
+class PendingConnection(object):
+    """ A job's socket, to one of its ports, still waiting on the network. """
+
+    def __init__(self, ssh_job, sock, port, siblings):
+        self.ssh_job = ssh_job
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.port = port
+        # connections to the job's other ports, including this one
+        self.siblings = siblings
+        self.deadline = None
+        self.state = CONNECTING
+        self.reason = None
+        self.timed_out = None
+        self.done = False
+
+
+def start_connect(ip, port):
+    """ Start a non-blocking connect, returns (socket, error string). """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(0)
+    try:
+        err = sock.connect_ex((ip, port))
+    except socket.error, detail:
+        sock.close()
+        return (None, str(detail))
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+        sock.close()
+        return (None, os.strerror(err))
+    return (sock, None)
+
+
+def probe_ports(ssh_job, timeout):
+    """
+    Blocking version of the loop's port race, for the thread engine.
+
+    Connects to all of ssh_job.ports at once and returns the socket of the
+    first to send an ssh banner, setting ssh_job.port to match. The others
+    are closed. Raises socket.error if none of them get that far, within
+    timeout seconds if that isn't None.
+    """
+    poller = Poller()
+    socks = {}
+    reason = _("host did not respond")
+    for port in ssh_job.ports:
+        sock, err = start_connect(ssh_job.ip, port)
+        if sock is None:
+            reason = err
+            continue
+        socks[sock.fileno()] = (sock, port)
+        poller.register(sock.fileno(), poller.WRITE)
+
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    winner = None
+    try:
+        while socks and winner is None:
+            left = None
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+            for fd, event in poller.poll(left):
+                sock, port = socks[fd]
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                data = None
+                if not err:
+                    try:
+                        data = sock.recv(256, socket.MSG_PEEK)
+                    except socket.error, detail:
+                        if detail[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                            # connected, now wait for the banner
+                            poller.modify(fd, poller.READ)
+                            continue
+                        err = detail[0]
+                if data:
+                    winner = (sock, port)
+                    break
+                if err:
+                    reason = os.strerror(err)
+                else:
+                    reason = _("connection closed before ssh banner")
+                poller.unregister(fd)
+                sock.close()
+                del socks[fd]
+    finally:
+        poller.close()
+
+    for sock, port in socks.values():
+        if winner is None or sock is not winner[0]:
+            sock.close()
+    if winner is None:
+        raise socket.error(reason)
+
+    sock, ssh_job.port = winner
+    sock.setblocking(1)
+    return sock
+
+
+class SshEventLoop(threading.Thread):
+    """
+    Connects to hosts and waits for their ssh banner from a single thread.
+
+    Jobs are added with add(), which blocks while the limiter is full.
+    Jobs that never get a banner are marked FAILED and sent straight to the
+    output_queue. The rest get the connected socket as ssh_job.sock and are
+    put on ssh_connect_queue. The SSHThreads reading that queue need to call
+    job_done() for every job they finish.
+
+    connect_timeout, if set, replaces ssh_job.timeout for the tcp connect.
+    The wait for the banner gets whatever is left of ssh_job.timeout. With
+    wait_for_banner False, jobs are handed over as soon as they connect.
+
+    threads, if set, is how many jobs the SSHThreads can work on at once,
+    and no more than that are handed over. A host that's ready while
+    they're all busy has its socket closed, left unread it would only run
+    into the server's LoginGraceTime, and its thread connects again. No
+    new connects are started while there are that many such hosts.
+    """
+
+    def __init__(self, output_queue, limiter=None, connect_timeout=None,
+                 wait_for_banner=True, threads=None):
+        threading.Thread.__init__(self, name="SshEventLoop")
+        self.setDaemon(True)
+        self.output_queue = output_queue
+        # set by whoever starts the SSHThreads
+        self.ssh_connect_queue = None
+
+        if limiter is None:
+            limiter = concurrency.ConcurrencyLimiter(DEFAULT_CONCURRENCY)
+        self.limiter = limiter
+        self.connect_timeout = connect_timeout
+        self.wait_for_banner = wait_for_banner
+        # retry.RetryQueue.retry, to give failed jobs another go
+        self.retry = None
+
+        self.threads = threads
+        # jobs with the SSHThreads, and ready ones waiting for them
+        self.handed = 0
+        self.ready = collections.deque()
+        self.hand_lock = threading.Lock()
+
+        self.incoming = Queue.Queue()
+        self.pending = {}
+        self.deadlines = []
+        self.poller = Poller()
+        self.quitting = False
+
+        # self pipe, so add() can wake up a sleeping poll()
+        self._wake_r, self._wake_w = os.pipe()
+        self.poller.register(self._wake_r, self.poller.READ)
+
+    def add(self, ssh_job):
+        """ Queue a job for connecting, blocks while the loop is full. """
+        self.limiter.acquire()
+        self.incoming.put(ssh_job)
+        self._wake()
+
+    def add_parked(self, ssh_job):
+        """ add() for a job that was park()ed on the limiter. """
+        self.limiter.acquire(parked=True)
+        self.incoming.put(ssh_job)
+        self._wake()
+
+    def job_done(self, ssh_job):
+        """ Free the slot held by a finished job. """
+        self.hand_lock.acquire()
+        try:
+            self.handed = self.handed - 1
+        finally:
+            self.hand_lock.release()
+        self.limiter.release(ssh_job)
+        if self.ready or not self.incoming.empty():
+            self._wake()
+
+    def wait(self):
+        """ Block until every job added so far is finished. """
+        self.limiter.wait()
+
+    def quit(self):
+        self.quitting = True
+        self._wake()
+
+    def _wake(self):
+        os.write(self._wake_w, "x")
+
+    def run(self):
+        while not self.quitting:
+            for fd, event in self.poller.poll(self._poll_timeout()):
+                if fd == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                    self._start_ready()
+                    self._start_new()
+                    continue
+
+                conn = self.pending.get(fd)
+                if conn is None:
+                    continue
+                if conn.state == CONNECTING:
+                    self._connected(conn)
+                else:
+                    self._banner(conn)
+            self._expire()
+
+        self.poller.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _poll_timeout(self):
+        """ Seconds until the next deadline, None to sleep forever. """
+        while self.deadlines and self._stale(self.deadlines[0]):
+            heapq.heappop(self.deadlines)
+        if not self.deadlines:
+            return None
+        return max(0, self.deadlines[0][0] - time.time()) + 0.001
+
+    def _stale(self, entry):
+        deadline, conn = entry
+        return conn.done or conn.deadline != deadline
+
+    def _set_deadline(self, conn, deadline):
+        # old heap entries are skipped once they don't match conn.deadline
+        conn.deadline = deadline
+        heapq.heappush(self.deadlines, (deadline, conn))
+
+    def _give(self, ssh_job):
+        """ Put ssh_job on the ssh_connect_queue, if a thread is free. """
+        self.hand_lock.acquire()
+        try:
+            if self.threads is not None and self.handed >= self.threads:
+                return False
+            self.handed = self.handed + 1
+        finally:
+            self.hand_lock.release()
+        self.ssh_connect_queue.put(ssh_job)
+        return True
+
+    def _start_ready(self):
+        while self.ready and self._give(self.ready[0]):
+            self.ready.popleft()
+
+    def _start_new(self):
+        while self.threads is None or len(self.ready) < self.threads:
+            try:
+                ssh_job = self.incoming.get_nowait()
+            except Queue.Empty:
+                return
+
+            # attemptConnection() knows what to do with these
+            if not ssh_job.ip:
+                if not self._give(ssh_job):
+                    self.ready.append(ssh_job)
+                continue
+
+            ssh_job.start_time = time.time()
+            timeout = self.connect_timeout
+            if timeout is None:
+                timeout = deadlines.Deadlines(ssh_job).seconds(
+                    deadlines.CONNECT)[0]
+            # try all the ports at once, the first to answer wins
+            siblings = []
+            for port in ssh_job.ports:
+                sock, reason = start_connect(ssh_job.ip, port)
+                if sock is None:
+                    continue
+                conn = PendingConnection(ssh_job, sock, port, siblings)
+                siblings.append(conn)
+                self.pending[conn.fd] = conn
+                if timeout is not None:
+                    self._set_deadline(conn, ssh_job.start_time + timeout)
+                self.poller.register(conn.fd, self.poller.WRITE)
+            if not siblings:
+                self._fail_job(ssh_job, reason)
+
+    def _connected(self, conn):
+        err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._fail(conn, os.strerror(err))
+            return
+        # with more than one port, only a banner tells us which is ssh
+        if not self.wait_for_banner and len(conn.siblings) == 1:
+            self._hand_off(conn)
+            return
+        # ssh servers talk first, wait for the banner
+        conn.state = BANNER
+        try:
+            seconds, phase = deadlines.Deadlines(conn.ssh_job).seconds(
+                deadlines.BANNER)
+        except deadlines.DeadlineExceeded, detail:
+            conn.timed_out = detail.phase
+            self._fail(conn, str(detail))
+            return
+        if seconds is None:
+            # makes the connect deadline stale
+            conn.deadline = None
+        else:
+            self._set_deadline(conn, time.time() + seconds)
+        self.poller.modify(conn.fd, self.poller.READ)
+
+    def _banner(self, conn):
+        # peek, paramiko wants to read the banner itself
+        try:
+            data = conn.sock.recv(256, socket.MSG_PEEK)
+        except socket.error, detail:
+            self._fail(conn, str(detail))
+            return
+        if not data:
+            self._fail(conn, _("connection closed before ssh banner"))
+            return
+        self._hand_off(conn)
+
+    def _hand_off(self, conn):
+        self._forget(conn)
+        for sibling in conn.siblings:
+            if not sibling.done:
+                self._forget(sibling)
+                sibling.sock.close()
+        conn.sock.setblocking(1)
+        conn.ssh_job.banner_latency = time.time() - conn.ssh_job.start_time
+        conn.ssh_job.sock = conn.sock
+        conn.ssh_job.port = conn.port
+        if not self._give(conn.ssh_job):
+            # the thread connects again, the wait isn't the host's doing
+            conn.ssh_job.sock = None
+            conn.ssh_job.banner_latency = None
+            conn.sock.close()
+            self.ready.append(conn.ssh_job)
+
+    def _expire(self):
+        now = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            entry = heapq.heappop(self.deadlines)
+            if self._stale(entry):
+                continue
+            conn = entry[1]
+            if conn.state == CONNECTING:
+                conn.timed_out = deadlines.CONNECT
+                # not a sign of trouble, most likely there's no host there
+                self._fail(conn, _("host did not respond"))
+            else:
+                conn.timed_out = deadlines.BANNER
+                self._fail(conn, _("timed out waiting for ssh banner"))
+
+    def _forget(self, conn):
+        conn.done = True
+        self.poller.unregister(conn.fd)
+        del self.pending[conn.fd]
+
+    def _fail(self, conn, reason):
+        self._forget(conn)
+        conn.sock.close()
+        conn.reason = reason
+        for sibling in conn.siblings:
+            if not sibling.done:
+                return
+        # every port failed. one that connected says more about the host
+        # than the ones that were refused
+        timed_out = conn.timed_out
+        for sibling in conn.siblings:
+            if sibling.state == BANNER:
+                reason = sibling.reason
+                timed_out = sibling.timed_out
+        self._fail_job(conn.ssh_job, reason, timed_out)
+
+    def _fail_job(self, ssh_job, reason, timed_out=None):
+        ssh_job.connection_result = "FAILED"
+        ssh_job.command_output = reason
+        ssh_job.timed_out = timed_out
+        if self.retry is not None and self.retry(ssh_job):
+            # it'll be back
+            self.limiter.release(ssh_job)
+            return
+        self.output_queue.put(ssh_job)
+        if ssh_job.output_callback:
+            ssh_job.output_callback()
+        self.limiter.release(ssh_job)
@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" The JSON files rho keeps what it learns about hosts in, between scans """
+
+# AuthMemory, HostHistory, ResultStore and FactCache each keep a dict in
+# a file of their own in the state directory. None of them is worth
+# stopping a scan over, so a missing or mangled file is just empty.
+
+import os
+
+import simplejson as json
+
+
+def load(path):
+    """ The dict saved at path, or an empty one. """
+    if not os.path.exists(path):
+        return {}
+    f = open(path)
+    try:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+    finally:
+        f.close()
+
+
+def save(path, data):
+    """ Write data to path, readable by us alone. """
+    save_items(path, data.iteritems())
+
+
+def save_items(path, items):
+    """
+    save() a dict given as (key, value) pairs, which can come from a
+    generator. Only one value is turned into JSON at a time.
+    """
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname, 0700)
+    # write it aside and rename, so a crash can't leave half a file
+    tmp = "%s.tmp" % path
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    f = os.fdopen(fd, "w")
+    try:
+        f.write("{")
+        first = True
+        for key, value in items:
+            if not first:
+                f.write(", ")
+            first = False
+            f.write(json.dumps(key))
+            f.write(": ")
+            json.dump(value, f)
+        f.write("}")
+    finally:
+        f.close()
+    os.rename(tmp, path)
@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for reporting a host's other ips as aliases """
+
+import binascii
+import gettext
+import os
+import unittest
+
+from rho import aliases
+from rho import config
+from rho import my_sshpt
+from rho import rho_cmds
+from rho import scanner
+from rho import ssh_jobs
+
+from my_sshpt_tests import PasswordSshd
+
+gettext.install('rho')
+
+UNAME = {"uname.os": "Linux", "uname.hostname": "multi",
+         "uname.processor": "x86_64", "uname.hardware_platform": "x86_64"}
+
+
+def inventoried_job(ip, host_key):
+    uname = rho_cmds.UnameRhoCmd()
+    uname.data = dict(UNAME)
+    job = ssh_jobs.SshJob(ip=ip, rho_cmds=[uname])
+    job.auth = ssh_jobs.SshAuth(name="cred", username="bob")
+    job.host_key = host_key
+    return job
+
+
+class HostAliasesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.aliases = aliases.HostAliases()
+
+    def test_alias(self):
+        self.aliases.add(inventoried_job("10.0.0.1", "aa"))
+        job = ssh_jobs.SshJob(ip="10.0.0.2", rho_cmds=[rho_cmds.UnameRhoCmd()])
+        job.host_key = "aa"
+        self.assertTrue(self.aliases.fill(job))
+        self.assertEquals("10.0.0.1", job.alias_of)
+        self.assertEquals(UNAME, job.rho_cmds[0].data)
+
+    def test_other_host_key(self):
+        self.aliases.add(inventoried_job("10.0.0.1", "aa"))
+        job = ssh_jobs.SshJob(ip="10.0.0.2", rho_cmds=[rho_cmds.UnameRhoCmd()])
+        job.host_key = "bb"
+        self.assertFalse(self.aliases.fill(job))
+        self.assertEquals(None, job.alias_of)
+
+    def test_first_ip_kept(self):
+        self.aliases.add(inventoried_job("10.0.0.1", "aa"))
+        self.aliases.add(inventoried_job("10.0.0.2", "aa"))
+        self.assertEquals("10.0.0.1", self.aliases.hosts["aa"][0])
+
+    def test_same_ip_again(self):
+        self.aliases.add(inventoried_job("10.0.0.1", "aa"))
+        self.assertFalse(self.aliases.fill(inventoried_job("10.0.0.1", "aa")))
+
+    def test_reported(self):
+        job = inventoried_job("10.0.0.2", "aa")
+        job.alias_of = "10.0.0.1"
+        report = scanner.ScanReport()
+        report.mark_aliases = True
+        report.add(job)
+        self.assertEquals("10.0.0.1", report.ips["10.0.0.2"]["alias_of"])
+        self.assertEquals("alias_of", report.fields()[-1])
+        self.assertEquals(1, report.aliases)
+
+
+class AliasCommandsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = os.environ.pop("SSH_AUTH_SOCK", None)
+        self.aliases = aliases.HostAliases()
+
+    def tearDown(self):
+        if self.agent is not None:
+            os.environ["SSH_AUTH_SOCK"] = self.agent
+        self.sshd.stop()
+
+    def test_commands_skipped(self):
+        # the server never answers a command, so it has to be an alias
+        self.sshd = PasswordSshd({"bob": "good"})
+        self.sshd.start()
+        host_key = binascii.hexlify(PasswordSshd.host_key.get_fingerprint())
+        self.aliases.add(inventoried_job("10.0.0.1", host_key))
+
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=self.sshd.port,
+                              rho_cmds=[rho_cmds.UnameRhoCmd()],
+                              auths=[ssh_jobs.SshAuth(name="good",
+                                                      username="bob",
+                                                      password="good")],
+                              timeout=10)
+        job.set_timeout("command", 5)
+        my_sshpt.attemptConnection(job, aliases=self.aliases)
+        self.assertEquals(None, job.timed_out)
+        self.assertEquals("10.0.0.1", job.alias_of)
+        self.assertEquals(UNAME, job.rho_cmds[0].data)
+
+
+class ScannerAliasesTests(unittest.TestCase):
+
+    def test_fresh_per_scan(self):
+        s = scanner.Scanner(config.Config(groups=[
+            config.Group("p", [], [], ["22"])]))
+        s.find_aliases = True
+        s.run_scan = lambda: None
+        s.report = lambda: None
+        s.scan_profiles(["p"])
+        first = s.aliases
+        s.scan_profiles(["p"])
+        self.assertFalse(first is s.aliases)
+        self.assertTrue(s.ssh_jobs.aliases is s.aliases)
+
+        s.find_aliases = False
+        s.scan_profiles(["p"])
+        self.assertEquals(None, s.ssh_jobs.aliases)
@@ -0,0 +1,113 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for remembering which credential got into which host """
+
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+from rho import auth_memory
+from rho import my_sshpt
+from rho import ssh_jobs
+
+from fixtures import finished_job
+
+gettext.install('rho')
+
+
+def make_auths(*names):
+    auths = []
+    for name in names:
+        auths.append(ssh_jobs.SshAuth(name=name, username=name))
+    return auths
+
+
+class AuthMemoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state", "auths.json")
+        self.auths = make_auths("first", "second", "third")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        memory = auth_memory.AuthMemory(self.path)
+        memory.load()
+        memory.record(finished_job("10.0.0.1", self.auths[2], "aa"))
+        memory.record(finished_job("10.0.0.2", host_key="bb"))
+        memory.save()
+
+        memory = auth_memory.AuthMemory(self.path)
+        memory.load()
+        self.assertEquals({"aa": "third"}, memory.hints("10.0.0.1"))
+        self.assertEquals({}, memory.hints("10.0.0.2"))
+
+    def test_hits_and_misses(self):
+        memory = auth_memory.AuthMemory(self.path)
+        memory.record(finished_job("10.0.0.1", self.auths[0], "aa",
+                                   hint="first"))
+        memory.record(finished_job("10.0.0.2", self.auths[1], "bb",
+                                   hint="first"))
+        memory.record(finished_job("10.0.0.3", host_key="cc", hint="first"))
+        memory.record(finished_job("10.0.0.4", self.auths[1], "dd"))
+        self.assertEquals(1, memory.hits)
+        self.assertEquals(2, memory.misses)
+        # the one that worked in the end is remembered
+        self.assertEquals({"bb": "second"}, memory.hints("10.0.0.2"))
+
+    def test_new_host_key_replaces(self):
+        memory = auth_memory.AuthMemory(self.path)
+        memory.record(finished_job("10.0.0.1", self.auths[0], "aa"))
+        memory.record(finished_job("10.0.0.1", self.auths[1], "bb"))
+        self.assertEquals({"bb": "second"}, memory.hints("10.0.0.1"))
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        f = open(self.path, "w")
+        f.write("{not json")
+        f.close()
+        memory = auth_memory.AuthMemory(self.path)
+        memory.load()
+        self.assertEquals({}, memory.hints("10.0.0.1"))
+
+
+class RememberedAuthFirstTests(unittest.TestCase):
+
+    def setUp(self):
+        self.job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+        self.job.host_key = "aa"
+        self.auths = make_auths("first", "second", "third")
+
+    def _names(self):
+        return [auth.name for auth in self.auths]
+
+    def test_moved_to_front(self):
+        self.job.auth_hints = {"aa": "third"}
+        my_sshpt.rememberedAuthFirst(self.job, self.auths)
+        self.assertEquals(["third", "first", "second"], self._names())
+        self.assertEquals("third", self.job.auth_hint)
+
+    def test_other_host_key(self):
+        self.job.auth_hints = {"bb": "third"}
+        my_sshpt.rememberedAuthFirst(self.job, self.auths)
+        self.assertEquals(["first", "second", "third"], self._names())
+        self.assertEquals(None, self.job.auth_hint)
+
+    def test_auth_not_in_profile(self):
+        self.job.auth_hints = {"aa": "gone"}
+        my_sshpt.rememberedAuthFirst(self.job, self.auths)
+        self.assertEquals(["first", "second", "third"], self._names())
+        self.assertEquals(None, self.job.auth_hint)
@@ -15,6 +15,7 @@ from rho.clicommands import *
 
 import unittest
 import os
+import StringIO
 
 class CliCommandsTests(unittest.TestCase):
     conffile = "test/rho.conf.test"
@@ -41,6 +42,24 @@ class CliCommandsTests(unittest.TestCase):
     def test_profile_add(self):
         self._run_test(ProfileAddCommand(), ["profile", "add", "--name", "profilename"])
 
+    def test_profile_expand(self):
+        self._run_test(ProfileExpandCommand(), ["profile", "expand", "--count"])
+
+    def test_profile_expand_count_overlap(self):
+        cmd = ProfileExpandCommand()
+        cmd.config = config.Config(groups=[
+            config.Group("p", ["10.0.0.0/24", "10.0.0.128/25"], [], ["22"])])
+        (cmd.options, cmd.args) = cmd.parser.parse_args(["expand", "--count"])
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            cmd._do_command()
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(["p\t10.0.0.0/24\t256", "p\t10.0.0.128/25\t128",
+                           "total: 256"], lines)
+
     def test_auth_show(self):
         self._run_test(AuthShowCommand(), ["auth", "show"])
 
@@ -58,3 +77,11 @@ class CliCommandsTests(unittest.TestCase):
                                                  'test/data/encrypted.data'])
         except SystemExit:
             pass
+
+    def test_parse_age(self):
+        self.assertEquals(90, parse_age("90"))
+        self.assertEquals(30 * 60, parse_age("30m"))
+        self.assertEquals(12 * 60 * 60, parse_age("12h"))
+        self.assertEquals(None, parse_age("h"))
+        self.assertEquals(None, parse_age("12y"))
+        self.assertEquals(None, parse_age("-1"))
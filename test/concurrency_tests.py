@@ -0,0 +1,116 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for the scan concurrency limiters """
+
+import gettext
+import unittest
+
+from rho import concurrency
+from rho import deadlines
+
+from fixtures import CRED, finished_job
+
+gettext.install('rho')
+
+
+class IsCongestionTests(unittest.TestCase):
+
+    def _job(self, error, timed_out):
+        job = finished_job(error=error)
+        job.timed_out = timed_out
+        return job
+
+    def test_banner_timeouts(self):
+        # the event loop's and the SSHThread's way of running out of time
+        self.assertTrue(concurrency.is_congestion(self._job(
+            "timed out waiting for ssh banner", deadlines.BANNER)))
+        self.assertTrue(concurrency.is_congestion(self._job(
+            str(deadlines.DeadlineExceeded(deadlines.BANNER)),
+            deadlines.BANNER)))
+
+    def test_other_timeouts(self):
+        self.assertFalse(concurrency.is_congestion(self._job(
+            "host did not respond", deadlines.CONNECT)))
+        self.assertFalse(concurrency.is_congestion(self._job(
+            str(deadlines.DeadlineExceeded(deadlines.COMMAND)),
+            deadlines.COMMAND)))
+
+
+class ConcurrencyLimiterTests(unittest.TestCase):
+
+    def test_limit(self):
+        limiter = concurrency.ConcurrencyLimiter(2)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEquals(2, limiter.in_use)
+        limiter.release()
+        limiter.release()
+        limiter.wait()
+        self.assertEquals(0, limiter.in_use)
+
+
+class AimdLimiterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = concurrency.AimdLimiter(initial=4, maximum=64,
+                                               latency_target=1.0)
+
+    def _run(self, job):
+        self.limiter.acquire()
+        self.limiter.release(job)
+
+    def test_slow_start(self):
+        for i in range(4):
+            self._run(finished_job(auth=CRED, latency=0.1))
+        self.assertEquals(8, self.limiter.limit)
+
+    def test_maximum(self):
+        for i in range(200):
+            self._run(finished_job(auth=CRED, latency=0.1))
+        self.assertEquals(64, self.limiter.limit)
+
+    def test_banner_error_halves(self):
+        for i in range(12):
+            self._run(finished_job(auth=CRED, latency=0.1))
+        self.assertEquals(16, self.limiter.limit)
+        self._run(finished_job(error="Error reading SSH protocol banner"))
+        self.assertEquals(8, self.limiter.limit)
+
+    def test_additive_after_congestion(self):
+        self._run(finished_job(error="timed out"))
+        self.assertEquals(2, self.limiter.limit)
+        # about one more per limit's worth of successes
+        for i in range(3):
+            self._run(finished_job(auth=CRED, latency=0.1))
+        self.assertEquals(3, self.limiter.limit)
+        for i in range(3):
+            self._run(finished_job(auth=CRED, latency=0.1))
+        self.assertEquals(4, self.limiter.limit)
+
+    def test_one_cut_per_window(self):
+        for i in range(12):
+            self._run(finished_job(auth=CRED, latency=0.1))
+        for i in range(8):
+            self.limiter.acquire()
+        for i in range(8):
+            self.limiter.release(finished_job(
+                error="Connection reset by peer"))
+        self.assertEquals(8, self.limiter.limit)
+
+    def test_slow_hosts_hold(self):
+        for i in range(10):
+            self._run(finished_job(auth=CRED, latency=3.0))
+        self.assertEquals(4, self.limiter.limit)
+
+    def test_refused_is_not_congestion(self):
+        self._run(finished_job(error="Connection refused"))
+        self.assertEquals(4, self.limiter.limit)
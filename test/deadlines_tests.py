@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for ssh job time limits """
+
+import gettext
+import threading
+import time
+import unittest
+
+from rho import deadlines
+from rho import ssh_jobs
+
+gettext.install('rho')
+
+
+class DeadlinesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[], timeout=5)
+        self.job.start_time = time.time()
+        self.limits = deadlines.Deadlines(self.job)
+
+    def test_phase_limits(self):
+        self.job.set_timeout(deadlines.AUTH, 7)
+        self.assertEquals((5, deadlines.CONNECT),
+                          self.limits.seconds(deadlines.CONNECT))
+        self.assertEquals((7, deadlines.AUTH),
+                          self.limits.seconds(deadlines.AUTH))
+        self.assertEquals((14, deadlines.AUTH),
+                          self.limits.seconds(deadlines.AUTH, 2))
+
+    def test_no_limit(self):
+        self.job.set_timeout(deadlines.COMMAND, None)
+        self.assertEquals((None, deadlines.COMMAND),
+                          self.limits.seconds(deadlines.COMMAND))
+
+    def test_total_first(self):
+        self.job.set_timeout(deadlines.TOTAL, 3)
+        seconds, phase = self.limits.seconds(deadlines.CONNECT)
+        self.assertEquals(deadlines.TOTAL, phase)
+        self.assertTrue(seconds <= 3)
+
+    def test_out_of_time(self):
+        self.job.set_timeout(deadlines.TOTAL, 3)
+        self.job.start_time = time.time() - 4
+        limits = deadlines.Deadlines(self.job)
+        self.assertRaises(deadlines.DeadlineExceeded, limits.seconds,
+                          deadlines.AUTH)
+
+
+class AlarmTests(unittest.TestCase):
+
+    def setUp(self):
+        self.job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+        self.job.set_timeout(deadlines.AUTH, 0.2)
+        self.limits = deadlines.Deadlines(self.job)
+        self.closed = threading.Event()
+
+    def test_goes_off(self):
+        alarm = self.limits.alarm(deadlines.AUTH, self.closed.set)
+        self.closed.wait(5)
+        self.assertTrue(self.closed.isSet())
+        alarm.cancel()
+        try:
+            alarm.check()
+            self.fail("no DeadlineExceeded")
+        except deadlines.DeadlineExceeded, detail:
+            self.assertEquals(deadlines.AUTH, detail.phase)
+
+    def test_cancelled(self):
+        alarm = self.limits.alarm(deadlines.AUTH, self.closed.set)
+        alarm.cancel()
+        time.sleep(0.4)
+        self.assertFalse(self.closed.isSet())
+        alarm.check()
+
+    def test_in_order(self):
+        went_off = []
+        self.job.set_timeout(deadlines.COMMAND, 0.1)
+        self.limits.alarm(deadlines.AUTH, lambda: went_off.append("auth"))
+        self.limits.alarm(deadlines.COMMAND,
+                          lambda: went_off.append("command"))
+        time.sleep(0.5)
+        self.assertEquals(["command", "auth"], went_off)
@@ -0,0 +1,168 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for reusing the facts that hardly ever change """
+
+import binascii
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+from rho import fact_cache
+from rho import my_sshpt
+from rho import rho_cmds
+from rho import ssh_jobs
+
+from fixtures import CRED, finished_job
+from my_sshpt_tests import PasswordSshd
+
+gettext.install('rho')
+
+DAY = 24 * 60 * 60
+NOW = 1000 * DAY
+
+UNAME = {"uname.os": "Linux", "uname.processor": "x86_64",
+         "uname.hardware_platform": "x86_64"}
+
+
+def uname_cmd(data=None):
+    rho_cmd = rho_cmds.UnameRhoCmd()
+    if data is not None:
+        rho_cmd.data = dict(data)
+    return rho_cmd
+
+
+class FactCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state", "facts.json")
+        self.cache = fact_cache.FactCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[uname_cmd(UNAME)]), NOW)
+        self.cache.save(NOW)
+
+        loaded = fact_cache.FactCache(self.path)
+        loaded.load()
+        self.assertEquals(UNAME, loaded.get("aa", uname_cmd(), NOW))
+
+    def test_ttl(self):
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[uname_cmd(UNAME)]), NOW)
+        later = NOW + rho_cmds.UnameRhoCmd.cache_ttl + 1
+        self.assertEquals(None, self.cache.get("aa", uname_cmd(), later))
+
+    def test_save_drops_expired(self):
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[uname_cmd(UNAME)]), NOW)
+        release = rho_cmds.RedhatReleaseRhoCmd()
+        release.data = {"redhat-release.name": "redhat-release",
+                        "redhat-release.version": "5Server",
+                        "redhat-release.release": "5.4.0.3"}
+        self.cache.record(finished_job(auth=CRED, host_key="bb",
+                                       rho_cmds=[release]), NOW)
+        self.cache.save(NOW + rho_cmds.RedhatReleaseRhoCmd.cache_ttl + 1)
+
+        loaded = fact_cache.FactCache(self.path)
+        loaded.load()
+        self.assertEquals(["aa"], loaded.hosts.keys())
+
+    def test_hostname_not_cached(self):
+        hostname = rho_cmds.HostnameRhoCmd()
+        hostname.data = {"uname.hostname": "old"}
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[uname_cmd(UNAME), hostname]),
+                          NOW)
+        self.assertEquals(["uname"], self.cache.hosts["aa"].keys())
+
+        # what an older rho kept, uname and all
+        self.cache.hosts["aa"]["uname"]["data"]["uname.hostname"] = "old"
+        self.assertEquals(UNAME, self.cache.get("aa", uname_cmd(), NOW))
+
+    def test_failure_not_cached(self):
+        release = rho_cmds.RedhatReleaseRhoCmd()
+        release.cmd_results = [("", "no package provides redhat-release")]
+        release.parse_data()
+        uname = uname_cmd(UNAME)
+        del uname.data["uname.processor"]
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[release, uname]), NOW)
+        self.assertEquals({}, self.cache.hosts)
+
+    def test_other_host_key(self):
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[uname_cmd(UNAME)]), NOW)
+        self.assertEquals(None, self.cache.get("bb", uname_cmd(), NOW))
+
+    def test_not_cacheable(self):
+        script = rho_cmds.ScriptRhoCmd("ls")
+        script.data = {"script.output": "x"}
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[script]), NOW)
+        self.assertEquals({}, self.cache.hosts)
+
+    def test_fill(self):
+        self.cache.record(finished_job(auth=CRED, host_key="aa",
+                                       rho_cmds=[uname_cmd(UNAME)]), NOW)
+        release = rho_cmds.RedhatReleaseRhoCmd()
+        uname = uname_cmd()
+        job = finished_job(auth=CRED, host_key="aa", rho_cmds=[uname, release])
+        self.assertEquals([release], self.cache.fill(job, NOW))
+        self.assertEquals(UNAME, uname.data)
+        self.assertTrue(uname.from_cache)
+
+        # hits are counted when the job comes back, and not cached again
+        self.cache.record(job, NOW + DAY)
+        self.assertEquals(1, self.cache.hits)
+        self.assertEquals(NOW, self.cache.hosts["aa"]["uname"]["time"])
+
+
+class CachedCommandsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = os.environ.pop("SSH_AUTH_SOCK", None)
+        self.dir = tempfile.mkdtemp()
+        self.cache = fact_cache.FactCache(os.path.join(self.dir,
+                                                       "facts.json"))
+
+    def tearDown(self):
+        if self.agent is not None:
+            os.environ["SSH_AUTH_SOCK"] = self.agent
+        self.sshd.stop()
+        shutil.rmtree(self.dir)
+
+    def test_not_sent(self):
+        # the server never answers a command, so only the cache can
+        self.sshd = PasswordSshd({"bob": "good"})
+        self.sshd.start()
+        host_key = binascii.hexlify(PasswordSshd.host_key.get_fingerprint())
+        self.cache.record(finished_job(auth=CRED, host_key=host_key,
+                                       rho_cmds=[uname_cmd(UNAME)]))
+
+        uname = uname_cmd()
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=self.sshd.port,
+                              rho_cmds=[uname],
+                              auths=[ssh_jobs.SshAuth(name="good",
+                                                      username="bob",
+                                                      password="good")],
+                              timeout=10)
+        job.set_timeout("command", 5)
+        my_sshpt.attemptConnection(job, fact_cache=self.cache)
+        self.assertEquals(None, job.timed_out)
+        self.assertEquals(True, job.connection_result)
+        self.assertEquals(UNAME, uname.data)
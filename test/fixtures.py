@@ -0,0 +1,60 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Helpers shared by the tests """
+
+import socket
+
+from rho import ssh_jobs
+
+# what finished_job()s that got in got in with, unless they say otherwise
+CRED = ssh_jobs.SshAuth(name="cred", username="bob")
+
+
+def closed_port():
+    """ A local port nothing is listening on. """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def finished_job(ip="10.0.0.1", auth=None, host_key=None, error=None,
+                 rho_cmds=None, latency=None, start_time=None, hint=None):
+    """
+    An SshJob as the ssh threads give it back. It got in with auth, or
+    without one failed, with error as its output.
+    """
+    job = ssh_jobs.SshJob(ip=ip, rho_cmds=rho_cmds or [])
+    job.auth = auth
+    job.host_key = host_key
+    job.connect_latency = latency
+    job.start_time = start_time
+    job.auth_hint = hint
+    if auth is None:
+        job.connection_result = "FAILED"
+        job.command_output = error
+    return job
+
+
+class RecordingReport(object):
+    """ Stands in for a ScanReport, keeping every job it's given. """
+
+    def __init__(self):
+        self.jobs = []
+        self.summary = {}
+
+    def add(self, ssh_job):
+        self.jobs.append(ssh_job)
+
+    def set_summary(self, name, value):
+        self.summary[name] = value
@@ -0,0 +1,147 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for ordering hosts by what earlier scans saw of them """
+
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+from rho import config
+from rho import history
+from rho import resolver
+from rho import scanner
+
+from fixtures import CRED, finished_job
+
+gettext.install('rho')
+
+DAY = 24 * 60 * 60
+NOW = 1000 * DAY
+
+
+class HostHistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state", "history.json")
+        self.history = history.HostHistory(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _order(self, ips):
+        return list(self.history.order(lambda: iter(ips), NOW))
+
+    def test_save_and_load(self):
+        self.history.record(finished_job("10.0.0.1", CRED, "aa",
+                                         start_time=NOW - 5), NOW)
+        self.history.save()
+
+        loaded = history.HostHistory(self.path)
+        loaded.load()
+        self.assertEquals(history.GOOD, loaded.rank("10.0.0.1", NOW))
+        self.assertEquals(history.UNKNOWN, loaded.rank("10.0.0.2", NOW))
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        f = open(self.path, "w")
+        f.write("{not json")
+        f.close()
+        self.history.load()
+        self.assertEquals({}, self.history.hosts)
+
+    def test_down_since_first_failure(self):
+        job = finished_job("10.0.0.1")
+        self.history.record(job, NOW - 10 * DAY)
+        self.history.record(job, NOW - DAY)
+        self.assertEquals(history.DEAD, self.history.rank("10.0.0.1", NOW))
+
+    def test_not_down_long(self):
+        self.history.record(finished_job("10.0.0.1"), NOW - DAY)
+        self.assertEquals(history.UNKNOWN, self.history.rank("10.0.0.1", NOW))
+
+    def test_answering_isnt_down(self):
+        # turned us away, but it's up
+        job = finished_job("10.0.0.1")
+        self.history.record(job, NOW - 10 * DAY)
+        self.history.record(finished_job("10.0.0.1", host_key="aa"), NOW)
+        self.assertEquals(history.UNKNOWN, self.history.rank("10.0.0.1", NOW))
+
+    def test_success_gets_stale(self):
+        self.history.record(finished_job("10.0.0.1", CRED, "aa",
+                                         start_time=NOW - 5),
+                            NOW - history.RECENT - DAY)
+        self.assertEquals(history.UNKNOWN, self.history.rank("10.0.0.1", NOW))
+
+    def test_order(self):
+        self.history.record(finished_job("10.0.0.2", CRED, "aa",
+                                         start_time=NOW - 20), NOW)
+        self.history.record(finished_job("10.0.0.4", CRED, "bb",
+                                         start_time=NOW - 3), NOW)
+        self.history.record(finished_job("10.0.0.1"), NOW - 10 * DAY)
+        self.history.record(finished_job("10.0.0.3"), NOW - DAY)
+
+        ips = ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.5"]
+        self.assertEquals(["10.0.0.4", "10.0.0.2", "10.0.0.3", "10.0.0.5",
+                           "10.0.0.1"], self._order(ips))
+
+    def test_order_unknown_duration_last(self):
+        self.history.record(finished_job("10.0.0.1", CRED, "aa"), NOW)
+        self.history.record(finished_job("10.0.0.2", CRED, "bb",
+                                         start_time=NOW - 20), NOW)
+        self.assertEquals(["10.0.0.2", "10.0.0.1"],
+                          self._order(["10.0.0.1", "10.0.0.2"]))
+
+    def test_order_empty_history(self):
+        ips = ["10.0.0.3", "10.0.0.1", "10.0.0.2"]
+        self.assertEquals(ips, self._order(ips))
+
+
+class ScannerOrderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_jobs_in_history_order(self):
+        host_history = history.HostHistory(os.path.join(self.dir,
+                                                        "history.json"))
+        host_history.record(finished_job("10.0.0.3", CRED, "aa",
+                                         start_time=NOW - 1))
+
+        s = scanner.Scanner()
+        s.history = host_history
+        profile = config.Group("p", ["10.0.0.1 - 10.0.0.4"], [], ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        self.assertEquals(["10.0.0.3", "10.0.0.1", "10.0.0.2", "10.0.0.4"],
+                          ips)
+
+    def test_hostnames_in_history_order(self):
+        host_history = history.HostHistory(os.path.join(self.dir,
+                                                        "history.json"))
+        host_history.record(finished_job("10.0.0.9", CRED, "aa",
+                                         start_time=NOW - 1))
+
+        s = scanner.Scanner()
+        s.history = host_history
+        s.resolver = resolver.Resolver(gethostbyname={
+            "a.example.com": "10.0.0.9"}.get)
+        # answered before the scan, rather than as it goes
+        list(s.resolver.resolve(["a.example.com"]))
+        profile = config.Group("p", ["10.0.0.1", "a.example.com"], [],
+                               ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        self.assertEquals(["10.0.0.9", "10.0.0.1"], ips)
@@ -0,0 +1,92 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for the scan journal and resuming from it """
+
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+from rho import config
+from rho import journal
+from rho import scanner
+from rho import ssh_jobs
+
+from scanner_tests import scanned_job
+
+gettext.install('rho')
+
+
+def failed_job(ip):
+    job = ssh_jobs.SshJob(ip=ip, rho_cmds=[])
+    job.connection_result = "FAILED"
+    return job
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "journals", "scan.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write_report(self, *jobs):
+        scan_journal = journal.Journal(self.path)
+        scan_journal.open()
+        report = scanner.ScanReport()
+        report.journal = scan_journal
+        for job in jobs:
+            report.add(job)
+        scan_journal.close()
+
+    def _loaded(self):
+        scan_journal = journal.Journal(self.path)
+        scan_journal.load()
+        return scan_journal
+
+    def test_written_as_they_finish(self):
+        self._write_report(scanned_job("10.0.0.1"), failed_job("10.0.0.2"))
+        scan_journal = self._loaded()
+        self.assertEquals(["10.0.0.1", "10.0.0.2"], sorted(scan_journal.done))
+        rows = dict(scan_journal.rows())
+        self.assertEquals("bob", rows["10.0.0.1"]["auth.username"])
+        self.assertEquals(None, rows["10.0.0.2"])
+
+    def test_no_passwords(self):
+        self._write_report(scanned_job("10.0.0.1"))
+        self.assertFalse("sekurity" in open(self.path).read())
+
+    def test_torn_line(self):
+        self._write_report(scanned_job("10.0.0.1"))
+        f = open(self.path, "a")
+        f.write('{"ip": "10.0.0.2", "ro')
+        f.close()
+
+        # the torn line is skipped, and doesn't swallow the next one
+        self._write_report(failed_job("10.0.0.3"))
+        self.assertEquals(["10.0.0.1", "10.0.0.3"],
+                          sorted(self._loaded().done))
+
+    def test_resume(self):
+        self._write_report(scanned_job("10.0.0.1"), failed_job("10.0.0.2"))
+
+        s = scanner.Scanner()
+        s.journal = self._loaded()
+        s.ssh_jobs.report.resume(s.journal)
+        profile = config.Group("p", ["10.0.0.1 - 10.0.0.4"], [], ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        self.assertEquals(["10.0.0.3", "10.0.0.4"], ips)
+        self.assertEquals(["10.0.0.1"], s.ssh_jobs.report.ips.keys())
+        self.assertEquals(2, s.ssh_jobs.report.resumed)
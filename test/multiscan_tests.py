@@ -0,0 +1,81 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for multi process scanning """
+
+import gettext
+import os
+import unittest
+
+from rho import ssh_jobs
+
+from fixtures import RecordingReport, closed_port
+
+gettext.install('rho')
+
+
+class MultiScanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = ssh_jobs.SshJobs()
+        self.jobs.processes = 2
+        self.jobs.report = RecordingReport()
+
+    def _gen_jobs(self, number):
+        port = closed_port()
+        for i in range(number):
+            yield ssh_jobs.SshJob(ip="127.0.0.%d" % (i + 1), port=port,
+                                  rho_cmds=[], auths=[])
+
+    def test_every_job_comes_back(self):
+        out_queue = self.jobs.run_jobs(ssh_jobs=self._gen_jobs(25))
+        out_queue.join()
+
+        ips = [job.ip for job in self.jobs.report.jobs]
+        ips.sort()
+        expected = ["127.0.0.%d" % (i + 1) for i in range(25)]
+        expected.sort()
+        self.assertEquals(expected, ips)
+        for job in self.jobs.report.jobs:
+            self.assertEquals("FAILED", job.connection_result)
+
+    def test_summary_per_process(self):
+        self.jobs.concurrency = "auto"
+        out_queue = self.jobs.run_jobs(ssh_jobs=self._gen_jobs(4))
+        out_queue.join()
+        self.assertEquals(2, len(self.jobs.report.summary))
+
+
+class DyingSshJob(ssh_jobs.SshJob):
+    """ Takes down the worker process that unpickles it. """
+
+    def __setstate__(self, state):
+        os._exit(1)
+
+
+class DeadWorkerTests(unittest.TestCase):
+
+    def test_jobs_reported(self):
+        jobs = ssh_jobs.SshJobs()
+        jobs.processes = 2
+        jobs.report = RecordingReport()
+        port = closed_port()
+        # one for each worker, then some no one is left to run
+        dying = [DyingSshJob(ip="127.0.0.%d" % (i + 1), port=port,
+                             rho_cmds=[], auths=[]) for i in range(5)]
+        out_queue = jobs.run_jobs(ssh_jobs=iter(dying))
+        out_queue.join()
+
+        self.assertEquals(5, len(jobs.report.jobs))
+        for job in jobs.report.jobs:
+            self.assertEquals("FAILED", job.connection_result)
+        self.assertEquals(5, jobs.report.summary[
+            "lost with a dead scan worker"])
@@ -0,0 +1,472 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for running rho commands over an ssh connection """
+
+import gettext
+import os
+import socket
+import subprocess
+import threading
+import time
+import unittest
+
+import paramiko
+
+from rho import deadlines
+from rho import my_sshpt
+from rho import rho_cmds
+from rho import ssh_jobs
+
+from fixtures import RecordingReport
+
+gettext.install('rho')
+
+TOKEN = "RHO-0123456789abcdef"
+
+
+def run_local(cmd):
+    """ Run a command line with the local shell, the way sshd would. """
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    return (stdout, stderr, proc.returncode)
+
+
+class BatchTests(unittest.TestCase):
+
+    def _batch(self, cmd_strings):
+        stdout, stderr, status = run_local(
+            my_sshpt.batchScript(cmd_strings, TOKEN))
+        return my_sshpt.splitBatchOutput(stdout, stderr, len(cmd_strings),
+                                         TOKEN)
+
+    def test_same_as_one_by_one(self):
+        cmd_strings = ["echo hello",
+                       "echo to stderr >&2",
+                       "printf 'no newline'",
+                       "uname -s; echo 'quoted \"stuff\"'",
+                       "false",
+                       "echo one; exit 3",
+                       "echo trailing # comment"]
+        results = self._batch(cmd_strings)
+        self.assertEquals(len(cmd_strings), len(results))
+        for cmd_string, result in zip(cmd_strings, results):
+            self.assertEquals(run_local(cmd_string), result)
+
+    def test_exit_does_not_stop_batch(self):
+        results = self._batch(["exit 1", "echo still here"])
+        self.assertEquals(("still here\n", "", 0), results[1])
+
+    def test_no_stdin(self):
+        results = self._batch(["cat", "echo done"])
+        self.assertEquals(("", "", 0), results[0])
+
+    def test_broken_framing(self):
+        stdout, stderr, status = run_local(
+            my_sshpt.batchScript(["echo one", "echo two"], TOKEN))
+        # the shell went away after the first command
+        stdout = stdout[:stdout.find("%s:1:start" % TOKEN)]
+        self.assertEquals(None, my_sshpt.splitBatchOutput(stdout, stderr, 2,
+                                                          TOKEN))
+
+
+class FakeChannel:
+    """ Channel whose command takes 'steps' polls to finish. """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.out = []
+        self.err = []
+        self.steps = 0
+        self.status = False
+        self._r, self._w = os.pipe()
+
+    def exec_command(self, cmd_string):
+        # "<steps> <stdout> <stderr>"
+        steps, out, err = cmd_string.split()
+        self.steps = int(steps)
+        self.out = [out]
+        self.err = [err]
+        self.transport.started.append(out)
+
+    def fileno(self):
+        return self._r
+
+    def _tick(self):
+        if self.steps > 0:
+            self.steps = self.steps - 1
+        elif not self.status:
+            self.status = True
+
+    def recv_ready(self):
+        return self.steps == 0 and len(self.out) > 0
+
+    def recv(self, size):
+        return self.out.pop(0)
+
+    def recv_stderr_ready(self):
+        return self.steps == 0 and len(self.err) > 0
+
+    def recv_stderr(self, size):
+        return self.err.pop(0)
+
+    def exit_status_ready(self):
+        self._tick()
+        return self.status
+
+    def close(self):
+        if self in self.transport.open:
+            self.transport.open.remove(self)
+            os.close(self._r)
+            os.close(self._w)
+
+
+class FakeTransport:
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self.open = []
+        self.started = []
+        self.most_open = 0
+
+    def open_session(self):
+        if len(self.open) >= self.max_sessions:
+            raise paramiko.SSHException("administratively prohibited")
+        chan = FakeChannel(self)
+        self.open.append(chan)
+        self.most_open = max(self.most_open, len(self.open))
+        return chan
+
+
+class FakeRhoCmd(rho_cmds.RhoCmd):
+
+    def __init__(self, cmd_strings):
+        rho_cmds.RhoCmd.__init__(self)
+        self.cmd_strings = cmd_strings
+
+    def parse_data(self):
+        pass
+
+
+class ParallelChannelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rho_cmds = [FakeRhoCmd(["3 a1 ea1", "0 a2 ea2"]),
+                         FakeRhoCmd(["1 b1 eb1"]),
+                         FakeRhoCmd(["0 c1 ec1", "2 c2 ec2", "0 c3 ec3"])]
+
+    def _check_results(self):
+        self.assertEquals([("a1", "ea1"), ("a2", "ea2")],
+                          self.rho_cmds[0].cmd_results)
+        self.assertEquals([("b1", "eb1")], self.rho_cmds[1].cmd_results)
+        self.assertEquals([("c1", "ec1"), ("c2", "ec2"), ("c3", "ec3")],
+                          self.rho_cmds[2].cmd_results)
+
+    def test_results_in_order(self):
+        transport = FakeTransport(10)
+        my_sshpt.executeCommands(transport, self.rho_cmds, channels=4)
+        self._check_results()
+        self.assertEquals(4, transport.most_open)
+        self.assertEquals([], transport.open)
+
+    def test_max_sessions(self):
+        # the server allows fewer channels than we asked for
+        transport = FakeTransport(2)
+        my_sshpt.executeCommands(transport, self.rho_cmds, channels=5)
+        self._check_results()
+        self.assertEquals(2, transport.most_open)
+        self.assertEquals(["a1", "a2", "b1", "c1", "c2", "c3"],
+                          transport.started)
+
+    def test_no_channels(self):
+        transport = FakeTransport(0)
+        self.assertRaises(paramiko.SSHException, my_sshpt.executeCommands,
+                          transport, self.rho_cmds, channels=2)
+
+
+class PasswordServer(paramiko.ServerInterface):
+
+    def __init__(self, sshd):
+        self.sshd = sshd
+        self.failures = 0
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if self.sshd.channel_delay:
+            time.sleep(self.sshd.channel_delay)
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        # the command runs forever, it never says anything
+        return True
+
+    def check_auth_password(self, username, password):
+        if self.sshd.auth_delay:
+            time.sleep(self.sshd.auth_delay)
+        if self.sshd.users.get(username) == password:
+            return paramiko.AUTH_SUCCESSFUL
+        self.failures = self.failures + 1
+        self.sshd.auth_failures = self.sshd.auth_failures + 1
+        if self.failures >= self.sshd.max_auth_tries:
+            # what sshd does, hang up rather than say no
+            self.sock.shutdown(socket.SHUT_RDWR)
+        return paramiko.AUTH_FAILED
+
+
+class PasswordSshd(threading.Thread):
+    """ paramiko server on localhost that only knows about passwords. """
+
+    host_key = None
+
+    def __init__(self, users, max_auth_tries=6):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        if PasswordSshd.host_key is None:
+            PasswordSshd.host_key = paramiko.RSAKey.generate(1024)
+        self.users = users
+        self.max_auth_tries = max_auth_tries
+        self.auth_delay = 0
+        self.channel_delay = 0
+        self.connections = 0
+        self.auth_failures = 0
+        self.transports = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            client, addr = self.sock.accept()
+            self.connections = self.connections + 1
+            server = PasswordServer(self)
+            server.sock = client
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            # don't wait on it, a quick client can have been and gone by then
+            transport.start_server(threading.Event(), server)
+            self.transports.append(transport)
+
+    def stop(self):
+        for transport in self.transports:
+            transport.close()
+
+
+class HangUpSshd(threading.Thread):
+    """ Hangs up on everyone before the banner. """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.connections = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            client, addr = self.sock.accept()
+            self.connections = self.connections + 1
+            client.close()
+
+    def stop(self):
+        self.sock.close()
+
+
+class ParamikoConnectTests(unittest.TestCase):
+
+    def setUp(self):
+        # no agent keys, only what we give it
+        self.agent = os.environ.pop("SSH_AUTH_SOCK", None)
+
+    def tearDown(self):
+        if self.agent is not None:
+            os.environ["SSH_AUTH_SOCK"] = self.agent
+        self.sshd.stop()
+
+    def _connect(self, *passwords):
+        self.sshd.start()
+        auths = []
+        for password in passwords:
+            auths.append(ssh_jobs.SshAuth(name=password, username="bob",
+                                          password=password))
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=self.sshd.port,
+                              rho_cmds=[], auths=auths, timeout=10)
+        return job, my_sshpt.paramikoConnect(job)
+
+    def test_one_handshake(self):
+        self.sshd = PasswordSshd({"bob": "good"})
+        job, transport = self._connect("bad1", "bad2", "bad3", "good")
+        self.assertTrue(transport.is_authenticated())
+        transport.close()
+        self.assertEquals("good", job.auth.name)
+        self.assertEquals(1, self.sshd.connections)
+        self.assertEquals(3, self.sshd.auth_failures)
+
+    def test_reconnect_after_hang_up(self):
+        self.sshd = PasswordSshd({"bob": "good"}, max_auth_tries=2)
+        job, transport = self._connect("bad1", "bad2", "bad3", "good")
+        self.assertTrue(transport.is_authenticated())
+        transport.close()
+        self.assertEquals("good", job.auth.name)
+        # bad2 gets us hung up on, bad3 is tried on a new connection
+        self.assertEquals(2, self.sshd.connections)
+        self.assertEquals(3, self.sshd.auth_failures)
+
+    def test_nothing_works(self):
+        self.sshd = PasswordSshd({"bob": "good"})
+        job, error = self._connect("bad1", "bad2")
+        self.assertEquals(None, job.auth)
+        self.assertTrue(isinstance(error, str))
+        self.assertEquals(1, self.sshd.connections)
+
+    def test_hang_up_ends_host(self):
+        # it never gets as far as auth, so no other credential would either
+        self.sshd = HangUpSshd()
+        job, error = self._connect("one", "two", "three")
+        self.assertTrue(isinstance(error, str))
+        self.assertEquals(None, job.auth)
+        self.assertEquals(1, self.sshd.connections)
+
+    def test_latency_from_connect(self):
+        self.sshd = PasswordSshd({"bob": "good"})
+        self.sshd.start()
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=self.sshd.port,
+                              rho_cmds=[], timeout=10)
+        # the loop connected it a second ago, and it sat in the queue
+        # for most of that
+        job.start_time = time.time() - 60
+        job.banner_latency = 0.5
+        job.sock = socket.create_connection(("127.0.0.1", self.sshd.port))
+        transport = my_sshpt.connectTransport(job)
+        transport.close()
+        self.assertTrue(0.5 <= job.connect_latency < 30)
+
+
+class KeyTransport:
+
+    def __init__(self, key):
+        self.key = key
+
+    def get_remote_server_key(self):
+        return self.key
+
+
+class HostKeyTests(unittest.TestCase):
+
+    def setUp(self):
+        if PasswordSshd.host_key is None:
+            PasswordSshd.host_key = paramiko.RSAKey.generate(1024)
+        self.host_keys = paramiko.HostKeys()
+        self.job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+
+    def _check(self, key):
+        return my_sshpt.checkHostKey(self.job, KeyTransport(key),
+                                     self.host_keys)
+
+    def test_same_key(self):
+        self._check(PasswordSshd.host_key)
+        self._check(PasswordSshd.host_key)
+        self.assertEquals(["10.0.0.1"], self.host_keys.keys())
+
+    def test_changed_key(self):
+        self._check(PasswordSshd.host_key)
+        self.assertRaises(paramiko.BadHostKeyException, self._check,
+                          paramiko.RSAKey.generate(1024))
+
+
+class SSHQueueTests(unittest.TestCase):
+
+    def test_threads_as_needed(self):
+        output_queue = my_sshpt.startOutputThread(False, None,
+                                                  RecordingReport())
+        queue = my_sshpt.startSSHQueue(output_queue, 3)
+        for i in range(5):
+            # one at a time, the first thread is always free again
+            queue.put(ssh_jobs.SshJob(ip="", rho_cmds=[]))
+            queue.join()
+            while queue.idle < 1:
+                time.sleep(0.01)
+        self.assertEquals(1, queue.threads)
+
+    def test_max_threads(self):
+        output_queue = my_sshpt.startOutputThread(False, None,
+                                                  RecordingReport())
+        queue = my_sshpt.startSSHQueue(output_queue, 3)
+        for i in range(20):
+            queue.put(ssh_jobs.SshJob(ip="", rho_cmds=[]))
+        queue.join()
+        self.assertTrue(queue.threads <= 3)
+
+
+class DeadlineTests(ParamikoConnectTests):
+
+    def _job(self, **timeouts):
+        self.sshd.start()
+        auths = [ssh_jobs.SshAuth(name="good", username="bob",
+                                  password="good")]
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=self.sshd.port,
+                              rho_cmds=[rho_cmds.UnameRhoCmd()],
+                              auths=auths, timeout=10)
+        for phase, seconds in timeouts.items():
+            job.set_timeout(phase, seconds)
+        return job
+
+    def test_hung_command(self):
+        self.sshd = PasswordSshd({"bob": "good"})
+        job = self._job(command=0.5)
+        start = time.time()
+        my_sshpt.attemptConnection(job)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEquals(False, job.connection_result)
+        self.assertEquals(deadlines.COMMAND, job.timed_out)
+
+    def test_hung_command_parallel(self):
+        self.sshd = PasswordSshd({"bob": "good"})
+        job = self._job(command=0.5)
+        job.channels = 4
+        my_sshpt.attemptConnection(job)
+        self.assertEquals(deadlines.COMMAND, job.timed_out)
+
+    def test_slow_channel(self):
+        for channels in [1, 4]:
+            self.sshd = PasswordSshd({"bob": "good"})
+            self.sshd.channel_delay = 3
+            job = self._job(command=0.5)
+            job.channels = channels
+            start = time.time()
+            my_sshpt.attemptConnection(job)
+            self.assertTrue(time.time() - start < 2.5)
+            self.assertEquals(deadlines.COMMAND, job.timed_out)
+            self.sshd.stop()
+
+    def test_total(self):
+        # each command is in time, but not all four of them
+        self.sshd = PasswordSshd({"bob": "good"})
+        job = self._job(command=10, total=1)
+        start = time.time()
+        my_sshpt.attemptConnection(job)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEquals(deadlines.TOTAL, job.timed_out)
+
+    def test_slow_auth(self):
+        self.sshd = PasswordSshd({"bob": "good"})
+        self.sshd.auth_delay = 3
+        job = self._job(auth=0.5)
+        start = time.time()
+        my_sshpt.attemptConnection(job)
+        self.assertTrue(time.time() - start < 2.5)
+        self.assertEquals(False, job.connection_result)
+        self.assertEquals(deadlines.AUTH, job.timed_out)
@@ -0,0 +1,79 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for the compact records ScanReport keeps """
+
+import unittest
+
+from rho import records
+from rho import scanner
+
+from scanner_tests import scanned_job
+
+
+class HostRecordTests(unittest.TestCase):
+
+    def test_like_a_dict(self):
+        record = records.HostRecord({"ip": "10.0.0.1", "port": 22})
+        record["uname.os"] = "Linux"
+        self.assertEquals("10.0.0.1", record["ip"])
+        self.assertEquals(22, record.get("port"))
+        self.assertEquals(None, record.get("uname.hostname"))
+        self.assertTrue("uname.os" in record)
+        self.assertFalse("uname.hostname" in record)
+        self.assertEquals({"ip": "10.0.0.1", "port": 22, "uname.os": "Linux"},
+                          dict(record))
+
+    def test_missing_fields_empty(self):
+        record = records.HostRecord({"ip": "10.0.0.1"})
+        self.assertEquals("10.0.0.1,,", "%(ip)s,%(port)s,%(nosuch.field)s"
+                          % record)
+
+    def test_values_shared(self):
+        values = records.Values()
+        first = records.HostRecord({"uname.os": "".join(["Li", "nux"])},
+                                   values)
+        second = records.HostRecord({"uname.os": "".join(["Lin", "ux"])},
+                                    values)
+        self.assertTrue(first["uname.os"] is second["uname.os"])
+
+    def test_values_per_report(self):
+        first = records.HostRecord({"uname.os": "".join(["Li", "nux"])},
+                                   records.Values())
+        second = records.HostRecord({"uname.os": "".join(["Lin", "ux"])},
+                                    records.Values())
+        self.assertFalse(first["uname.os"] is second["uname.os"])
+
+    def test_unique_values_not_shared(self):
+        values = records.Values()
+        ip = "".join(["10.0.0", ".1"])
+        record = records.HostRecord({"ip": ip}, values)
+        self.assertTrue(record["ip"] is ip)
+        self.assertEquals({}, values.values)
+
+    def test_one_schema(self):
+        records.HostRecord({"records-test.only": "here"})
+        record = records.HostRecord({"ip": "10.0.0.1"})
+        self.assertEquals(None, record.get("records-test.only"))
+        self.assertFalse("records-test.only" in record.keys())
+        self.assertFalse(hasattr(record, "__dict__"))
+
+
+class ReportRecordTests(unittest.TestCase):
+
+    def test_no_credentials(self):
+        report = scanner.ScanReport()
+        report.add(scanned_job("10.0.0.1"))
+        row = report.ips["10.0.0.1"]
+        self.assertTrue(isinstance(row, records.HostRecord))
+        self.assertFalse("auth.password" in row)
+        self.assertFalse("sekurity" in row.values)
+        self.assertEquals("bob", row["auth.username"])
@@ -0,0 +1,80 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for looking up hostnames """
+
+import socket
+import threading
+import time
+import unittest
+
+from rho import resolver
+
+HOSTS = {"web1.example.com": "10.0.0.1", "web2.example.com": "10.0.0.2",
+         "db.example.com": "10.0.0.3"}
+
+
+class FakeDns(object):
+    """ A slow gethostbyname, keeping track of how it's called. """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, hostname):
+        self.lock.acquire()
+        self.calls.append(hostname)
+        self.running = self.running + 1
+        self.most_running = max(self.most_running, self.running)
+        self.lock.release()
+        time.sleep(self.delay)
+        self.lock.acquire()
+        self.running = self.running - 1
+        self.lock.release()
+        if hostname not in HOSTS:
+            raise socket.gaierror(socket.EAI_NONAME, "no such host")
+        return HOSTS[hostname]
+
+
+class ResolverTests(unittest.TestCase):
+
+    def test_resolve(self):
+        dns = FakeDns()
+        r = resolver.Resolver(gethostbyname=dns)
+        answers = dict(r.resolve(HOSTS.keys() + ["nowhere.example.com"]))
+        self.assertEquals("10.0.0.1", answers["web1.example.com"])
+        self.assertEquals(None, answers["nowhere.example.com"])
+        self.assertEquals(4, len(answers))
+
+    def test_pool_bounded(self):
+        dns = FakeDns(0.05)
+        r = resolver.Resolver(threads=2, gethostbyname=dns)
+        hostnames = ["host%d.example.com" % i for i in range(8)]
+        self.assertEquals(8, len(list(r.resolve(hostnames))))
+        self.assertEquals(2, dns.most_running)
+
+    def test_cached(self):
+        dns = FakeDns()
+        r = resolver.Resolver(gethostbyname=dns)
+        list(r.resolve(["web1.example.com", "nowhere.example.com"]))
+        self.assertEquals("10.0.0.1", r.lookup("web1.example.com"))
+        self.assertRaises(socket.error, r.lookup, "nowhere.example.com")
+        self.assertEquals(2, len(dns.calls))
+
+    def test_expired(self):
+        dns = FakeDns()
+        r = resolver.Resolver(gethostbyname=dns)
+        r.lookup("web1.example.com")
+        later = time.time() + resolver.DEFAULT_TTL + 1
+        self.assertEquals((False, None), r.cached("web1.example.com", later))
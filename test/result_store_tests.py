@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for reusing the rows of recently scanned hosts """
+
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+from rho import config
+from rho import result_store
+from rho import scanner
+
+from scanner_tests import scanned_job
+
+gettext.install('rho')
+
+HOUR = 60 * 60
+NOW = 1000 * HOUR
+
+
+class ResultStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state", "results.json")
+        self.store = result_store.ResultStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _stored_row(self, ip):
+        report = scanner.ScanReport()
+        report.result_store = self.store
+        report.add(scanned_job(ip))
+        return report.ips[ip]
+
+    def test_save_and_load(self):
+        self._stored_row("10.0.0.1")
+        self.store.save()
+
+        loaded = result_store.ResultStore(self.path)
+        loaded.load()
+        row = loaded.fresh("10.0.0.1", HOUR)
+        self.assertEquals("bob", row["auth.username"])
+        self.assertEquals("10.0.0.1", row["uname.hostname"])
+
+    def test_no_passwords(self):
+        self._stored_row("10.0.0.1")
+        self.store.save()
+        self.assertFalse("sekurity" in open(self.path).read())
+
+    def test_keeps_report_row(self):
+        # not a copy of it
+        row = self._stored_row("10.0.0.1")
+        self.assertTrue(row is self.store.hosts["10.0.0.1"][1])
+
+    def test_stale(self):
+        self.store.put({"ip": "10.0.0.1"}, NOW - 2 * HOUR)
+        self.assertEquals(None, self.store.fresh("10.0.0.1", HOUR, NOW))
+        self.assertEquals({"ip": "10.0.0.1"},
+                          self.store.fresh("10.0.0.1", 3 * HOUR, NOW))
+        self.assertEquals(None, self.store.fresh("10.0.0.2", 3 * HOUR, NOW))
+
+    def test_failed_scan_forgotten(self):
+        self._stored_row("10.0.0.1")
+        report = scanner.ScanReport()
+        report.result_store = self.store
+        job = scanned_job("10.0.0.1")
+        job.connection_result = "FAILED"
+        report.add(job)
+        self.assertEquals(None, self.store.fresh("10.0.0.1", HOUR))
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        f = open(self.path, "w")
+        f.write("{not json")
+        f.close()
+        self.store.load()
+        self.assertEquals({}, self.store.hosts)
+
+
+class MaxAgeScanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = result_store.ResultStore(os.path.join(self.dir,
+                                                           "results.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _job_ips(self, max_age):
+        s = scanner.Scanner()
+        s.result_store = self.store
+        s.max_age = max_age
+        profile = config.Group("p", ["10.0.0.1 - 10.0.0.3"], [], ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        return ips, s.ssh_jobs.report
+
+    def test_fresh_hosts_not_scanned(self):
+        # from a scan that had every field
+        self.store.put({"ip": "10.0.0.2", "port": 22},
+                       fields=scanner.ScanReport().fields())
+        ips, report = self._job_ips(HOUR)
+        self.assertEquals(["10.0.0.1", "10.0.0.3"], ips)
+        self.assertEquals(scanner.CACHED, report.ips["10.0.0.2"]["source"])
+        self.assertEquals(1, report.cached)
+
+    def test_narrow_row_not_used_for_full_report(self):
+        # a --fields scan stored its row over the full one
+        report = scanner.ScanReport()
+        report.result_store = self.store
+        report.set_fields(["ip", "uname.os"])
+        report.add(scanned_job("10.0.0.2"))
+
+        ips, report = self._job_ips(HOUR)
+        self.assertEquals(["10.0.0.1", "10.0.0.2", "10.0.0.3"], ips)
+        self.assertEquals(0, report.cached)
+
+        s = scanner.Scanner()
+        s.result_store = self.store
+        s.max_age = HOUR
+        s.set_fields(["uname.os"])
+        profile = config.Group("p", ["10.0.0.1 - 10.0.0.3"], [], ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        self.assertEquals(["10.0.0.1", "10.0.0.3"], ips)
+
+    def test_no_max_age(self):
+        self.store.put({"ip": "10.0.0.2", "port": 22})
+        ips, report = self._job_ips(None)
+        self.assertEquals(["10.0.0.1", "10.0.0.2", "10.0.0.3"], ips)
+        self.assertEquals({}, report.ips)
@@ -0,0 +1,166 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for retrying ssh jobs that failed in passing """
+
+import gettext
+import os
+import time
+import unittest
+
+from rho import concurrency
+from rho import deadlines
+from rho import retry
+from rho import ssh_jobs
+
+from fixtures import RecordingReport
+from my_sshpt_tests import PasswordSshd
+
+gettext.install('rho')
+
+
+def failed_job(error, timed_out=None):
+    job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+    job.connection_result = "FAILED"
+    job.command_output = error
+    job.timed_out = timed_out
+    return job
+
+
+class IsTransientTests(unittest.TestCase):
+
+    def test_transient(self):
+        for error in ["Error reading SSH protocol banner",
+                      "[Errno 104] Connection reset by peer",
+                      "connection closed before ssh banner"]:
+            self.assertTrue(retry.is_transient(failed_job(error)), error)
+        self.assertTrue(retry.is_transient(failed_job(
+            "timed out waiting for ssh banner", deadlines.BANNER)))
+
+    def test_permanent(self):
+        for error in ["[Errno 111] Connection refused",
+                      "host did not respond",
+                      "Authentication failed."]:
+            self.assertFalse(retry.is_transient(failed_job(error)), error)
+        self.assertFalse(retry.is_transient(failed_job(
+            "command deadline passed", deadlines.COMMAND)))
+
+    def test_success(self):
+        job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+        job.connection_result = "SUCCESS"
+        self.assertFalse(retry.is_transient(job))
+
+
+class RetryQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = concurrency.ConcurrencyLimiter(5)
+        self.added = []
+        self.retries = retry.RetryQueue(self.limiter, self._add,
+                                        max_attempts=3, delay=0.1)
+        self.retries.start()
+
+    def tearDown(self):
+        self.retries.quit()
+        self.retries.join()
+
+    def _add(self, ssh_job):
+        self.limiter.acquire(parked=True)
+        self.added.append((time.time(), ssh_job))
+        # and straight away it fails again
+        ssh_job.connection_result = "FAILED"
+        ssh_job.command_output = "Connection reset by peer"
+        if not self.retries.retry(ssh_job):
+            self.finished = ssh_job
+        self.limiter.release(ssh_job)
+
+    def test_backoff(self):
+        for attempt in range(2, 10):
+            delay = min(retry.MAX_RETRY_DELAY, 2.0 * 2 ** (attempt - 2))
+            retries = retry.RetryQueue(self.limiter, None, delay=2.0)
+            seconds = retries.backoff(attempt)
+            self.assertTrue(delay / 2 <= seconds <= delay)
+
+    def test_until_max_attempts(self):
+        job = failed_job("Connection reset by peer")
+        self.limiter.acquire()
+        start = time.time()
+        self.assertTrue(self.retries.retry(job))
+        self.limiter.release(job)
+
+        # waits for the retries too
+        self.limiter.wait()
+        self.assertEquals(2, len(self.added))
+        self.assertEquals(3, job.attempts)
+        self.assertTrue(self.finished is job)
+        self.assertEquals(2, self.retries.retried)
+        # the first retry comes after 0.05 to 0.1 seconds, the next
+        # after 0.1 to 0.2
+        self.assertTrue(self.added[0][0] - start >= 0.05)
+        self.assertTrue(self.added[1][0] - self.added[0][0] >= 0.1)
+
+    def test_permanent_not_retried(self):
+        job = failed_job("Connection refused")
+        self.assertFalse(self.retries.retry(job))
+        self.assertEquals(0, self.limiter.parked)
+
+
+class FlakySshd(PasswordSshd):
+    """ Hangs up on the first few connections, like sshd's MaxStartups. """
+
+    def __init__(self, users, drop=1):
+        PasswordSshd.__init__(self, users)
+        self.drop = drop
+
+    def run(self):
+        while self.drop:
+            client, addr = self.sock.accept()
+            self.connections = self.connections + 1
+            client.close()
+            self.drop = self.drop - 1
+        PasswordSshd.run(self)
+
+
+class SshJobsRetryTests(unittest.TestCase):
+    engine = "events"
+
+    def setUp(self):
+        # no agent keys, only what we give it
+        self.agent = os.environ.pop("SSH_AUTH_SOCK", None)
+        self.sshd = FlakySshd({"bob": "good"})
+        self.sshd.start()
+        self.jobs = ssh_jobs.SshJobs()
+        self.jobs.engine = self.engine
+        self.jobs.retry_delay = 0.1
+        self.jobs.report = RecordingReport()
+
+    def tearDown(self):
+        if self.agent is not None:
+            os.environ["SSH_AUTH_SOCK"] = self.agent
+        self.sshd.stop()
+
+    def test_busy_host_retried(self):
+        auths = [ssh_jobs.SshAuth(name="good", username="bob",
+                                  password="good")]
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=self.sshd.port,
+                              rho_cmds=[], auths=auths)
+        out_queue = self.jobs.run_jobs(ssh_jobs=[job])
+        out_queue.join()
+        # reported once, once it got in
+        self.assertEquals([job], self.jobs.report.jobs)
+        self.assertEquals("SUCCESS", job.connection_result)
+        self.assertEquals(2, job.attempts)
+        self.assertEquals(2, self.sshd.connections)
+        self.assertEquals(1, self.jobs.report.summary[_("retries")])
+
+
+class SshJobsRetryThreadsTests(SshJobsRetryTests):
+    engine = "threads"
@@ -36,7 +36,14 @@ class TestUnameCmd(_TestRhoCmd):
 
     def test_data_display(self):
         self.rho_cmd.populate_data(self.out)
-        print "uname: %(uname.os)s\n hostname:%(uname.hostname)s\n%(uname.processor)s\n" % self.rho_cmd.data
+        print "uname: %(uname.os)s\n%(uname.processor)s\n" % self.rho_cmd.data
+
+class TestHostnameRhoCmd(_TestRhoCmd):
+    cmd_class = rho_cmds.HostnameRhoCmd
+
+    def test_data_display(self):
+        self.rho_cmd.populate_data(self.out)
+        print "hostname: %(uname.hostname)s\n" % self.rho_cmd.data
 
 class TestRedhatReleaseRhoCmd(_TestRhoCmd):
     cmd_class = rho_cmds.RedhatReleaseRhoCmd
@@ -52,3 +59,44 @@ class TestScriptRhoCmd(_TestRhoCmd):
         self.out = self._run_cmds()
 
     
+
+
+# more commands than uname, but gives uname.os too
+class FakeRhoCmd(rho_cmds.RhoCmd):
+    name = "fake"
+    cmd_strings = ["true", "true", "true", "true", "true"]
+    fields = ["uname.os", "fake.only"]
+
+
+class TestPlanRhoCmds(unittest.TestCase):
+    classes = [rho_cmds.UnameRhoCmd, rho_cmds.RedhatReleaseRhoCmd]
+
+    def test_one_command(self):
+        self.assertEquals([rho_cmds.RedhatReleaseRhoCmd],
+                          rho_cmds.plan_rho_cmds(["ip", "redhat-release.version"],
+                                                 self.classes))
+
+    def test_base_fields_only(self):
+        self.assertEquals([], rho_cmds.plan_rho_cmds(["ip", "auth.name"],
+                                                     self.classes))
+
+    def test_both(self):
+        self.assertEquals(self.classes,
+                          rho_cmds.plan_rho_cmds(["redhat-release.name",
+                                                  "uname.os"], self.classes))
+
+    def test_cheapest_cover(self):
+        classes = [FakeRhoCmd] + self.classes
+        self.assertEquals([rho_cmds.UnameRhoCmd],
+                          rho_cmds.plan_rho_cmds(["uname.os"], classes))
+        self.assertEquals([FakeRhoCmd],
+                          rho_cmds.plan_rho_cmds(["uname.os", "fake.only"],
+                                                 classes))
+
+    def test_unknown(self):
+        try:
+            rho_cmds.plan_rho_cmds(["uname.os", "no.such"], self.classes)
+        except rho_cmds.UnknownFieldsError, detail:
+            self.assertEquals(["no.such"], detail.fields)
+        else:
+            self.fail("no.such was planned")
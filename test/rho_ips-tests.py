@@ -2,6 +2,7 @@
 
 import unittest
 
+from rho import resolver
 from rho import rho_ips
 
 
@@ -81,4 +82,47 @@ class TestRhoIps(unittest.TestCase):
                 expected.append("10.0.%s.%s" % (i, j))
         self._check_ipr("10.0.0.0 - 10.0.3.255", expected)
 
-    
+    def testLenLarge(self):
+        ipr = rho_ips.RhoIpRange("10.0.0.0/8")
+        self.assertEquals(2 ** 24, len(ipr))
+        self.assertEquals([(167772160, 184549375)], ipr.intervals)
+
+    def testIterLazy(self):
+        ips = iter(rho_ips.RhoIpRange("10.0.0.0/8"))
+        self.assertEquals("10.0.0.0", ips.next())
+        self.assertEquals("10.0.0.1", ips.next())
+
+    def testLenBadHostname(self):
+        nowhere = resolver.Resolver(gethostbyname={}.get)
+        ipr = rho_ips.RhoIpRange("this-will-never-exist.example.com",
+                                 resolver=nowhere)
+        self.assertEquals(0, len(ipr))
+
+
+class TestIpSet(unittest.TestCase):
+    def setUp(self):
+        self.ips = rho_ips.IpSet()
+
+    def testMerge(self):
+        self.ips.add(10, 20)
+        self.ips.add(30, 40)
+        self.ips.add(15, 29)
+        self.ips.add(50, 60)
+        self.assertEquals([(10, 40), (50, 60)], self.ips.intervals[4])
+        self.assertEquals(42, len(self.ips))
+
+    def testDifference(self):
+        self.ips.add(0, 100)
+        other = rho_ips.IpSet()
+        other.add(10, 20)
+        other.add(50, 200)
+        diff = self.ips.difference(other)
+        self.assertEquals([(0, 9), (21, 49)], diff.intervals[4])
+
+    def testOverlappingRanges(self):
+        self.ips.add_range(rho_ips.RhoIpRange("10.0.0.0/24"))
+        self.ips.add_range(rho_ips.RhoIpRange("10.0.0.10 - 10.0.1.1"))
+        self.assertEquals(258, len(self.ips))
+        ips = list(self.ips)
+        self.assertEquals("10.0.0.0", ips[0])
+        self.assertEquals("10.0.1.1", ips[-1])
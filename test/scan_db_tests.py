@@ -0,0 +1,108 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for keeping scan results in SQLite """
+
+import gettext
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from rho import scan_db
+from rho import scanner
+
+from scanner_tests import scanned_job
+
+gettext.install('rho')
+
+
+class ScanDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state", "scans.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _scan(self, *ips):
+        db = scan_db.ScanDatabase(self.path)
+        report = scanner.ScanReport()
+        report.sinks.append(db)
+        for ip in ips:
+            report.add(scanned_job(ip))
+        report.close()
+        return db.scan_id
+
+    def _query(self, sql, *args):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+
+    def test_hosts_and_facts(self):
+        scan_id = self._scan("10.0.0.1", "10.0.0.2")
+        self.assertEquals([(scan_id, 2)],
+                          self._query("SELECT id, hosts FROM scans"))
+        self.assertEquals([("10.0.0.1", 22, "bobslogin")],
+                          self._query("SELECT ip, port, auth_name FROM hosts "
+                                      "WHERE ip = ?", "10.0.0.1"))
+        self.assertEquals([("10.0.0.2",)],
+                          self._query("SELECT h.ip FROM facts f, hosts h "
+                                      "WHERE f.host_id = h.id AND "
+                                      "f.key = 'uname.hostname' AND "
+                                      "f.value = '10.0.0.2'"))
+
+    def test_scans_kept_apart(self):
+        first = self._scan("10.0.0.1")
+        second = self._scan("10.0.0.1")
+        self.assertNotEquals(first, second)
+        self.assertEquals([(first,), (second,)],
+                          self._query("SELECT scan_id FROM hosts "
+                                      "WHERE ip = '10.0.0.1' ORDER BY id"))
+
+    def test_no_passwords(self):
+        self._scan("10.0.0.1")
+        self.assertEquals([], self._query("SELECT * FROM facts "
+                                          "WHERE value = 'sekurity'"))
+
+    def test_batches(self):
+        self.old_batch_size = scan_db.BATCH_SIZE
+        scan_db.BATCH_SIZE = 2
+        try:
+            self._scan("10.0.0.1", "10.0.0.2", "10.0.0.3")
+        finally:
+            scan_db.BATCH_SIZE = self.old_batch_size
+        self.assertEquals([(3,)], self._query("SELECT COUNT(*) FROM hosts"))
+
+    def test_indexes(self):
+        self._scan()
+        names = [name for (name,) in self._query(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        for index in ["hosts_ip", "hosts_scan_id", "facts_key"]:
+            self.assertTrue(index in names)
+
+    def test_bad_row(self):
+        db = scan_db.ScanDatabase(self.path)
+        # no ip, the writer gives up on it but still takes the rest
+        db.write({"port": 22})
+        for i in range(10):
+            db.write({"ip": "10.0.0.%d" % i})
+        self.assertRaises(scan_db.DatabaseError, db.close)
+
+    def test_unwritable(self):
+        os.makedirs(self.path)
+        db = scan_db.ScanDatabase(self.path)
+        db.write({"ip": "10.0.0.1"})
+        self.assertRaises(scan_db.DatabaseError, db.close)
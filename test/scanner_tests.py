@@ -0,0 +1,202 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for the scanner and its report """
+
+import threading
+import unittest
+
+from rho import config
+from rho import deadlines
+from rho import resolver
+from rho import rho_cmds
+from rho import scanner
+from rho import ssh_jobs
+
+
+def scanned_job(ip):
+    auth = config.SshCredentials({"name": "bobslogin", "type": "ssh",
+                                  "username": "bob", "password": "sekurity"})
+    uname = rho_cmds.UnameRhoCmd()
+    uname.populate_data([("Linux\n", ""), ("x86_64\n", ""),
+                         ("x86_64\n", "")])
+    hostname = rho_cmds.HostnameRhoCmd()
+    hostname.populate_data([("%s\n" % ip, "")])
+    job = ssh_jobs.SshJob(ip=ip, rho_cmds=[uname, hostname], auths=[auth])
+    job.auth = auth
+    job.connection_result = "SUCCESS"
+    return job
+
+
+class ScanReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.report = scanner.ScanReport()
+
+    def test_failed_hosts_skipped(self):
+        job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+        job.connection_result = "FAILED"
+        self.report.add(job)
+        self.assertEquals({}, self.report.ips)
+
+    def test_timed_out_row(self):
+        self.report.mark_timed_out = True
+        job = ssh_jobs.SshJob(ip="10.0.0.1", rho_cmds=[])
+        job.connection_result = "FAILED"
+        job.timed_out = deadlines.BANNER
+        self.report.add(job)
+        self.assertEquals("banner", self.report.ips["10.0.0.1"]["timed_out"])
+        self.assertEquals("", self.report.ips["10.0.0.1"]["auth.name"])
+        self.assertEquals("timed_out", self.report.fields()[-1])
+
+        job = ssh_jobs.SshJob(ip="10.0.0.2", rho_cmds=[])
+        job.connection_result = "FAILED"
+        job.timed_out = deadlines.CONNECT
+        self.report.add(job)
+        self.assertFalse("10.0.0.2" in self.report.ips)
+
+    def test_optional_fields_only_when_used(self):
+        self.report.mark_timed_out = True
+        self.report.mark_aliases = True
+        fields = self.report.fields()
+        self.report.add(scanned_job("10.0.0.1"))
+        self.assertEquals(fields, self.report.fields())
+        self.assertFalse("alias_of" in fields)
+        self.assertFalse("timed_out" in fields)
+
+        # a streamed report has to have them from the start
+        self.report.keep_rows = False
+        self.assertEquals(["alias_of", "timed_out"],
+                          self.report.fields()[-2:])
+
+    def test_same_host_once(self):
+        self.report.add(scanned_job("10.0.0.1"))
+        self.report.add(scanned_job("10.0.0.1"))
+        self.assertEquals(["10.0.0.1"], self.report.ips.keys())
+
+    def test_ip_sort_key(self):
+        ips = ["10.0.0.10", "example.com", "10.0.0.9", "9.0.0.1"]
+        ips.sort(key=scanner._ip_sort_key)
+        self.assertEquals(["9.0.0.1", "10.0.0.9", "10.0.0.10", "example.com"],
+                          ips)
+
+    def test_summary(self):
+        self.report.set_summary("concurrency", 4)
+        self.report.set_summary("concurrency", 8)
+        self.assertEquals([("concurrency", 8)], self.report.summary)
+
+
+class FieldsTests(unittest.TestCase):
+
+    def test_narrow_report(self):
+        s = scanner.Scanner()
+        s.set_fields(["ip", "uname.os"])
+        self.assertEquals(["uname"], [cmd.name for cmd in s.get_rho_cmds()])
+        report = s.ssh_jobs.report
+        self.assertEquals(["ip", "uname.os"], report.fields())
+        report.add(scanned_job("10.0.0.1"))
+        self.assertEquals("10.0.0.1,Linux", report.format % report.ips["10.0.0.1"])
+
+
+class MergeProfilesTests(unittest.TestCase):
+
+    def test_overlapping_ranges(self):
+        s = scanner.Scanner()
+        first = config.Group("first", ["10.0.0.0/30", "10.0.0.2 - 10.0.0.5"],
+                             [], ["22"])
+        second = config.Group("second", ["10.0.0.4 - 10.0.0.7"], [], ["22"])
+        all_sets, ip_sets, duplicates = s._merge_profiles([first, second])
+        self.assertEquals(["10.0.0.%s" % i for i in range(0, 6)],
+                          list(ip_sets[0]))
+        self.assertEquals(["10.0.0.6", "10.0.0.7"], list(ip_sets[1]))
+        # 10.0.0.2-3 within first, 10.0.0.4-5 across the two
+        self.assertEquals(4, duplicates)
+
+    def test_overlap_gets_both_profiles(self):
+        bob = config.SshCredentials({"name": "bob", "type": "ssh",
+                                     "username": "bob", "password": "x"})
+        alice = config.SshCredentials({"name": "alice", "type": "ssh",
+                                       "username": "alice", "password": "y"})
+        first = config.Group("first", ["10.0.0.0/31"], ["bob"], ["22"])
+        second = config.Group("second", ["10.0.0.1 - 10.0.0.2"],
+                              ["alice", "bob"], ["22", "2222"])
+        s = scanner.Scanner(config.Config(credentials=[bob, alice],
+                                          groups=[first, second]))
+        jobs = []
+        s.run_scan = lambda: jobs.extend(s.ssh_jobs.ssh_jobs)
+        s.report = lambda: None
+        s.scan_profiles(["first", "second"])
+
+        self.assertEquals(["10.0.0.0", "10.0.0.1", "10.0.0.2"],
+                          [job.ip for job in jobs])
+        self.assertEquals([22], jobs[0].ports)
+        self.assertEquals([bob], jobs[0].auths)
+        self.assertEquals([22, 2222], jobs[1].ports)
+        self.assertEquals([bob, alice], jobs[1].auths)
+        self.assertEquals([22, 2222], jobs[2].ports)
+
+    def test_jobs(self):
+        s = scanner.Scanner()
+        profile = config.Group("p", ["10.0.0.1", "10.0.0.0/31"], [], ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        self.assertEquals(["10.0.0.0", "10.0.0.1"], ips)
+
+    def test_hostnames(self):
+        s = scanner.Scanner()
+        s.resolver = resolver.Resolver(gethostbyname={
+            "a.example.com": "10.0.0.1", "b.example.com": "10.0.0.9"}.get)
+        profile = config.Group("p", ["10.0.0.0/30", "a.example.com",
+                                     "b.example.com", "nowhere.example.com"],
+                               [], ["22"])
+        ips = [job.ip for job in s._gen_ssh_jobs(profile, [])]
+        self.assertEquals(["10.0.0.%s" % i for i in range(0, 4)] +
+                          ["10.0.0.9"], ips)
+        self.assertEquals(1, s.ssh_jobs.report.duplicates)
+        self.assertEquals(1, s.ssh_jobs.report.unresolved)
+
+    def test_ranges_scanned_during_lookups(self):
+        answer = threading.Event()
+
+        def gethostbyname(hostname):
+            answer.wait()
+            return "10.0.0.9"
+        s = scanner.Scanner()
+        s.resolver = resolver.Resolver(gethostbyname=gethostbyname)
+        profile = config.Group("p", ["10.0.0.0/31", "a.example.com"], [],
+                               ["22"])
+        jobs = s._gen_ssh_jobs(profile, [])
+        self.assertEquals("10.0.0.0", jobs.next().ip)
+        self.assertEquals("10.0.0.1", jobs.next().ip)
+        answer.set()
+        self.assertEquals(["10.0.0.9"], [job.ip for job in jobs])
+
+    def test_hostname_in_later_profile(self):
+        s = scanner.Scanner(config.Config(groups=[
+            config.Group("first", ["10.0.0.0/31", "b.example.com"], [],
+                         ["22"]),
+            config.Group("second", ["10.0.0.8/31", "a.example.com"], [],
+                         ["2222"])]))
+        s.resolver = resolver.Resolver(gethostbyname={
+            "a.example.com": "10.0.0.1", "b.example.com": "10.0.0.9"}.get)
+        # answered before the scan, rather than as it goes
+        list(s.resolver.resolve(["a.example.com", "b.example.com"]))
+        jobs = []
+        s.run_scan = lambda: jobs.extend(s.ssh_jobs.ssh_jobs)
+        s.report = lambda: None
+        s.scan_profiles(["first", "second"])
+
+        # each ip with the first profile that has it, by range or hostname
+        self.assertEquals(["10.0.0.0", "10.0.0.1", "10.0.0.9", "10.0.0.8"],
+                          [job.ip for job in jobs])
+        self.assertEquals([22, 2222], jobs[1].ports)
+        self.assertEquals([22, 2222], jobs[2].ports)
+        self.assertEquals([2222], jobs[3].ports)
+        self.assertEquals(2, s.ssh_jobs.report.duplicates)
@@ -0,0 +1,109 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for writing report rows as hosts finish """
+
+import csv
+import gettext
+import StringIO
+import sys
+import unittest
+
+import simplejson as json
+
+from rho import scanner
+from rho import sinks
+
+from scanner_tests import scanned_job
+
+gettext.install('rho')
+
+FIELDS = ["ip", "uname.os", "uname.hostname"]
+
+
+class SinkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO.StringIO()
+
+    def test_csv_escaped(self):
+        sink = sinks.CsvSink(self.out, FIELDS)
+        sink.write({"ip": "10.0.0.1", "uname.os": 'Linux, "mostly"',
+                    "uname.hostname": u"caf\xe9"})
+        sink.close()
+        rows = list(csv.reader(StringIO.StringIO(self.out.getvalue())))
+        self.assertEquals([FIELDS,
+                           ["10.0.0.1", 'Linux, "mostly"', "caf\xc3\xa9"]],
+                          rows)
+
+    def test_csv_missing_fields(self):
+        sink = sinks.CsvSink(self.out, FIELDS)
+        sink.write({"ip": "10.0.0.1"})
+        self.assertEquals("ip,uname.os,uname.hostname\r\n10.0.0.1,,\r\n",
+                          self.out.getvalue())
+
+    def test_csv_header_without_rows(self):
+        sink = sinks.CsvSink(self.out, FIELDS)
+        sink.close()
+        self.assertEquals("ip,uname.os,uname.hostname\r\n",
+                          self.out.getvalue())
+
+    def test_json_lines(self):
+        sink = sinks.JsonLinesSink(self.out, FIELDS)
+        sink.write({"ip": "10.0.0.1", "uname.os": "Linux",
+                    "auth.password": "sekurity"})
+        sink.write({"ip": "10.0.0.2"})
+        lines = self.out.getvalue().splitlines()
+        self.assertEquals({"ip": "10.0.0.1", "uname.os": "Linux",
+                           "uname.hostname": ""}, json.loads(lines[0]))
+        self.assertEquals({"ip": "10.0.0.2", "uname.os": "",
+                           "uname.hostname": ""}, json.loads(lines[1]))
+
+
+class StreamingReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO.StringIO()
+        self.report = scanner.ScanReport()
+        self.stdout = sys.stdout
+        self.stderr = sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+
+    def test_rows_not_kept(self):
+        self.report.keep_rows = False
+        self.report.sinks.append(sinks.CsvSink(self.out,
+                                               self.report.fields()))
+        self.report.add(scanned_job("10.0.0.1"))
+        self.assertEquals({}, self.report.ips)
+        lines = self.out.getvalue().splitlines()
+        self.assertEquals(2, len(lines))
+        self.assertTrue(lines[1].startswith("10.0.0.1,22,Linux,"))
+
+    def test_summary_out_of_the_way(self):
+        self.report.keep_rows = False
+        self.report.sinks.append(sinks.JsonLinesSink(self.out,
+                                                     self.report.fields()))
+        self.report.set_summary("concurrency", 4)
+        self.report.report()
+        self.assertEquals("", sys.stdout.getvalue())
+        self.assertEquals("# concurrency: 4\n", sys.stderr.getvalue())
+
+    def test_missing_fields_printed_empty(self):
+        # no redhat-release results
+        self.report.add(scanned_job("10.0.0.1"))
+        self.report.report()
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertTrue(lines[-1].endswith("x86_64,,,,ssh,bob,bobslogin"))
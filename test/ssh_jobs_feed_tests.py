@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for how SshJobs feeds jobs to the engines """
+
+import gettext
+import unittest
+
+from rho import ssh_jobs
+from rho import ssh_loop
+
+from fixtures import closed_port
+
+gettext.install('rho')
+
+
+class CountingSshJob(ssh_jobs.SshJob):
+    finished = 0
+
+    def output_callback(self):
+        CountingSshJob.finished = CountingSshJob.finished + 1
+
+
+class SshJobsFeedTests(unittest.TestCase):
+    engine = "threads"
+
+    def setUp(self):
+        CountingSshJob.finished = 0
+        self.jobs = ssh_jobs.SshJobs()
+        self.jobs.engine = self.engine
+        self.jobs.max_threads = 2
+        self.jobs.concurrency = 2
+        self.max_lead = 0
+
+    def _gen_jobs(self, number):
+        port = closed_port()
+        auths = [ssh_jobs.SshAuth(name="nobody", username="nobody")]
+        for i in range(number):
+            # how far ahead of the finished jobs are we being read?
+            self.max_lead = max(self.max_lead, i - CountingSshJob.finished)
+            yield CountingSshJob(ip="127.0.0.1", port=port, rho_cmds=[],
+                                 auths=auths)
+
+    def test_all_jobs_run(self):
+        out_queue = self.jobs.run_jobs(ssh_jobs=self._gen_jobs(30))
+        out_queue.join()
+        self.assertEquals(30, CountingSshJob.finished)
+
+    def test_jobs_read_lazily(self):
+        out_queue = self.jobs.run_jobs(ssh_jobs=self._gen_jobs(30))
+        out_queue.join()
+        # queued + running + the one being put
+        self.assertTrue(self.max_lead <= 5)
+
+
+class SshJobsFeedEventsTests(SshJobsFeedTests):
+    engine = "events"
+
+
+class SweepConcurrencyTests(unittest.TestCase):
+
+    def test_concurrency_not_threads(self):
+        jobs = ssh_jobs.SshJobs()
+        jobs.engine = "threads"
+        jobs.max_threads = 2
+        jobs.sweep_timeout = 1
+        out_queue = jobs.run_jobs(ssh_jobs=[])
+        out_queue.join()
+        self.assertEquals(ssh_loop.DEFAULT_CONCURRENCY, jobs.limiter.limit)
+        self.assertEquals(2, jobs.ssh_connect_queue.max_threads)
+
+        jobs.concurrency = 50
+        out_queue = jobs.run_jobs(ssh_jobs=[])
+        out_queue.join()
+        self.assertEquals(50, jobs.limiter.limit)
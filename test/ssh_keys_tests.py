@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for parsing and caching credential private keys """
+
+import gettext
+import os
+import StringIO
+import unittest
+
+import paramiko
+
+from rho import config
+from rho import my_sshpt
+from rho import ssh_keys
+
+gettext.install('rho')
+
+
+def key_text(key, passphrase=None):
+    f = StringIO.StringIO()
+    key.write_private_key(f, passphrase)
+    return f.getvalue()
+
+
+def key_auth(key, passphrase=""):
+    return config.SshKeyCredentials({"name": "key", "type": "ssh_key",
+                                     "username": "bob", "key": key,
+                                     "password": passphrase})
+
+
+class KeyCacheTests(unittest.TestCase):
+
+    rsa = paramiko.RSAKey.generate(1024)
+    dss = paramiko.DSSKey.generate(1024)
+
+    def setUp(self):
+        self.cache = ssh_keys.KeyCache()
+
+    def test_rsa(self):
+        pkey = self.cache.get(key_auth(key_text(self.rsa)))
+        self.assertEquals(self.rsa, pkey)
+
+    def test_dss(self):
+        pkey = self.cache.get(key_auth(key_text(self.dss)))
+        self.assertEquals(self.dss, pkey)
+
+    def test_passphrase(self):
+        pkey = self.cache.get(key_auth(key_text(self.rsa, "sekrit"), "sekrit"))
+        self.assertEquals(self.rsa, pkey)
+
+    def test_parsed_once(self):
+        auth = key_auth(key_text(self.rsa))
+        self.assertTrue(self.cache.get(auth) is self.cache.get(auth))
+
+    def test_missing_passphrase(self):
+        auth = key_auth(key_text(self.rsa, "sekrit"))
+        self.assertRaises(paramiko.PasswordRequiredException,
+                          self.cache.get, auth)
+        # and again from the cache
+        self.assertRaises(paramiko.PasswordRequiredException,
+                          self.cache.get, auth)
+
+    def test_not_a_key(self):
+        self.assertRaises(paramiko.SSHException, self.cache.get,
+                          key_auth("not a key"))
+
+
+class RecordingTransport:
+
+    def __init__(self):
+        self.tried = []
+
+    def auth_publickey(self, username, key):
+        self.tried.append(("publickey", username))
+        raise paramiko.AuthenticationException("no")
+
+    def auth_password(self, username, password):
+        self.tried.append(("password", username, password))
+        raise paramiko.AuthenticationException("no")
+
+
+class AuthTransportTests(unittest.TestCase):
+
+    def setUp(self):
+        # no agent keys, only what we give it
+        self.agent = os.environ.pop("SSH_AUTH_SOCK", None)
+
+    def tearDown(self):
+        if self.agent is not None:
+            os.environ["SSH_AUTH_SOCK"] = self.agent
+
+    def test_passphrase_not_sent(self):
+        transport = RecordingTransport()
+        auth = key_auth("key text", "sekrit")
+        self.assertRaises(paramiko.AuthenticationException,
+                          my_sshpt.authTransport, transport, auth,
+                          KeyCacheTests.rsa)
+        self.assertEquals([("publickey", "bob")], transport.tried)
+
+    def test_password_sent(self):
+        transport = RecordingTransport()
+        auth = config.SshCredentials({"name": "pw", "type": "ssh",
+                                      "username": "bob", "password": "pw"})
+        self.assertRaises(paramiko.AuthenticationException,
+                          my_sshpt.authTransport, transport, auth)
+        self.assertEquals([("password", "bob", "pw")], transport.tried)
@@ -0,0 +1,216 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for the event loop scan engine """
+
+import gettext
+import socket
+import threading
+import time
+import unittest
+import Queue
+
+from rho import concurrency
+from rho import deadlines
+from rho import ssh_jobs
+from rho import ssh_loop
+
+from fixtures import closed_port
+
+gettext.install('rho')
+
+
+class FakeSshd(threading.Thread):
+    """ Accepts connections on localhost, optionally sends a banner. """
+
+    def __init__(self, banner="SSH-2.0-OpenSSH_5.1\r\n"):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.banner = banner
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.clients = []
+
+    def run(self):
+        while True:
+            client, addr = self.sock.accept()
+            self.clients.append(client)
+            if self.banner:
+                client.send(self.banner)
+
+
+class SshEventLoopTests(unittest.TestCase):
+
+    def setUp(self):
+        self.output_queue = Queue.Queue()
+        self.loop = ssh_loop.SshEventLoop(self.output_queue,
+                concurrency.ConcurrencyLimiter(5))
+        self.loop.ssh_connect_queue = Queue.Queue()
+        self.loop.start()
+
+    def tearDown(self):
+        self.loop.quit()
+        self.loop.join()
+
+    def _job(self, port, timeout=5, ports=None):
+        job = ssh_jobs.SshJob(ip="127.0.0.1", port=port, rho_cmds=[],
+                              auths=[], timeout=timeout, ports=ports)
+        job.set_timeout(deadlines.BANNER, timeout)
+        return job
+
+    def test_banner_hands_off_socket(self):
+        sshd = FakeSshd()
+        sshd.start()
+        job = self._job(sshd.port)
+        self.loop.add(job)
+
+        handed = self.loop.ssh_connect_queue.get(timeout=5)
+        self.assertTrue(handed is job)
+        # the banner was only peeked at, paramiko still gets to read it
+        self.assertEquals("SSH-2.0-OpenSSH_5.1\r\n", job.sock.recv(256))
+        self.assertEquals(1, self.loop.limiter.in_use)
+
+        self.loop.job_done(job)
+        self.loop.wait()
+        job.sock.close()
+
+    def test_refused(self):
+        job = self._job(closed_port())
+        self.loop.add(job)
+
+        failed = self.output_queue.get(timeout=5)
+        self.assertTrue(failed is job)
+        self.assertEquals("FAILED", job.connection_result)
+        self.assertTrue(job.sock is None)
+        self.loop.wait()
+
+    def test_no_banner_times_out(self):
+        sshd = FakeSshd(banner=None)
+        sshd.start()
+        job = self._job(sshd.port, timeout=1)
+        self.loop.add(job)
+
+        failed = self.output_queue.get(timeout=5)
+        self.assertEquals("FAILED", failed.connection_result)
+        self.assertEquals(_("timed out waiting for ssh banner"),
+                          failed.command_output)
+        self.assertEquals(deadlines.BANNER, failed.timed_out)
+        self.assertTrue(self.loop.ssh_connect_queue.empty())
+        self.loop.wait()
+
+    def test_first_port_with_banner_wins(self):
+        sshd = FakeSshd()
+        sshd.start()
+        silent = FakeSshd(banner=None)
+        silent.start()
+        job = self._job(None, ports=[closed_port(), silent.port, sshd.port])
+        self.loop.add(job)
+
+        handed = self.loop.ssh_connect_queue.get(timeout=5)
+        self.assertTrue(handed is job)
+        self.assertEquals(sshd.port, job.port)
+        job.sock.close()
+        self.loop.job_done(job)
+        self.loop.wait()
+
+    def test_all_ports_fail(self):
+        silent = FakeSshd(banner=None)
+        silent.start()
+        job = self._job(None, timeout=1, ports=[closed_port(), silent.port])
+        self.loop.add(job)
+
+        failed = self.output_queue.get(timeout=5)
+        self.assertEquals("FAILED", failed.connection_result)
+        # the port that connected explains more than the refused one
+        self.assertEquals(_("timed out waiting for ssh banner"),
+                          failed.command_output)
+        self.loop.wait()
+
+    def test_lots(self):
+        port = closed_port()
+        for i in range(20):
+            self.loop.add(self._job(port))
+        self.loop.wait()
+        self.assertEquals(20, self.output_queue.qsize())
+
+
+class ProbePortsTests(unittest.TestCase):
+
+    def test_banner_wins(self):
+        sshd = FakeSshd()
+        sshd.start()
+        silent = FakeSshd(banner=None)
+        silent.start()
+        job = ssh_jobs.SshJob(ip="127.0.0.1", rho_cmds=[],
+                              ports=[silent.port, closed_port(), sshd.port])
+        sock = ssh_loop.probe_ports(job, 5)
+        self.assertEquals(sshd.port, job.port)
+        self.assertEquals("SSH-2.0-OpenSSH_5.1\r\n", sock.recv(256))
+        sock.close()
+
+    def test_none_answer(self):
+        silent = FakeSshd(banner=None)
+        silent.start()
+        job = ssh_jobs.SshJob(ip="127.0.0.1", rho_cmds=[],
+                              ports=[silent.port, closed_port()])
+        self.assertRaises(socket.error, ssh_loop.probe_ports, job, 0.5)
+
+
+class SweepTests(SshEventLoopTests):
+    """ The same loop used as a plain tcp sweep """
+
+    def setUp(self):
+        self.output_queue = Queue.Queue()
+        self.loop = ssh_loop.SshEventLoop(self.output_queue,
+                concurrency.ConcurrencyLimiter(5), connect_timeout=1,
+                wait_for_banner=False)
+        self.loop.ssh_connect_queue = Queue.Queue()
+        self.loop.start()
+
+    def test_no_banner_times_out(self):
+        # nothing to wait for, the socket is handed over once connected
+        sshd = FakeSshd(banner=None)
+        sshd.start()
+        job = self._job(sshd.port)
+        self.loop.add(job)
+
+        handed = self.loop.ssh_connect_queue.get(timeout=5)
+        self.assertTrue(handed is job)
+        self.assertTrue(job.sock is not None)
+        job.sock.close()
+        self.loop.job_done(job)
+        self.loop.wait()
+
+    def test_no_more_than_threads(self):
+        self.loop.threads = 1
+        sshd = FakeSshd(banner=None)
+        sshd.start()
+        self.loop.add(self._job(sshd.port))
+        self.loop.add(self._job(sshd.port))
+
+        first = self.loop.ssh_connect_queue.get(timeout=5)
+        # the other one connects too, but isn't left holding its socket
+        # until the thread is free
+        end = time.time() + 5
+        while not self.loop.ready and time.time() < end:
+            time.sleep(0.01)
+        self.assertEquals(1, len(self.loop.ready))
+        self.assertTrue(self.loop.ssh_connect_queue.empty())
+
+        first.sock.close()
+        self.loop.job_done(first)
+        second = self.loop.ssh_connect_queue.get(timeout=5)
+        self.assertTrue(second is not first)
+        self.assertTrue(second.sock is None)
+        self.loop.job_done(second)
+        self.loop.wait()
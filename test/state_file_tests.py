@@ -0,0 +1,52 @@
+#
+# Copyright (c) 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+""" Tests for the files rho keeps its state in """
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from rho import state_file
+
+
+class StateFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "state", "hosts.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        state_file.save(self.path, {"10.0.0.1": {"ok": 5}})
+        self.assertEquals({"10.0.0.1": {"ok": 5}}, state_file.load(self.path))
+        self.assertEquals(0600, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertFalse(os.path.exists("%s.tmp" % self.path))
+
+    def test_save_items(self):
+        items = (("10.0.0.%d" % i, {"ok": i}) for i in range(3))
+        state_file.save_items(self.path, items)
+        self.assertEquals({"10.0.0.0": {"ok": 0}, "10.0.0.1": {"ok": 1},
+                           "10.0.0.2": {"ok": 2}}, state_file.load(self.path))
+
+    def test_missing(self):
+        self.assertEquals({}, state_file.load(self.path))
+
+    def test_corrupt(self):
+        os.makedirs(os.path.dirname(self.path))
+        f = open(self.path, "w")
+        f.write("{not json")
+        f.close()
+        self.assertEquals({}, state_file.load(self.path))